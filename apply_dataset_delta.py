@@ -0,0 +1,92 @@
+"""
+Применение дельта-архива датасета на стороне клиента.
+
+Пример:
+    python apply_dataset_delta.py --dataset ./dataset --url http://server:8000
+    python apply_dataset_delta.py --dataset ./dataset --archive dataset_delta_3_5.zip
+
+Версия полного архива приходит в заголовке X-Dataset-Version ответа /download-dataset —
+после распаковки полного архива запишите её в <dataset>/.dataset_version.
+"""
+from pathlib import Path
+import urllib.request
+import argparse
+import tempfile
+import zipfile
+import shutil
+import json
+import os
+
+VERSION_FILE = ".dataset_version"
+DELTA_MANIFEST = "delta.json"
+
+
+def read_local_version(dataset_dir):
+    path = os.path.join(dataset_dir, VERSION_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        return int(f.read().strip() or 0)
+
+
+def download_delta(url, since, out_path):
+    request_url = f"{url.rstrip('/')}/download-dataset?since={since}"
+    print(f"Скачиваем дельту: {request_url}")
+    with urllib.request.urlopen(request_url) as response, open(out_path, "wb") as f:
+        shutil.copyfileobj(response, f, 1024 * 1024)
+
+
+def apply_delta(archive_path, dataset_dir, force=False):
+    dataset_root = Path(dataset_dir).resolve()
+    with zipfile.ZipFile(archive_path) as zf:
+        manifest = json.loads(zf.read(DELTA_MANIFEST).decode("utf-8"))
+        local_version = read_local_version(dataset_dir)
+        if local_version != manifest["from"] and not force:
+            raise SystemExit(f"Локальная версия {local_version}, а дельта рассчитана от {manifest['from']}. "
+                             f"Используйте --force или скачайте полный архив.")
+
+        # Пути проверяются все заранее: подозрительная дельта не должна удалить ничего
+        to_remove = []
+        for name in manifest["removed"]:
+            target = (dataset_root / name).resolve()
+            if dataset_root not in target.parents:
+                raise SystemExit(f"Подозрительный путь в списке удалений: {name}")
+            to_remove.append(target)
+        for target in to_remove:
+            if target.is_file():
+                target.unlink()
+
+        for member in zf.infolist():
+            if member.filename == DELTA_MANIFEST:
+                continue
+            target = (dataset_root / member.filename).resolve()
+            if dataset_root not in target.parents:
+                raise SystemExit(f"Подозрительный путь в архиве: {member.filename}")
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with zf.open(member) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    with open(os.path.join(dataset_dir, VERSION_FILE), "w", encoding="utf-8") as f:
+        f.write(str(manifest["to"]))
+    print(f"Датасет обновлён {manifest['from']} → {manifest['to']}: "
+          f"добавлено {len(manifest['added'])}, удалено {len(manifest['removed'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Применить дельта-архив датасета")
+    parser.add_argument("--dataset", required=True, help="Локальная папка датасета")
+    parser.add_argument("--archive", help="Готовый дельта-архив (dataset_delta_<from>_<to>.zip)")
+    parser.add_argument("--url", help="Адрес API, откуда скачать дельту от локальной версии")
+    parser.add_argument("--force", action="store_true", help="Применить, даже если версии не совпадают")
+    args = parser.parse_args()
+
+    os.makedirs(args.dataset, exist_ok=True)
+    if args.archive:
+        apply_delta(args.archive, args.dataset, force=args.force)
+    elif args.url:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive = os.path.join(tmp_dir, "delta.zip")
+            download_delta(args.url, read_local_version(args.dataset), archive)
+            apply_delta(archive, args.dataset, force=args.force)
+    else:
+        parser.error("Нужен --archive или --url")
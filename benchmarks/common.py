@@ -0,0 +1,92 @@
+"""Общие помощники бенчмарков: замеры времени/памяти/syscalls и запись результатов в JSON."""
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+def _proc_io():
+    """Число read/write syscalls процесса из /proc/self/io (Linux); без /proc — пустой словарь."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            data = dict(line.split(": ") for line in f.read().splitlines())
+        return {"syscr": int(data["syscr"]), "syscw": int(data["syscw"])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def timed(fn, *args, **kwargs):
+    """(результат, {"wall": сек, "cpu": сек}) — замер в текущем процессе."""
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    result = fn(*args, **kwargs)
+    return result, {"wall": round(time.perf_counter() - started, 4),
+                    "cpu": round(time.process_time() - cpu_started, 4)}
+
+
+def _child(fn, args, kwargs, setup, queue):
+    if setup is not None:
+        setup()
+    io_before = _proc_io()
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        result, timing = timed(fn, *args, **kwargs)
+        error = None
+    except Exception as e:
+        result, timing, error = None, {}, repr(e)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    io_after = _proc_io()
+    stats = dict(timing)
+    # ru_maxrss в Linux — КиБ; пик относится ко всему дочернему процессу
+    stats["peak_rss_mb"] = round(usage.ru_maxrss / 1024, 1)
+    stats["syscalls_read"] = io_after.get("syscr", 0) - io_before.get("syscr", 0) if io_before else None
+    stats["syscalls_write"] = io_after.get("syscw", 0) - io_before.get("syscw", 0) if io_before else None
+    stats["ctx_switches"] = (usage.ru_nvcsw + usage.ru_nivcsw) - (usage_before.ru_nvcsw + usage_before.ru_nivcsw)
+    stats["minor_faults"] = usage.ru_minflt - usage_before.ru_minflt
+    queue.put((result, stats, error))
+
+
+def measure_isolated(fn, *args, setup=None, **kwargs):
+    """
+    Выполняет fn в отдельном (fork) процессе, чтобы пик RSS и счётчики syscalls
+    относились только к этому замеру. setup() выполняется в том же процессе до замера
+    (например, импорт модулей). Возвращает (результат, статистика).
+    """
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(fn, args, kwargs, setup, queue))
+    proc.start()
+    result, stats, error = queue.get()
+    proc.join()
+    if error:
+        stats["error"] = error
+    return result, stats
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "commit": commit, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def write_results(out_path, suite, results, params=None):
+    """Пишет машиночитаемый отчёт {suite, env, params, results} для отслеживания регрессий."""
+    report = {"suite": suite, "env": environment_info(), "params": params or {}, "results": results}
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Результаты записаны в {out_path}")
+    return report
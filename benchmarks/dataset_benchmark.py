@@ -0,0 +1,163 @@
+"""
+Микробенчмарки датасета на больших масштабах: сборка, анализ и упаковка.
+
+Для каждого масштаба (по умолчанию 10k, 100k и 1M файлов) генерирует исходные кадры и
+фейковые задачи Label Studio, собирает датасет split/class_N через build_classification_dataset
+и замеряет analyze_classification_dataset, check_dataset_duplicates, _need_rebuild
+(быстрый путь по отпечатку и полный обход) и упаковку ZIP (с нуля и дозапись 1% новых файлов).
+
+Каждый замер выполняется в отдельном процессе: файлов/с, wall/CPU, пик RSS,
+read/write syscalls (/proc/self/io), переключения контекста. Нужен только Linux и стандартная библиотека.
+
+Пример:
+    python -m benchmarks.dataset_benchmark --scales 10000,100000 --out dataset_bench.json
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import uuid
+from pathlib import Path
+
+from benchmarks.common import measure_isolated, timed, write_results
+
+FRAMES_PER_VIDEO = 100
+REMOTE_FRAME_DIR = "Tracker/annotation_frames"
+# Маленький, но настоящий по сигнатуре JPEG: содержимое для бенчмарка не важно
+_FAKE_JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 1020 + b"\xff\xd9"
+
+
+def frame_name(index):
+    return f"K{index // FRAMES_PER_VIDEO:06d}AX702_2025.5.1 8.0.0-8.1.0_{index % FRAMES_PER_VIDEO:06d}.jpg"
+
+
+def generate_sources(src_dir, start, count):
+    os.makedirs(src_dir, exist_ok=True)
+    for i in range(start, start + count):
+        with open(os.path.join(src_dir, frame_name(i)), "wb") as f:
+            f.write(_FAKE_JPEG)
+
+
+def fake_tasks(start, count, classes):
+    return [{"id": i + 1,
+             "data": {"image": f"/data/local-files/?d={REMOTE_FRAME_DIR}/{frame_name(i)}"},
+             "annotations": [{"created_at": "2025-01-01T00:00:00",
+                              "result": [{"value": {"choices": [f"class_{(i // FRAMES_PER_VIDEO) % classes}"]}}]}]}
+            for i in range(start, start + count)]
+
+
+# ---- Замеры (выполняются в дочернем процессе) ----
+
+def import_pipeline():
+    """Импорт модулей пайплайна — до начала замера, чтобы не считать его время."""
+    from ls_wb_pipeline import build_dataset_cls  # noqa: F401
+    from ls_wb_pipeline.fastapi_app import services  # noqa: F401
+
+
+def bench_build(tasks):
+    from ls_wb_pipeline import build_dataset_cls
+    build_dataset_cls.build_classification_dataset(tasks)
+    return {"files": len(tasks)}
+
+
+def bench_analyze(dataset_dir):
+    from ls_wb_pipeline import build_dataset_cls
+    result = build_dataset_cls.analyze_classification_dataset(dataset_dir)
+    return {"files": result.get("total")}
+
+
+def bench_duplicates(dataset_dir):
+    from ls_wb_pipeline.dataset_checker import check_dataset_duplicates
+    return {"ok": check_dataset_duplicates(dataset_dir)["ok"]}
+
+
+def bench_zip_build(dataset_dir):
+    from ls_wb_pipeline.fastapi_app import services
+    task_id = uuid.uuid4().hex
+    services.task_store.get_task_store().create(task_id, {"status": "queued", "progress": 0})
+    services._zip_build_worker(task_id, Path(dataset_dir))
+    task = services.task_store.get_task_store().get(task_id)
+    return {"status": task.get("status"), "result": task.get("result"), "error": task.get("error")}
+
+
+def bench_need_rebuild(dataset_dir):
+    from ls_wb_pipeline.fastapi_app import services
+    return {"need_rebuild": services._need_rebuild(Path(dataset_dir), services._ARCHIVE_PATH, services._META_PATH)}
+
+
+def bench_full_scan(dataset_dir):
+    """Медленный путь _need_rebuild: полный обход дерева и сравнение с манифестом."""
+    from ls_wb_pipeline.fastapi_app import services
+    snapshot = services._scan_dataset(Path(dataset_dir))
+    mode, _ = services._zip_update_plan(snapshot, services._ARCHIVE_PATH, services._META_PATH,
+                                        services._MANIFEST_PATH)
+    return {"files": len(snapshot), "mode": mode}
+
+
+def _run(name, files, fn, *args):
+    result, stats = measure_isolated(fn, *args, setup=import_pipeline)
+    stats["files_per_s"] = round(files / stats["wall"], 1) if stats.get("wall") else None
+    stats["result"] = result
+    print(f"  {name:24} {stats.get('wall', '-'):>9}s  {stats['files_per_s'] or '-':>12} files/s  "
+          f"rss {stats['peak_rss_mb']} MB")
+    return stats
+
+
+def run_scale(workdir, files, classes, append_ratio):
+    from ls_wb_pipeline import settings
+
+    src_dir = settings.MOUNTED_PATH
+    for path in (settings.MOUNTED_PATH, settings.DATASET_PATH, settings.DATASET_ARCHIVE_DIR):
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(settings.DATASET_ARCHIVE_DIR, exist_ok=True)
+
+    print(f"Масштаб: {files} файлов")
+    result = {"files": files, "classes": classes}
+    _, result["generate_sources"] = timed(generate_sources, src_dir, 0, files)
+    tasks = fake_tasks(0, files, classes)
+    dataset_dir = settings.DATASET_PATH
+
+    result["build_classification_dataset"] = _run("build", files, bench_build, tasks)
+    result["analyze_classification_dataset"] = _run("analyze", files, bench_analyze, dataset_dir)
+    result["check_dataset_duplicates"] = _run("duplicates", files, bench_duplicates, dataset_dir)
+    result["zip_build"] = _run("zip build", files, bench_zip_build, dataset_dir)
+    result["need_rebuild_fingerprint"] = _run("need_rebuild (fingerprint)", files, bench_need_rebuild, dataset_dir)
+    result["need_rebuild_full_scan"] = _run("need_rebuild (full scan)", files, bench_full_scan, dataset_dir)
+
+    extra = max(1, int(files * append_ratio))
+    generate_sources(src_dir, files, extra)
+    result["build_append"] = _run("build (append)", extra, bench_build, fake_tasks(0, files + extra, classes))
+    result["zip_append"] = _run("zip append", extra, bench_zip_build, dataset_dir)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки датасета: сборка, анализ, упаковка")
+    parser.add_argument("--scales", default="10000,100000,1000000", help="Число файлов, через запятую")
+    parser.add_argument("--classes", type=int, default=4, help="Число классов")
+    parser.add_argument("--append-ratio", type=float, default=0.01, help="Доля файлов для замера дозаписи")
+    parser.add_argument("--workdir", help="Рабочая папка (по умолчанию временная); нужно место под ~2 ГБ на 1M")
+    parser.add_argument("--out", default="dataset_benchmark.json", help="Куда записать JSON с результатами")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="ls_bench_dataset_"))
+    from ls_wb_pipeline import settings
+    # settings настраиваются до импорта модулей пайплайна — дочерние процессы наследуют их через fork
+    settings.MOUNTED_PATH = str(workdir / "frames")
+    settings.DATASET_PATH = str(workdir / "dataset")
+    settings.DATASET_ARCHIVE_DIR = str(workdir / "dataset_archives")
+    # services тянет functions, который создаёт клиент WebDAV при импорте; сеть бенчмарку не нужна
+    os.environ.setdefault("webdav_host", "http://127.0.0.1")
+
+    results = []
+    try:
+        for files in (int(x) for x in args.scales.split(",") if x.strip()):
+            results.append(run_scale(workdir, files, args.classes, args.append_ratio))
+    finally:
+        write_results(args.out, "dataset", results, params=vars(args))
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
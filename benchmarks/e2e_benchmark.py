@@ -0,0 +1,357 @@
+"""
+Офлайн-бенчмарк пайплайна целиком: локальный WebDAV (wsgidav) и заглушка Label Studio API.
+
+Генерирует синтетические видео регистраторов в раскладке <reg>/<day>/<base>/ с report.json,
+затем замеряет process_video_loop, синхронизацию хранилища, get_all_tasks,
+build_classification_dataset, _zip_build_worker и очистку на нескольких масштабах.
+
+Пример:
+    python -m benchmarks.e2e_benchmark --scales 2,8 --latency-ms 20 --bandwidth-mbit 200 --out e2e.json
+
+Нужны wsgidav и cheroot (pip install wsgidav cheroot). rclone не используется: вместо
+смонтированной папки build_classification_dataset читает кадры прямо из корня WebDAV.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+from benchmarks.common import timed, write_results
+
+BASE_REMOTE_DIR = "/Tracker/Видео выгрузок"
+REMOTE_FRAME_DIR = "/Tracker/annotation_frames"
+CLASSES = ("empty", "half", "full", "overload")
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ---- Синтетические данные ----
+
+def make_video(path, seconds, fps=25, size=(640, 360)):
+    """Шум + движущийся прямоугольник: кодек не может сжать кадры до нуля."""
+    import cv2
+    import numpy as np
+
+    width, height = size
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    rng = np.random.default_rng(zlib.crc32(str(path).encode("utf-8")))
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for i in range(int(seconds * fps)):
+        frame = base.copy()
+        x = (i * 7) % (width - 80)
+        cv2.rectangle(frame, (x, 100), (x + 80, 220), (0, 0, 255), -1)
+        writer.write(frame)
+    writer.release()
+
+
+def generate_videos(webdav_root, count, seconds):
+    """count видео в раскладке BASE_REMOTE_DIR/<reg>/<day>/<base>/<base>.mp4 + report.json."""
+    videos = []
+    for i in range(count):
+        reg = f"K{100 + i % 7}AX702"
+        day = f"2025.5.{1 + i % 28}"
+        start = f"8.{i % 60}.11"
+        base = f"{reg}_{day} {start}-8.{i % 60}.59"
+        video_dir = Path(webdav_root) / BASE_REMOTE_DIR.lstrip("/") / reg / day / base
+        video_dir.mkdir(parents=True, exist_ok=True)
+        make_video(video_dir / f"{base}.mp4", seconds)
+        switch = 23 if i % 3 else 22
+        (video_dir / "report.json").write_text(json.dumps({"switch_events": [{"switch": switch}]}))
+        videos.append(f"{base}.mp4")
+    return videos
+
+
+# ---- Локальный WebDAV ----
+
+class ThrottleMiddleware:
+    """Задержка на запрос и ограничение полосы для тел запросов и ответов."""
+
+    def __init__(self, app, latency, bandwidth):
+        self.app = app
+        self.latency = latency
+        self.bandwidth = bandwidth  # байт/с, 0 — без ограничения
+
+    def _throttle(self, size):
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+
+    def __call__(self, environ, start_response):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.bandwidth and "wsgi.input" in environ:
+            stream = environ["wsgi.input"]
+            middleware = self
+
+            class ThrottledInput:
+                def read(self, *args):
+                    data = stream.read(*args)
+                    middleware._throttle(len(data))
+                    return data
+
+                def readline(self, *args):
+                    return stream.readline(*args)
+
+                def __iter__(self):
+                    return iter(stream)
+
+            environ["wsgi.input"] = ThrottledInput()
+        body = self.app(environ, start_response)
+        if not self.bandwidth:
+            return body
+        return self._iter_throttled(body)
+
+    def _iter_throttled(self, body):
+        try:
+            for chunk in body:
+                self._throttle(len(chunk))
+                yield chunk
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+
+def start_webdav(root, latency, bandwidth):
+    try:
+        from cheroot import wsgi
+        from wsgidav.wsgidav_app import WsgiDAVApp
+    except ImportError:
+        raise SystemExit("Для бенчмарка нужен локальный WebDAV: pip install wsgidav cheroot")
+
+    port = _free_port()
+    app = WsgiDAVApp({
+        "host": "127.0.0.1", "port": port,
+        "provider_mapping": {"/": str(root)},
+        "simple_dc": {"user_mapping": {"*": True}},
+        "verbose": 0, "logging": {"enable": False},
+    })
+    server = wsgi.Server(("127.0.0.1", port), ThrottleMiddleware(app, latency, bandwidth), numthreads=16)
+    server.prepare()
+    threading.Thread(target=server.serve, daemon=True).start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+# ---- Заглушка Label Studio ----
+
+class FakeLabelStudio:
+    """
+    Минимум API, которым пользуется пайплайн: GET /api/tasks (пагинация),
+    DELETE /api/tasks/<id>, POST /api/storages/localfiles/<id>/sync.
+    Синхронизация заводит задачи на новые кадры в frames_dir; часть из них сразу «размечена».
+    """
+
+    def __init__(self, frames_dir, latency, annotated_ratio=0.7):
+        self.frames_dir = Path(frames_dir)
+        self.latency = latency
+        self.annotated_ratio = annotated_ratio
+        self.tasks = {}
+        self.known = set()
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.rng = random.Random(0)
+
+    def reset(self):
+        with self.lock:
+            self.tasks.clear()
+            self.known.clear()
+            self.next_id = 1
+
+    def sync(self):
+        with self.lock:
+            for name in sorted(os.listdir(self.frames_dir)):
+                if not name.endswith(".jpg") or name in self.known:
+                    continue
+                self.known.add(name)
+                task = {"id": self.next_id,
+                        "data": {"image": f"/data/local-files/?d={REMOTE_FRAME_DIR.lstrip('/')}/{name}"},
+                        "annotations": []}
+                if self.rng.random() < self.annotated_ratio:
+                    task["annotations"].append({"created_at": "2025-01-01T00:00:00",
+                                                "result": [{"value": {"choices": [self.rng.choice(CLASSES)]}}]})
+                self.tasks[self.next_id] = task
+                self.next_id += 1
+
+    def handler(self):
+        ls = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload=None):
+                body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                time.sleep(ls.latency)
+                url = urlparse(self.path)
+                if url.path != "/api/tasks":
+                    return self._reply(404, {"detail": "not found"})
+                query = parse_qs(url.query)
+                page = int(query.get("page", ["1"])[0])
+                page_size = int(query.get("page_size", ["100"])[0])
+                with ls.lock:
+                    ordered = [ls.tasks[k] for k in sorted(ls.tasks)]
+                chunk = ordered[(page - 1) * page_size: page * page_size]
+                self._reply(200, {"tasks": chunk, "total": len(ordered)})
+
+            def do_DELETE(self):
+                time.sleep(ls.latency)
+                task_id = int(self.path.rstrip("/").rsplit("/", 1)[-1])
+                with ls.lock:
+                    found = ls.tasks.pop(task_id, None)
+                self._reply(204 if found else 404)
+
+            def do_POST(self):
+                time.sleep(ls.latency)
+                if "/storages/" in self.path and self.path.endswith("/sync"):
+                    ls.sync()
+                    return self._reply(200, {"status": "completed"})
+                self._reply(404, {"detail": "not found"})
+
+        return Handler
+
+
+def start_label_studio(frames_dir, latency):
+    ls = FakeLabelStudio(frames_dir, latency)
+    port = _free_port()
+    server = ThreadingHTTPServer(("127.0.0.1", port), ls.handler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return ls, server, port
+
+
+# ---- Прогон ----
+
+def configure_pipeline(workdir, webdav_url, ls_port):
+    """Настраивает settings до импорта functions (он забирает их через import *)."""
+    from ls_wb_pipeline import settings
+
+    os.environ.update({"webdav_host": webdav_url, "webdav_login": "bench", "webdav_password": "bench",
+                       "labelstudio_token": "bench"})
+    settings.BASE_REMOTE_DIR = BASE_REMOTE_DIR
+    settings.REMOTE_FRAME_DIR = REMOTE_FRAME_DIR
+    settings.LOCAL_VIDEO_DIR = str(workdir / "videos_temp")
+    settings.FRAME_DIR_TEMP = str(workdir / "frames_temp")
+    settings.DOWNLOAD_HISTORY_FILE = str(workdir / "downloaded_videos.json")
+    settings.MOUNTED_PATH = str(workdir / "webdav" / REMOTE_FRAME_DIR.lstrip("/"))
+    settings.DATASET_PATH = str(workdir / "dataset")
+    settings.DATASET_ARCHIVE_DIR = str(workdir / "dataset_archives")
+    settings.LABELSTUDIO_HOST = "http://127.0.0.1"
+    settings.LABELSTUDIO_PORT = ls_port
+    settings.LABELSTUDIO_API_URL = f"http://127.0.0.1:{ls_port}/api"
+    settings.HEADERS = {"Authorization": "Token bench"}
+    settings.BLACKLISTED_REGISTRATORS = set()
+    for path in (settings.LOCAL_VIDEO_DIR, settings.FRAME_DIR_TEMP, settings.MOUNTED_PATH):
+        os.makedirs(path, exist_ok=True)
+
+    from ls_wb_pipeline import functions
+    # Вместо rclone-монтирования — локальный корень WebDAV, перемонтировать нечего
+    functions.remount_webdav = lambda *args, **kwargs: None
+    return functions
+
+
+def reset_state(workdir, functions, ls):
+    for name in ("webdav", "dataset", "videos_temp", "frames_temp"):
+        shutil.rmtree(workdir / name, ignore_errors=True)
+    for path in (functions.LOCAL_VIDEO_DIR, functions.FRAME_DIR_TEMP, functions.MOUNTED_PATH):
+        os.makedirs(path, exist_ok=True)
+    functions.downloaded_videos.clear()
+    ls.reset()
+
+
+def run_scale(workdir, functions, ls, videos, seconds, fps):
+    from ls_wb_pipeline import build_dataset_cls, metrics
+    from ls_wb_pipeline.fastapi_app import services
+
+    reset_state(workdir, functions, ls)
+    _, gen_timing = timed(generate_videos, workdir / "webdav", videos, seconds)
+    result = {"videos": videos, "video_seconds": seconds, "fps": fps, "generate": gen_timing}
+
+    def ingest():
+        with metrics.collect_timings() as stages:
+            report = functions.process_video_loop(max_frames=10 ** 9, fps=fps)
+        return report, stages
+
+    (report, stages), timing = timed(ingest)
+    # Когда видео кончаются, process_video_loop возвращает только {"error": ...} — считаем кадры в хранилище
+    frames = sum(1 for name in os.listdir(functions.MOUNTED_PATH) if name.endswith(".jpg"))
+    result["process_video_loop"] = dict(timing, frames=frames, stages=stages,
+                                        frames_per_s=round(frames / timing["wall"], 2) if timing["wall"] else None)
+
+    _, result["ls_sync"] = timed(functions.sync_label_studio_storage)
+    tasks, timing = timed(functions.get_all_tasks)
+    result["get_all_tasks"] = dict(timing, tasks=len(tasks or []))
+
+    _, timing = timed(build_dataset_cls.build_classification_dataset, tasks or [])
+    result["build_classification_dataset"] = timing
+
+    for path in services._archive_paths("stored")[:3]:
+        if path.exists():
+            path.unlink()
+    task_id = uuid.uuid4().hex
+    services.task_store.get_task_store().create(task_id, {"status": "queued", "progress": 0})
+    _, timing = timed(services._zip_build_worker, task_id, Path(functions.DATASET_PATH))
+    zip_task = services.task_store.get_task_store().get(task_id)
+    result["zip_build"] = dict(timing, status=zip_task.get("status"), result=zip_task.get("result"))
+
+    # Файлы в облаке удаляются через смонтированный /mnt — в бенчмарке только dry_run
+    _, timing = timed(functions.clean_cloud_files_from_tasks, tasks or [], dry_run=True)
+    result["cleanup_files_dry_run"] = timing
+    (deleted, _), timing = timed(functions.delete_ls_tasks, tasks or [], dry_run=False)
+    result["cleanup_ls_tasks"] = dict(timing, deleted=len(deleted))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн e2e-бенчмарк пайплайна")
+    parser.add_argument("--scales", default="2,8", help="Число видео на каждом масштабе, через запятую")
+    parser.add_argument("--video-seconds", type=float, default=10, help="Длина синтетического видео")
+    parser.add_argument("--fps", type=float, default=1, help="Кадров в секунду при нарезке")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Задержка WebDAV и Label Studio на запрос")
+    parser.add_argument("--bandwidth-mbit", type=float, default=0, help="Полоса WebDAV, 0 — без ограничения")
+    parser.add_argument("--workdir", help="Рабочая папка (по умолчанию временная)")
+    parser.add_argument("--out", default="e2e_benchmark.json", help="Куда записать JSON с результатами")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="ls_bench_e2e_"))
+    (workdir / "webdav" / REMOTE_FRAME_DIR.lstrip("/")).mkdir(parents=True, exist_ok=True)
+    latency = args.latency_ms / 1000
+    bandwidth = args.bandwidth_mbit * 1_000_000 / 8
+
+    webdav_server, webdav_url = start_webdav(workdir / "webdav", latency, bandwidth)
+    ls, ls_server, ls_port = start_label_studio(workdir / "webdav" / REMOTE_FRAME_DIR.lstrip("/"), latency)
+    functions = configure_pipeline(workdir, webdav_url, ls_port)
+    ls.frames_dir = Path(functions.MOUNTED_PATH)
+
+    results = []
+    try:
+        for videos in (int(x) for x in args.scales.split(",") if x.strip()):
+            print(f"Масштаб: {videos} видео")
+            results.append(run_scale(workdir, functions, ls, videos, args.video_seconds, args.fps))
+    finally:
+        webdav_server.stop()
+        ls_server.shutdown()
+    write_results(args.out, "e2e", results, params=vars(args))
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
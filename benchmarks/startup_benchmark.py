@@ -0,0 +1,98 @@
+"""
+Бенчмарк холодного старта: время импорта модулей API и CLI в свежем интерпретаторе.
+
+Для каждого модуля несколько раз запускает `python -X importtime -c "import <модуль>"`,
+сообщает медиану, самые тяжёлые по cumulative time импорты и то, какие тяжёлые
+зависимости (cv2, webdav3, sklearn, torch, numpy) оказались загружены сразу.
+
+Пример:
+    python -m benchmarks.startup_benchmark --repeat 5 --out startup.json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from benchmarks.common import REPO_ROOT, write_results
+
+DEFAULT_MODULES = ("ls_wb_pipeline.fastapi_app.main", "ls_wb_pipeline.fastapi_app.services",
+                   "ls_wb_pipeline.functions", "ls_wb_pipeline.build_dataset_cls")
+HEAVY_MODULES = ("cv2", "numpy", "webdav3", "requests", "lxml", "sklearn", "torch", "torchvision", "zstandard")
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def _parse_importtime(stderr):
+    """Строки `import time: self [us] | cumulative | imported package` -> [(модуль, self_us, cumulative_us)]."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            rows.append((name.strip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return rows
+
+
+def measure_module(module, repeat, top):
+    runs, errors, importtime_rows = [], [], []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                               _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                              cwd=REPO_ROOT, capture_output=True, text=True)
+        if proc.returncode != 0:
+            errors.append(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed")
+            continue
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        importtime_rows = _parse_importtime(proc.stderr)
+
+    result = {"module": module, "runs": len(runs)}
+    if errors:
+        result["error"] = errors[-1]
+    if not runs:
+        return result
+    seconds = [run["seconds"] for run in runs]
+    result.update({
+        "median_s": round(statistics.median(seconds), 4),
+        "min_s": round(min(seconds), 4),
+        "max_s": round(max(seconds), 4),
+        "heavy_loaded": runs[-1]["heavy"],
+        # Верхнеуровневые пакеты по cumulative time — видно, кто тянет тяжёлые зависимости
+        "top_cumulative": [{"module": name, "cumulative_ms": round(cumulative / 1000, 1),
+                            "self_ms": round(self_us / 1000, 1)}
+                           for name, self_us, cumulative in
+                           sorted(importtime_rows, key=lambda row: -row[2])[:top]],
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время холодного импорта модулей API/CLI")
+    parser.add_argument("--modules", default=",".join(DEFAULT_MODULES), help="Модули через запятую")
+    parser.add_argument("--repeat", type=int, default=5, help="Сколько раз запускать каждый импорт")
+    parser.add_argument("--top", type=int, default=15, help="Сколько самых тяжёлых импортов показать")
+    parser.add_argument("--out", default="startup_benchmark.json", help="Куда записать JSON с результатами")
+    args = parser.parse_args()
+
+    results = []
+    for module in (m.strip() for m in args.modules.split(",") if m.strip()):
+        result = measure_module(module, args.repeat, args.top)
+        results.append(result)
+        if "median_s" in result:
+            print(f"{module:45} {result['median_s'] * 1000:8.1f} ms  тяжёлые: {', '.join(result['heavy_loaded']) or '-'}")
+        else:
+            print(f"{module:45} ошибка: {result.get('error')}")
+    write_results(args.out, "startup", results, params=vars(args))
+
+
+if __name__ == "__main__":
+    main()
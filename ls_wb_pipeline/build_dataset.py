@@ -1,4 +1,3 @@
-from sklearn.model_selection import train_test_split
 from ls_wb_pipeline import settings
 from urllib.parse import unquote
 from collections import Counter
@@ -120,6 +119,7 @@ def main_from_tasks(all_tasks, train_ratio=0.8, test_ratio=0.1, val_ratio=0.1):
     if len(entries) < 3:
         split_data = {"train": entries, "val": [], "test": []}
     else:
+        from sklearn.model_selection import train_test_split  # тяжёлый импорт — только когда нужен
         train_val, test = train_test_split(entries, test_size=test_ratio, random_state=42)
         train, val = train_test_split(train_val, test_size=val_ratio/(train_ratio+val_ratio), random_state=42)
         split_data = {"train": train, "val": val, "test": test}
@@ -1,19 +1,133 @@
 import os
+import re
 import shutil
 import json
 from urllib.parse import unquote
 from collections import Counter
 from ls_wb_pipeline.dataset_checker import check_dataset_duplicates
-from sklearn.model_selection import train_test_split
+from ls_wb_pipeline.dataset_generation import bump_generation
 from ls_wb_pipeline import settings
 
+SPLITS = ("train", "val", "test")
+SPLIT_STATE_FILE = ".split_state.json"
+_FRAME_NAME_RE = re.compile(r"^(?P<stem>.+)_\d{6}\.(jpg|jpeg|png)$", re.IGNORECASE)
+
 def get_latest_valid_annotation(annotations):
     valid = [a for a in annotations if not a.get("was_cancelled", False)]
     if not valid:
         return None
     return max(valid, key=lambda x: x.get("created_at", ""))
 
-def build_classification_dataset(all_tasks, train_ratio=0.8, test_ratio=0.1, val_ratio=0.1):
+
+def get_video_stem(image_name):
+    """Имя видео, из которого нарезан кадр: всё до суффикса _NNNNNN.jpg."""
+    match = _FRAME_NAME_RE.match(image_name)
+    if match:
+        return match.group("stem")
+    return os.path.splitext(image_name)[0]
+
+
+def _scan_split_state(dataset_path):
+    """Восстанавливает состояние сплитов по уже собранному датасету (однократно)."""
+    state = {"groups": {}, "counts": {split: {} for split in SPLITS}}
+    classes_path = os.path.join(dataset_path, "labels.txt")
+    if not os.path.exists(classes_path):
+        return state
+    with open(classes_path, "r", encoding="utf-8") as f:
+        classes = [line.strip() for line in f if line.strip()]
+
+    for split in SPLITS:
+        for class_id, class_name in enumerate(classes):
+            class_dir = os.path.join(dataset_path, split, f"class_{class_id}")
+            if not os.path.isdir(class_dir):
+                continue
+            for fname in os.listdir(class_dir):
+                if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
+                    continue
+                state["groups"].setdefault(get_video_stem(fname), split)
+                counts = state["counts"][split]
+                counts[class_name] = counts.get(class_name, 0) + 1
+    return state
+
+
+def load_split_state(dataset_path):
+    """
+    Загружает сохранённые счётчики по сплитам/классам и привязку видео к сплиту.
+    Если файла состояния нет — строит его по содержимому датасета.
+    """
+    state_path = os.path.join(dataset_path, SPLIT_STATE_FILE)
+    if os.path.exists(state_path):
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            for split in SPLITS:
+                state.setdefault("counts", {}).setdefault(split, {})
+            state.setdefault("groups", {})
+            return state
+        except Exception:
+            pass
+    return _scan_split_state(dataset_path)
+
+
+def save_split_state(dataset_path, state):
+    os.makedirs(dataset_path, exist_ok=True)
+    state_path = os.path.join(dataset_path, SPLIT_STATE_FILE)
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, state_path)
+
+
+def assign_group_split(state, class_counts, ratios):
+    """
+    Выбирает сплит для новой группы кадров (одного видео).
+    class_counts — Counter {класс: кол-во кадров группы}.
+    Группа целиком уходит в сплит, который сильнее всего недобран
+    относительно целевой доли с учётом классов группы.
+    """
+    counts = state["counts"]
+    best_split, best_deficit = None, None
+    for split in SPLITS:
+        deficit = 0.0
+        for cls, n in class_counts.items():
+            total_cls = sum(counts[s].get(cls, 0) for s in SPLITS) + n
+            deficit += ratios[split] * total_cls - counts[split].get(cls, 0)
+        # При равенстве выигрывает сплит с большей целевой долей
+        if best_deficit is None or deficit > best_deficit or (
+                deficit == best_deficit and ratios[split] > ratios[best_split]):
+            best_split, best_deficit = split, deficit
+    return best_split
+
+
+def assign_splits(entries, state, train_ratio=0.8, test_ratio=0.1, val_ratio=0.1):
+    """
+    Детерминированно распределяет новые записи по сплитам, группируя по видео.
+    Кадры уже известного видео попадают в тот же сплит, что и раньше.
+    Существующие данные не перемешиваются, сложность — O(новых записей).
+    """
+    total_ratio = (train_ratio + val_ratio + test_ratio) or 1.0
+    ratios = {"train": train_ratio / total_ratio,
+              "val": val_ratio / total_ratio,
+              "test": test_ratio / total_ratio}
+
+    groups = {}
+    for entry in entries:
+        groups.setdefault(get_video_stem(entry["image"]), []).append(entry)
+
+    split_data = {split: [] for split in SPLITS}
+    for stem in sorted(groups):
+        items = groups[stem]
+        split = state["groups"].get(stem)
+        if split not in split_data:
+            split = assign_group_split(state, Counter(e["class"] for e in items), ratios)
+            state["groups"][stem] = split
+        counts = state["counts"][split]
+        for item in items:
+            counts[item["class"]] = counts.get(item["class"], 0) + 1
+        split_data[split].extend(items)
+    return split_data
+
+def build_classification_dataset(all_tasks, train_ratio=0.8, test_ratio=0.1, val_ratio=0.1, progress_cb=None):
     entries = []
     stats = Counter()
     used_image_names = set()
@@ -78,27 +192,28 @@ def build_classification_dataset(all_tasks, train_ratio=0.8, test_ratio=0.1, val
     all_classes = list(dict.fromkeys(existing_classes + new_classes))  # сохраняем порядок, избегаем дубликатов
     class_to_id = {cls: idx for idx, cls in enumerate(all_classes)}
 
-    # Перезапись labels.txt
+    # Перезапись labels.txt (только при появлении новых классов, чтобы не сбивать mtime для архива)
     os.makedirs(settings.DATASET_PATH, exist_ok=True)
-    with open(classes_path, "w", encoding="utf-8") as f:
-        for cls in all_classes:
-            f.write(f"{cls}\n")
+    if all_classes != existing_classes:
+        with open(classes_path, "w", encoding="utf-8") as f:
+            for cls in all_classes:
+                f.write(f"{cls}\n")
 
     print("\n📊 Распределение классов:")
     for cls, count in stats.items():
         print(f"{cls:25} — {count} изображений")
 
-    # Разделение
-    if len(entries) < 3:
-        split_data = {"train": entries, "val": [], "test": []}
-    else:
-        train_val, test = train_test_split(entries, test_size=test_ratio, random_state=42, stratify=[e["class"] for e in entries])
-        train, val = train_test_split(train_val, test_size=val_ratio / (train_ratio + val_ratio), random_state=42, stratify=[e["class"] for e in train_val])
-        split_data = {"train": train, "val": val, "test": test}
+    # Разделение: группами по видео, с учётом уже накопленных долей
+    split_state = load_split_state(settings.DATASET_PATH)
+    split_data = assign_splits(entries, split_state, train_ratio=train_ratio,
+                               test_ratio=test_ratio, val_ratio=val_ratio)
 
-    # Копирование
-    for split, items in split_data.items():
-        for item in items:
+    # Копирование. progress_cb — точка отмены фоновой задачи (JobCancelled): даже при прерывании
+    # уже скопированные кадры учитываются в долях сплитов и поколении, нескопированные вычитаются
+    pending = [(split, item) for split, items in split_data.items() for item in items]
+    copied = 0
+    try:
+        for split, item in pending:
             class_id = class_to_id[item["class"]]
             class_dir = os.path.join(settings.DATASET_PATH, split, f"class_{class_id}")
             os.makedirs(class_dir, exist_ok=True)
@@ -107,6 +222,17 @@ def build_classification_dataset(all_tasks, train_ratio=0.8, test_ratio=0.1, val
             dst = os.path.join(class_dir, item["image"])
             if os.path.exists(src):
                 shutil.copy(src, dst)
+            else:
+                counts = split_state["counts"][split]
+                counts[item["class"]] -= 1
+            copied += 1
+            if progress_cb is not None and (copied % 50 == 0 or copied == len(entries)):
+                progress_cb("build", done=copied, total=len(entries))
+    finally:
+        for split, item in pending[copied:]:
+            split_state["counts"][split][item["class"]] -= 1
+        save_split_state(settings.DATASET_PATH, split_state)
+        bump_generation(settings.DATASET_PATH)
     print(f"\n✅ Классификационный датасет собран: {settings.DATASET_PATH}")
     return {"stats": True, "path": settings.DATASET_PATH}
 
@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import uuid
+
+GENERATION_FILE = ".generation"
+
+
+def read_generation(dataset_path):
+    """{"epoch": ..., "generation": N}; epoch меняется, когда датасет создаётся заново."""
+    path = os.path.join(dataset_path, GENERATION_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return {"epoch": str(data["epoch"]), "generation": int(data["generation"])}
+    except Exception:
+        return {"epoch": None, "generation": 0}
+
+
+def bump_generation(dataset_path):
+    """Увеличивает счётчик поколений. Вызывается всеми, кто меняет датасет."""
+    os.makedirs(dataset_path, exist_ok=True)
+    current = read_generation(dataset_path)
+    data = {"epoch": current["epoch"] or uuid.uuid4().hex, "generation": current["generation"] + 1}
+    path = os.path.join(dataset_path, GENERATION_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    return data["generation"]
+
+
+def dir_fingerprint(dataset_path):
+    """
+    Отпечаток по mtime каталогов (корень, сплиты, class_N) — ловит добавление и
+    удаление файлов в обход счётчика. Сами каталоги классов не листаются.
+    """
+    parts = []
+    try:
+        root_stat = os.stat(dataset_path)
+    except FileNotFoundError:
+        return "absent"
+    parts.append(f".:{root_stat.st_mtime_ns}")
+    with os.scandir(dataset_path) as root_entries:
+        splits = sorted(e.name for e in root_entries if e.is_dir(follow_symlinks=False))
+    for split in splits:
+        split_path = os.path.join(dataset_path, split)
+        parts.append(f"{split}:{os.stat(split_path).st_mtime_ns}")
+        with os.scandir(split_path) as class_entries:
+            for entry in sorted(class_entries, key=lambda e: e.name):
+                if entry.is_dir(follow_symlinks=False):
+                    parts.append(f"{split}/{entry.name}:{entry.stat(follow_symlinks=False).st_mtime_ns}")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def dataset_fingerprint(dataset_path):
+    """Дешёвый (O(число каталогов)) отпечаток состояния датасета."""
+    generation = read_generation(dataset_path)
+    return f"{generation['epoch']}:{generation['generation']}#{dir_fingerprint(dataset_path)}"
@@ -0,0 +1,181 @@
+import io
+import json
+import os
+import re
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+SPLITS = ("train", "val", "test")
+INDEX_FILE = "index.json"
+MANIFEST_FILE = "manifest.json"
+_CLASS_DIR_RE = re.compile(r"^class_(\d+)$")
+
+
+def _sample_key(fname: str) -> str:
+    """Ключ сэмпла в стиле WebDataset: без точек, иначе ломается разбор расширений."""
+    stem = os.path.splitext(fname)[0]
+    return stem.replace(".", "_").replace(" ", "_")
+
+
+def _load_json(path: Path, default):
+    if not path.exists():
+        return default
+    try:
+        return json.loads(path.read_text(encoding="utf-8") or "null") or default
+    except Exception:
+        return default
+
+
+def _write_json(path: Path, data):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+
+def read_classes(dataset_dir: Path):
+    classes_file = Path(dataset_dir) / "labels.txt"
+    if not classes_file.exists():
+        return []
+    with open(classes_file, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def collect_split_samples(dataset_dir: Path):
+    """Возвращает {split: [(relpath, class_id), ...]} в детерминированном порядке."""
+    dataset_dir = Path(dataset_dir)
+    samples = {split: [] for split in SPLITS}
+    for split in SPLITS:
+        split_dir = dataset_dir / split
+        if not split_dir.is_dir():
+            continue
+        for class_dir in sorted(os.listdir(split_dir)):
+            match = _CLASS_DIR_RE.match(class_dir)
+            if not match or not (split_dir / class_dir).is_dir():
+                continue
+            class_id = int(match.group(1))
+            for fname in sorted(os.listdir(split_dir / class_dir)):
+                if fname.lower().endswith((".jpg", ".jpeg", ".png")):
+                    samples[split].append((f"{split}/{class_dir}/{fname}", class_id))
+    return samples
+
+
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes, mtime: float):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_shard(dataset_dir: Path, shard_path: Path, samples, classes):
+    """
+    Пишет один tar-шард: на каждый сэмпл .jpg + .cls + .json.
+    Возвращает (размер, relpath реально записанных сэмплов) — исчезнувшие файлы пропускаются.
+    """
+    dataset_dir = Path(dataset_dir)
+    tmp_path = shard_path.with_suffix(".tar.tmp")
+    now = time.time()
+    written = []
+    with tarfile.open(tmp_path, "w", format=tarfile.GNU_FORMAT) as tar:
+        for relpath, class_id in samples:
+            full = dataset_dir / relpath
+            fname = os.path.basename(relpath)
+            key = _sample_key(fname)
+            ext = os.path.splitext(fname)[1].lower().lstrip(".")
+            try:
+                info = tar.gettarinfo(str(full), arcname=f"{key}.{ext}")
+            except FileNotFoundError:
+                continue
+            info.mode = 0o644
+            info.uid = info.gid = 0
+            info.uname = info.gname = ""
+            with open(full, "rb") as f:
+                tar.addfile(info, f)
+            _add_bytes(tar, f"{key}.cls", str(class_id).encode(), now)
+            meta = {"image": fname, "label": class_id,
+                    "class": classes[class_id] if class_id < len(classes) else None}
+            _add_bytes(tar, f"{key}.json", json.dumps(meta, ensure_ascii=False).encode("utf-8"), now)
+            written.append(relpath)
+    tmp_path.replace(shard_path)
+    return shard_path.stat().st_size, written
+
+
+def build_shards(dataset_dir: Path, out_dir: Path, shard_size: int = 1000, workers: int = 4,
+                 progress_cb=None):
+    """
+    Экспортирует датасет в tar-шарды (по split) с индексом.
+    Инкрементально: пишутся только шарды с новыми файлами, последний неполный шард
+    переписывается вместе с ними (все шарды, кроме последнего, — ровно по shard_size).
+    Если из датасета что-то пропало — шарды этого сплита пересобираются целиком.
+    progress_cb(done_shards, total_shards) — опциональный колбэк прогресса.
+    """
+    dataset_dir = Path(dataset_dir)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    classes = read_classes(dataset_dir)
+    samples = collect_split_samples(dataset_dir)
+
+    manifest = _load_json(out_dir / MANIFEST_FILE, {})
+    index = _load_json(out_dir / INDEX_FILE, {})
+    index_splits = index.get("splits", {})
+
+    jobs = []
+    for split in SPLITS:
+        packed = manifest.get(split, {}).get("files", [])
+        shards = index_splits.get(split, {}).get("shards", [])
+        current = {relpath for relpath, _ in samples[split]}
+        if not set(packed) <= current:
+            # Файлы удалены или перенесены — инкрементальное дополнение невозможно
+            for shard in shards:
+                try:
+                    (out_dir / shard["name"]).unlink()
+                except FileNotFoundError:
+                    pass
+            packed, shards = [], []
+        packed_set = set(packed)
+        new_samples = [s for s in samples[split] if s[0] not in packed_set]
+        if new_samples and shards and shards[-1]["count"] < shard_size:
+            # Неполный хвостовой шард дописывается: его сэмплы — последние в манифесте
+            tail = shards.pop()
+            class_ids = dict(samples[split])
+            keep = len(packed) - tail["count"]
+            new_samples = [(relpath, class_ids[relpath]) for relpath in packed[keep:]] + new_samples
+            packed = packed[:keep]
+
+        next_no = len(shards)
+        for start in range(0, len(new_samples), shard_size):
+            chunk = new_samples[start:start + shard_size]
+            name = f"{split}-{next_no:06d}.tar"
+            jobs.append((split, name, chunk))
+            next_no += 1
+        manifest[split] = {"files": packed}
+        index_splits[split] = {"shards": shards}
+
+    done = 0
+    if progress_cb:
+        progress_cb(done, len(jobs))
+    if jobs:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(write_shard, dataset_dir, out_dir / name, chunk, classes): (split, name, chunk)
+                       for split, name, chunk in jobs}
+            results = {}
+            for fut in as_completed(futures):
+                results[futures[fut][1]] = fut.result()
+                done += 1
+                if progress_cb:
+                    progress_cb(done, len(jobs))
+        for split, name, chunk in jobs:
+            size, written = results[name]
+            index_splits[split]["shards"].append({"name": name, "count": len(written), "size": size})
+            manifest[split]["files"].extend(written)
+
+    for split in SPLITS:
+        shards = index_splits[split]["shards"]
+        index_splits[split]["total"] = sum(s["count"] for s in shards)
+
+    index = {"classes": classes, "splits": index_splits, "shard_size": shard_size, "built_at": time.time()}
+    _write_json(out_dir / MANIFEST_FILE, manifest)
+    _write_json(out_dir / INDEX_FILE, index)
+    return {"written_shards": len(jobs), "index": index}
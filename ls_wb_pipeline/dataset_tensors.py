@@ -0,0 +1,178 @@
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from ls_wb_pipeline.dataset_shards import SPLITS, collect_split_samples, read_classes
+from ls_wb_pipeline.logger import logger
+
+IMAGE_SIZE = 224
+IMAGES_FILE = "images.u8"
+LABELS_FILE = "labels.npy"
+SPLITS_FILE = "splits.npy"
+META_FILE = "meta.json"
+SPLIT_IDS = {split: i for i, split in enumerate(SPLITS)}
+
+
+def decode_image(path, size: int = IMAGE_SIZE):
+    """Читает картинку и приводит к RGB uint8 size×size×3."""
+    import cv2
+    import numpy as np
+    data = np.fromfile(path, dtype=np.uint8)
+    img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Не удалось декодировать {path}")
+    img = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def _try_decode(path, size: int):
+    try:
+        return decode_image(path, size)
+    except (ValueError, OSError) as e:
+        logger.warning(f"[TENSORS] Пропущен файл {path}: {e}")
+        return None
+
+
+def _save_npy(path: Path, array):
+    """np.save через временный файл и os.replace: читатель видит либо старый, либо новый массив."""
+    import numpy as np
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _load_meta(out_dir: Path):
+    meta_path = out_dir / META_FILE
+    if not meta_path.exists():
+        return None
+    try:
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+
+def open_tensor_dataset(out_dir, split: str = None):
+    """
+    Открывает экспорт на чтение без копирования.
+    Возвращает (images, labels, indices): images — np.memmap N×S×S×3 uint8,
+    indices — номера строк нужного сплита (или всех, если split не задан).
+    """
+    import numpy as np
+
+    out_dir = Path(out_dir)
+    meta = _load_meta(out_dir)
+    if not meta:
+        raise FileNotFoundError(f"Тензорный экспорт не найден в {out_dir}")
+    n, size = meta["count"], meta["image_size"]
+    images = np.memmap(out_dir / IMAGES_FILE, dtype=np.uint8, mode="r", shape=(n, size, size, 3))
+    # Массивы могут быть длиннее count, если дописывание идёт прямо сейчас: мета пишется последней
+    labels = np.load(out_dir / LABELS_FILE, mmap_mode="r")[:n]
+    splits = np.load(out_dir / SPLITS_FILE)[:n]
+    if split is None:
+        indices = np.arange(n)
+    else:
+        indices = np.flatnonzero(splits == SPLIT_IDS[split])
+    return images, labels, indices
+
+
+def build_tensors(dataset_dir, out_dir, workers: int = 4, batch_size: int = 512,
+                  image_size: int = IMAGE_SIZE, progress_cb=None):
+    """
+    Декодирует и ресайзит все картинки датасета один раз в memmap-массив uint8.
+    Новые картинки дописываются в конец; если что-то удалено — полная пересборка во временные
+    файлы с подменой через os.replace (meta.json — последней). Нечитаемые картинки пропускаются.
+    progress_cb(done, total) — опциональный колбэк прогресса по новым картинкам.
+    """
+    import numpy as np
+
+    dataset_dir = Path(dataset_dir)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    samples = [(relpath, class_id, SPLIT_IDS[split])
+               for split, items in collect_split_samples(dataset_dir).items()
+               for relpath, class_id in items]
+    current = {relpath for relpath, _, _ in samples}
+
+    meta = _load_meta(out_dir)
+    files, labels, splits = [], [], []
+    if meta and meta.get("image_size") == image_size and set(meta.get("files", [])) <= current:
+        files = meta["files"]
+        # Хвост от прерванного дописывания (массивы длиннее meta) отбрасываем
+        labels = np.load(out_dir / LABELS_FILE)[:len(files)].tolist()
+        splits = np.load(out_dir / SPLITS_FILE)[:len(files)].tolist()
+    known = set(files)
+    new_samples = [s for s in samples if s[0] not in known]
+
+    item_bytes = image_size * image_size * 3
+    images_path = out_dir / IMAGES_FILE
+    # Полная пересборка идёт во временный файл: живой экспорт читают, пока не подменим
+    rebuild = not files
+    target_path = images_path.with_name(f"{IMAGES_FILE}.{uuid.uuid4().hex}.tmp") if rebuild else images_path
+    old_count = len(files)
+    # Обрезаем хвост от прерванной сборки и резервируем место под новые строки
+    with open(target_path, "ab") as f:
+        f.truncate((old_count + len(new_samples)) * item_bytes)
+
+    written = []
+    try:
+        if progress_cb:
+            progress_cb(0, len(new_samples))
+        if new_samples:
+            images = np.memmap(target_path, dtype=np.uint8, mode="r+",
+                               shape=(old_count + len(new_samples), image_size, image_size, 3))
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                for start in range(0, len(new_samples), batch_size):
+                    chunk = new_samples[start:start + batch_size]
+                    paths = [dataset_dir / relpath for relpath, _, _ in chunk]
+                    decoded = pool.map(lambda p: _try_decode(p, image_size), paths)
+                    for sample, img in zip(chunk, decoded):
+                        # Битые картинки пропускаются, строки идут подряд
+                        if img is None:
+                            continue
+                        images[old_count + len(written)] = img
+                        written.append(sample)
+                    if progress_cb:
+                        progress_cb(start + len(chunk), len(new_samples))
+            images.flush()
+            del images
+        new_count = old_count + len(written)
+        with open(target_path, "r+b") as f:
+            f.truncate(new_count * item_bytes)
+    except BaseException:
+        if rebuild:
+            target_path.unlink()
+        raise
+
+    files.extend(relpath for relpath, _, _ in written)
+    labels.extend(class_id for _, class_id, _ in written)
+    splits.extend(split_id for _, _, split_id in written)
+    if rebuild:
+        # Без меты экспорт считается отсутствующим: пока подменяются файлы, читатель
+        # получит FileNotFoundError, а не строки, не совпадающие с meta["files"]
+        try:
+            (out_dir / META_FILE).unlink()
+        except FileNotFoundError:
+            pass
+        os.replace(target_path, images_path)
+    _save_npy(out_dir / LABELS_FILE, np.asarray(labels, dtype=np.int16))
+    _save_npy(out_dir / SPLITS_FILE, np.asarray(splits, dtype=np.uint8))
+
+    meta = {
+        "count": new_count,
+        "image_size": image_size,
+        "dtype": "uint8",
+        "layout": "NHWC",
+        "color": "RGB",
+        "classes": read_classes(dataset_dir),
+        "splits": list(SPLITS),
+        "files": files,
+        "built_at": time.time(),
+    }
+    tmp_meta = out_dir / (META_FILE + ".tmp")
+    tmp_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_meta, out_dir / META_FILE)
+    return {"count": new_count, "added": len(written), "skipped": len(new_samples) - len(written)}
@@ -0,0 +1,137 @@
+import json
+import os
+import time
+import uuid
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+INDEX_FILE = "index.json"
+SNAPSHOT_FILE = "snapshot.json"
+DELTA_MANIFEST = "delta.json"
+
+
+def _read_json(path: Path, default):
+    if not path.exists():
+        return default
+    try:
+        return json.loads(path.read_text(encoding="utf-8") or "null") or default
+    except Exception:
+        return default
+
+
+def _write_json(path: Path, data):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+
+def _version_path(versions_dir: Path, version: int) -> Path:
+    return versions_dir / f"v{version:06d}.json"
+
+
+def current_version(versions_dir) -> int:
+    return int(_read_json(Path(versions_dir) / INDEX_FILE, {}).get("current", 0))
+
+
+def recorded_fingerprint(versions_dir) -> Optional[str]:
+    """Отпечаток датасета, на котором было записано последнее поколение."""
+    return _read_json(Path(versions_dir) / INDEX_FILE, {}).get("fingerprint")
+
+
+def record_version(versions_dir, snapshot: Dict[str, List[float]],
+                   fingerprint: Optional[str] = None) -> Dict[str, int]:
+    """
+    Сравнивает снимок датасета с предыдущим и, если есть изменения,
+    заводит новое поколение со списками добавленных и удалённых файлов.
+    Изменённый файл (size/mtime) считается добавленным заново.
+    Не потокобезопасна: вызывающий сериализует вызовы (в API — аренда dataset_versions).
+    """
+    versions_dir = Path(versions_dir)
+    versions_dir.mkdir(parents=True, exist_ok=True)
+    index = _read_json(versions_dir / INDEX_FILE, {"current": 0, "versions": []})
+    previous = _read_json(versions_dir / SNAPSHOT_FILE, {})
+
+    added = sorted(name for name, stat in snapshot.items() if previous.get(name) != list(stat))
+    removed = sorted(name for name in previous if name not in snapshot)
+    if not added and not removed:
+        if fingerprint and index.get("fingerprint") != fingerprint:
+            index["fingerprint"] = fingerprint
+            _write_json(versions_dir / INDEX_FILE, index)
+        return {"version": index["current"], "added": 0, "removed": 0}
+
+    version = index["current"] + 1
+    _write_json(_version_path(versions_dir, version),
+                {"version": version, "added": added, "removed": removed})
+    _write_json(versions_dir / SNAPSHOT_FILE, {name: list(stat) for name, stat in snapshot.items()})
+    index["versions"].append({"version": version, "created_at": time.time(),
+                              "added": len(added), "removed": len(removed)})
+    index["current"] = version
+    index["fingerprint"] = fingerprint
+    _write_json(versions_dir / INDEX_FILE, index)
+    return {"version": version, "added": len(added), "removed": len(removed)}
+
+
+def compute_delta(versions_dir, since: int, until: Optional[int] = None):
+    """Сворачивает поколения (since, until] в итоговые множества added/removed."""
+    versions_dir = Path(versions_dir)
+    current = current_version(versions_dir)
+    until = current if until is None else until
+    if since < 0 or since > until or until > current:
+        raise ValueError(f"Версия {since} вне диапазона 0..{current}")
+
+    added, removed = set(), set()
+    for version in range(since + 1, until + 1):
+        data = _read_json(_version_path(versions_dir, version), None)
+        if data is None:
+            raise FileNotFoundError(f"История для версии {version} не сохранилась, скачайте полный архив")
+        for name in data["removed"]:
+            added.discard(name)
+            removed.add(name)
+        for name in data["added"]:
+            removed.discard(name)
+            added.add(name)
+    return sorted(added), sorted(removed), until
+
+
+def build_delta_archive(dataset_dir, versions_dir, out_dir, since: int, keep_seconds: float = 3600) -> Path:
+    """
+    Собирает (или берёт из кеша) ZIP с файлами, добавленными после версии since,
+    и delta.json со списком удалений. Применяется скриптом apply_dataset_delta.py.
+    Дельты до устаревших версий удаляются не сразу, а через keep_seconds — их ещё могут скачивать.
+    """
+    dataset_dir = Path(dataset_dir)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    added, removed, until = compute_delta(versions_dir, since)
+    archive_path = out_dir / f"dataset_delta_{since}_{until}.zip"
+    if archive_path.exists():
+        return archive_path
+
+    now = time.time()
+    for old in out_dir.glob("dataset_delta_*.zip"):
+        if old.name.endswith(f"_{until}.zip"):
+            continue
+        try:
+            if now - old.stat().st_mtime > keep_seconds:
+                old.unlink()
+        except FileNotFoundError:
+            pass
+
+    packed = []
+    tmp_path = archive_path.with_name(f"{archive_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as zf:
+            for arcname in added:
+                try:
+                    zf.write(dataset_dir / arcname, arcname)
+                except FileNotFoundError:
+                    continue
+                packed.append(arcname)
+            manifest = {"from": since, "to": until, "added": packed, "removed": removed}
+            zf.writestr(DELTA_MANIFEST, json.dumps(manifest, ensure_ascii=False))
+        os.replace(tmp_path, archive_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return archive_path
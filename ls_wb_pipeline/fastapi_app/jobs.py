@@ -0,0 +1,130 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from ls_wb_pipeline import settings
+from ls_wb_pipeline.logger import logger
+from ls_wb_pipeline.fastapi_app.task_store import LOCK_TTL, get_task_store
+
+# Сколько задач каждого типа может выполняться одновременно (на все воркеры API),
+# остальные ждут в очереди
+JOB_CONCURRENCY = {"load_frames": 1, "build_dataset": 1, "preannotate": 1}
+JOB_CONCURRENCY.update(getattr(settings, "JOB_CONCURRENCY", {}))
+TERMINAL_STATUSES = ("done", "error", "cancelled")
+
+
+class JobCancelled(BaseException):
+    """Отмена задачи. Наследуется от BaseException, чтобы её не проглотили
+    широкие `except Exception` внутри пайплайна."""
+
+
+def _update(job_id: str, **fields):
+    get_task_store().update(job_id, fields)
+
+
+def _is_cancel_requested(job_id: str) -> bool:
+    job = get_task_store().get(job_id)
+    return bool(job and job.get("cancel_requested"))
+
+
+def make_progress_callback(job_id: str) -> Callable[..., None]:
+    """
+    progress_cb(stage, done=None, total=None, **info) для пайплайна.
+    Обновляет статус этапа и служит точкой отмены: бросает JobCancelled.
+    """
+    def progress_cb(stage: str, done: Optional[int] = None, total: Optional[int] = None, **info):
+        if _is_cancel_requested(job_id):
+            raise JobCancelled()
+
+        def apply(job):
+            stage_info = job["stages"].setdefault(stage, {"started_at": time.time()})
+            if done is not None:
+                stage_info["done"] = done
+            if total is not None:
+                stage_info["total"] = total
+            stage_info.update(info)
+            job["stage"] = stage
+            if total:
+                job["progress"] = int(min(done or 0, total) * 100 / total)
+            job["detail"] = f"{stage}: {done}/{total}" if total else stage
+            job["updated_at"] = time.time()
+
+        get_task_store().modify(job_id, apply)
+    return progress_cb
+
+
+def _run_job(job_id: str, job_type: str, fn: Callable[..., Any], kwargs: Dict[str, Any]):
+    slots = max(1, int(JOB_CONCURRENCY.get(job_type, 1)))
+    with get_task_store().heartbeat(job_id), \
+            get_task_store().lease(f"job:{job_type}", ttl=LOCK_TTL, wait=float("inf"), slots=slots, owner=job_id,
+                         should_stop=lambda: _is_cancel_requested(job_id)) as acquired:
+        if not acquired or _is_cancel_requested(job_id):
+            _update(job_id, status="cancelled", finished_at=time.time())
+            return
+        try:
+            _update(job_id, status="running", started_at=time.time(), detail="Started")
+            result = fn(progress_cb=make_progress_callback(job_id), **kwargs)
+            _update(job_id, status="done", progress=100, result=result, finished_at=time.time())
+        except JobCancelled:
+            logger.info(f"[JOB] {job_type} {job_id} отменена")
+            _update(job_id, status="cancelled", finished_at=time.time())
+        except Exception as e:
+            logger.exception(f"[JOB] {job_type} {job_id} завершилась с ошибкой")
+            _update(job_id, status="error", error=str(e), finished_at=time.time())
+
+
+def start_job(job_type: str, fn: Callable[..., Any], **kwargs) -> Dict[str, Any]:
+    """Запускает fn(progress_cb=..., **kwargs) в фоне и возвращает id задачи."""
+    job_id = uuid.uuid4().hex
+    get_task_store().create(job_id, {"type": job_type, "status": "queued", "progress": 0, "stage": None,
+                           "stages": {}, "params": kwargs, "created_at": time.time()})
+    t = threading.Thread(target=_run_job, args=(job_id, job_type, fn, kwargs), daemon=True)
+    t.start()
+    return {"job_id": job_id, "status": "queued"}
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return get_task_store().get(job_id)
+
+
+def list_jobs(job_type: Optional[str] = None):
+    return [{"job_id": job["task_id"], "type": job.get("type"), "status": job.get("status"),
+             "progress": job.get("progress"), "stage": job.get("stage"), "created_at": job.get("created_at")}
+            for job in get_task_store().list() if job_type is None or job.get("type") == job_type]
+
+
+def cancel_job(job_id: str) -> Optional[Dict[str, Any]]:
+    def apply(job):
+        if job.get("status") not in TERMINAL_STATUSES:
+            job["cancel_requested"] = True
+
+    job = get_task_store().modify(job_id, apply, touch=False)
+    if job is None:
+        return None
+    return {"job_id": job_id, "status": job.get("status"), "cancel_requested": job.get("cancel_requested", False)}
+
+
+async def job_events(job_id: str, interval: float = 0.5):
+    """
+    Server-Sent Events: шлёт снимок задачи при каждом изменении до завершения.
+    Чтение из SQLite синхронное, поэтому идёт в пуле потоков, не блокируя цикл событий.
+    """
+    last = None
+    while True:
+        job = await run_in_threadpool(get_job, job_id)
+        if job is None:
+            yield "event: error\ndata: {\"detail\": \"Job not found\"}\n\n"
+            return
+        payload = json.dumps(job, ensure_ascii=False)
+        if payload != last:
+            last = payload
+            yield f"event: progress\ndata: {payload}\n\n"
+        if job.get("status") in TERMINAL_STATUSES:
+            yield f"event: {job['status']}\ndata: {payload}\n\n"
+            return
+        await asyncio.sleep(interval)
@@ -0,0 +1,62 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import iterate_in_threadpool
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from ls_wb_pipeline.fastapi_app import services
+
+_ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+class RangeFileResponse(Response):
+    """
+    Отдаёт файл целиком, одним или несколькими диапазонами (multipart/byteranges).
+    Если ASGI-сервер поддерживает расширение zerocopysend, тело уходит через
+    os.sendfile без копирования в userspace; иначе — os.pread чанками из пула потоков.
+    Файл уже открыт в services.plan_download, заголовки (включая Content-Length) построены
+    по его fstat; все части читаются из этого же дескриптора, ответ его закрывает.
+    """
+
+    def __init__(self, file, ranges: List[Tuple[int, int]], headers: Dict[str, str],
+                 status_code: int = 200, media_type: str = "application/zip",
+                 boundary: Optional[str] = None, send_body: bool = True):
+        self.file = file
+        self.ranges = ranges
+        self.boundary = boundary
+        self.part_media_type = media_type
+        self.send_body = send_body
+        if boundary:
+            media_type = f"multipart/byteranges; boundary={boundary}"
+        super().__init__(content=None, status_code=status_code, headers=headers, media_type=media_type)
+
+    async def _send_range(self, send: Send, start: int, end: int, zerocopy: bool):
+        if zerocopy:
+            await send({"type": _ZEROCOPY_EXTENSION, "file": self.file, "offset": start,
+                        "count": end - start + 1, "more_body": True})
+            return
+        async for chunk in iterate_in_threadpool(services.iter_fd(self.file, start, end)):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if not self.send_body or not self.ranges:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+            zerocopy = _ZEROCOPY_EXTENSION in scope.get("extensions", {})
+            total = os.fstat(self.file.fileno()).st_size
+            for start, end in self.ranges:
+                if self.boundary:
+                    part_header = services.multipart_part_header(self.boundary, self.part_media_type,
+                                                                 start, end, total)
+                    await send({"type": "http.response.body", "body": part_header, "more_body": True})
+                await self._send_range(send, start, end, zerocopy)
+            if self.boundary:
+                await send({"type": "http.response.body", "body": services.multipart_tail(self.boundary),
+                            "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            self.file.close()
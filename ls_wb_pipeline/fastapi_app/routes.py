@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Query, HTTPException, Request
-from fastapi.responses import FileResponse
-from ls_wb_pipeline import settings
-from ls_wb_pipeline.fastapi_app import services
+from typing import List
+
+from fastapi import APIRouter, File, Query, HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from ls_wb_pipeline import settings, metrics
+from ls_wb_pipeline.fastapi_app import services, jobs
+from ls_wb_pipeline.fastapi_app.responses import RangeFileResponse
 
 router = APIRouter()
 
@@ -12,9 +15,14 @@ def build_dataset(
     val_ratio: float = Query(0.1, description="Валидационная часть"),
     test_ratio: float = Query(0.1, description="Тестовая часть"),
     del_unannotated: bool = Query(True, description="Удалить неразмеченные кадры"),
-    dry_run: bool = Query(default=False, description="Имитация удаления")):
-    return services.enrich_dataset_and_cleanup(dry_run=dry_run,
-        del_unannotated=del_unannotated, train_ratio=train_ratio, test_ratio=test_ratio, val_ratio=val_ratio)
+    dry_run: bool = Query(default=False, description="Имитация удаления"),
+    wait: bool = Query(default=False, description="Ждать завершения и вернуть результат (старое поведение)"),
+    profile: bool = Query(default=False, description="Приложить к результату сводку cProfile")):
+    params = dict(dry_run=dry_run, del_unannotated=del_unannotated,
+                  train_ratio=train_ratio, test_ratio=test_ratio, val_ratio=val_ratio, profile=profile)
+    if wait:
+        return services.enrich_dataset_and_cleanup(**params)
+    return jobs.start_job("build_dataset", services.enrich_dataset_and_cleanup, **params)
 
 
 @router.get("/analyze-dataset", tags=["dataset"])
@@ -23,12 +31,16 @@ def analyze_dataset():
 
 
 @router.post("/prepare-dataset", tags=["dataset"])
-def prepare_dataset():
+def prepare_dataset(
+        codec: str = Query("stored", description="Кодек архива: stored, deflate или zstd (tar.zst)"),
+        level: int = Query(6, ge=0, le=22, description="Уровень сжатия: deflate 0-9, zstd 1-22")):
     try:
-        task = services.prepare_dataset_start()
+        task = services.prepare_dataset_start(codec=codec, level=level)
         return task
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to start prepare task: {e}")
 
@@ -41,19 +53,107 @@ def prepare_dataset_status(task_id: str):
     return st
 
 
-@router.get("/download-dataset", tags=["dataset"])
-def download_dataset():
+@router.post("/prepare-shards", tags=["dataset"])
+def prepare_shards():
+    try:
+        return services.prepare_shards_start()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to start shards task: {e}")
+
+
+@router.get("/prepare-shards/{task_id}", tags=["dataset"])
+def prepare_shards_status(task_id: str):
+    st = services.prepare_dataset_status(task_id)
+    if st is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return st
+
+
+@router.get("/shards", tags=["dataset"])
+def shards_index():
+    try:
+        return services.get_shards_index()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.get("/shards/{shard_name}", tags=["dataset"])
+def download_shard(shard_name: str):
     try:
-        archive_path = services.get_ready_zip_path()
         return FileResponse(
-            archive_path,
-            media_type="application/zip",
-            filename="dataset.zip"
+            services.get_shard_path(shard_name),
+            media_type="application/x-tar",
+            filename=shard_name
         )
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
 
+@router.post("/prepare-tensors", tags=["dataset"])
+def prepare_tensors():
+    try:
+        return services.prepare_tensors_start()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to start tensors task: {e}")
+
+
+@router.get("/prepare-tensors/{task_id}", tags=["dataset"])
+def prepare_tensors_status(task_id: str):
+    st = services.prepare_dataset_status(task_id)
+    if st is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return st
+
+
+@router.api_route("/download-dataset", methods=["GET", "HEAD"], tags=["dataset"])
+def download_dataset(request: Request,
+                     codec: str = Query("stored", description="Кодек архива, собранного в /prepare-dataset"),
+                     since: int = Query(default=None, description="Скачать только изменения после этой версии датасета")):
+    try:
+        path = services.get_delta_archive_path(since) if since is not None else None
+        plan = services.plan_download(codec=codec,
+                                      range_header=request.headers.get("range"),
+                                      if_range=request.headers.get("if-range"),
+                                      if_none_match=request.headers.get("if-none-match"),
+                                      path=path)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    return RangeFileResponse(plan["file"], plan["ranges"], plan["headers"], status_code=plan["status"],
+                             media_type=plan["media_type"], boundary=plan["boundary"],
+                             send_body=request.method != "HEAD")
+
+
+@router.get("/dataset-version", tags=["dataset"])
+def dataset_version():
+    return services.get_dataset_version()
+
+
+@router.get("/stream-dataset", tags=["dataset"])
+def stream_dataset(request: Request):
+    try:
+        plan = services.plan_stream(range_header=request.headers.get("range"),
+                                    if_range=request.headers.get("if-range"),
+                                    if_none_match=request.headers.get("if-none-match"))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    if not plan["ranges"]:
+        # 304 или 416
+        return Response(status_code=plan["status"], headers=plan["headers"])
+    media_type = plan["media_type"]
+    if plan["boundary"]:
+        media_type = f"multipart/byteranges; boundary={plan['boundary']}"
+    return StreamingResponse(services.iter_stream_plan(plan), status_code=plan["status"],
+                             media_type=media_type, headers=plan["headers"])
+
 
 @router.delete("/del-dataset", tags=["dataset"])
 def delete_dataset():
@@ -67,8 +167,70 @@ def load_frames(max_frames: int = Query(300, description="Максимум ка
                                  description=f"Количество кадров в секунду. "
                                              f"По умолчанию: {settings.FRAMES_PER_SECOND_EURO}fps euro, "
                                              f"{settings.FRAMES_PER_SECOND_BUNKER}fps bunker"),
-                video_name: str = Query(default=None, description="Скачать конкретное видео (можно скачать уже скачанное ранее)")):
-    return services.load_new_frames(max_frames=max_frames, only_cargo_type=only_cargo_type, fps=fps, video_name=video_name)
+                video_name: str = Query(default=None, description="Скачать конкретное видео (можно скачать уже скачанное ранее)"),
+                wait: bool = Query(default=False, description="Ждать завершения и вернуть результат (старое поведение)"),
+                profile: bool = Query(default=False, description="Приложить к результату сводку cProfile"),
+                triage: bool = Query(default=None,
+                                     description="Отбирать кадры классификатором: загружать неуверенные и редкие. "
+                                                 "По умолчанию — settings.FRAME_TRIAGE"),
+                preannotate: bool = Query(default=None,
+                                          description="После синхронизации отправить в Label Studio предсказания "
+                                                      "модели для новых задач. По умолчанию — settings.PREANNOTATE")):
+    params = dict(max_frames=max_frames, only_cargo_type=only_cargo_type, fps=fps, video_name=video_name,
+                  profile=profile, triage=triage, preannotate=preannotate)
+    if wait:
+        return services.load_new_frames(**params)
+    return jobs.start_job("load_frames", services.load_new_frames, **params)
+
+
+@router.post("/preannotate", tags=["frames"])
+def preannotate(backend: str = Query(default=None, description="Бэкенд инференса: eager, torchscript или onnx"),
+                overwrite: bool = Query(default=False,
+                                        description="Заменить предсказания других версий модели"),
+                dry_run: bool = Query(default=False, description="Посчитать предсказания, но не отправлять"),
+                wait: bool = Query(default=False, description="Ждать завершения и вернуть результат")):
+    params = dict(backend=backend, overwrite=overwrite, dry_run=dry_run)
+    if wait:
+        return services.preannotate_service(**params)
+    return jobs.start_job("preannotate", services.preannotate_service, **params)
+
+
+@router.post("/classify", tags=["inference"])
+def classify(files: List[UploadFile] = File(..., description="Кадры (JPEG/PNG)"),
+             backend: str = Query(default=None, description="Бэкенд инференса: eager, torchscript или onnx")):
+    try:
+        return services.classify_images_service([(f.filename, f.file.read()) for f in files], backend=backend)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/jobs", tags=["jobs"])
+def list_jobs(job_type: str = Query(default=None, description="Фильтр по типу: load_frames, build_dataset")):
+    return jobs.list_jobs(job_type)
+
+
+@router.get("/jobs/{job_id}", tags=["jobs"])
+def job_status(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}/events", tags=["jobs"])
+def job_events(job_id: str):
+    if jobs.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(jobs.job_events(job_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.delete("/jobs/{job_id}", tags=["jobs"])
+def cancel_job(job_id: str):
+    st = jobs.cancel_job(job_id)
+    if st is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return st
 
 
 @router.delete("/del-frames", tags=["frames"])
@@ -83,3 +245,10 @@ def delete_frames(
 @router.delete("/clean-download-history", tags=["service"])
 def clean_download_history():
     return services.clean_downloaded_list()
+
+
+@router.get("/metrics", tags=["service"], include_in_schema=False)
+def metrics_endpoint():
+    services.collect_queue_metrics()
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
@@ -1,15 +1,20 @@
+import hashlib
 import json
 import os
+import re
 import shutil
 import tempfile
 import threading
 import time
 import uuid
 import zipfile
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
-from typing import Optional, Dict, Any, Iterator
+from typing import Optional, Dict, Any, Iterator, List, Tuple
 
-from ls_wb_pipeline import functions, build_dataset_cls
+from ls_wb_pipeline import functions, build_dataset_cls, dataset_shards, dataset_tensors, zip_stream, parallel_archive, \
+    dataset_versions, dataset_generation, metrics
+from ls_wb_pipeline.fastapi_app import task_store
 from ls_wb_pipeline.logger import logger
 from ls_wb_pipeline import settings
 
@@ -35,213 +40,514 @@ def cleanup_frames_tasks(tasks, dry_run: bool = False, save_annotated: bool = Tr
             "dry_run": dry_run}
 
 
-def enrich_dataset_and_cleanup(dry_run: bool = True, train_ratio=0.8, test_ratio=0.1, val_ratio=0.1,
-                               del_unannotated: bool = True):
+def _run_with_profile(fn, profile: bool, **kwargs):
+    """profile=True — результат дополняется сводкой cProfile по самым тяжёлым функциям."""
+    if not profile:
+        return fn(**kwargs)
+    result, summary = metrics.profile_call(fn, **kwargs)
+    result["profile"] = summary
+    return result
+
+
+def _enrich_dataset_and_cleanup(dry_run: bool, train_ratio, test_ratio, val_ratio, del_unannotated: bool,
+                                progress_cb=None):
     report = {
         "status": "dataset built",
         "dry_run": dry_run,
         "before": None,
         "after": None
     }
-    report["before"] = analyze_dataset_service()
-
-    all_tasks = functions.get_all_tasks()
-    build_dataset_cls.build_classification_dataset(all_tasks, train_ratio=train_ratio, test_ratio=test_ratio, val_ratio=val_ratio)
-
-    if del_unannotated:
-        delete_report = cleanup_frames_tasks(all_tasks, dry_run=dry_run, save_annotated=True)
-        report["delete_report"] = delete_report
-    after = analyze_dataset_service()
-    report["after"] = after
+    with metrics.collect_timings() as timings:
+        functions.report_progress(progress_cb, "analyze_before")
+        with metrics.timer(stage="analyze"):
+            report["before"] = analyze_dataset_service()
+
+        with metrics.timer(stage="fetch_tasks"):
+            all_tasks = functions.get_all_tasks(progress_cb=progress_cb)
+        with metrics.timer(stage="build"):
+            build_dataset_cls.build_classification_dataset(all_tasks, train_ratio=train_ratio, test_ratio=test_ratio,
+                                                           val_ratio=val_ratio, progress_cb=progress_cb)
+        with metrics.timer(stage="record_version"):
+            report["version"] = record_dataset_version()
+
+        if del_unannotated:
+            functions.report_progress(progress_cb, "cleanup")
+            with metrics.timer(stage="cleanup"):
+                delete_report = cleanup_frames_tasks(all_tasks, dry_run=dry_run, save_annotated=True)
+            report["delete_report"] = delete_report
+        functions.report_progress(progress_cb, "analyze_after")
+        with metrics.timer(stage="analyze"):
+            after = analyze_dataset_service()
+        report["after"] = after
+    report["timings"] = timings
     return report
 
 
-def load_new_frames(max_frames: int = 300, only_cargo_type: str = None, fps: float = None, video_name: str = None):
-    return functions.main_process_new_frames(max_frames=max_frames, only_cargo_type=only_cargo_type, fps=fps, video_name=video_name)
+def enrich_dataset_and_cleanup(dry_run: bool = True, train_ratio=0.8, test_ratio=0.1, val_ratio=0.1,
+                               del_unannotated: bool = True, progress_cb=None, profile: bool = False):
+    return _run_with_profile(_enrich_dataset_and_cleanup, profile, dry_run=dry_run, train_ratio=train_ratio,
+                             test_ratio=test_ratio, val_ratio=val_ratio, del_unannotated=del_unannotated,
+                             progress_cb=progress_cb)
+
+
+def load_new_frames(max_frames: int = 300, only_cargo_type: str = None, fps: float = None, video_name: str = None,
+                    progress_cb=None, profile: bool = False, triage: bool = None, preannotate: bool = None):
+    return _run_with_profile(functions.main_process_new_frames, profile, max_frames=max_frames,
+                             only_cargo_type=only_cargo_type, fps=fps, video_name=video_name,
+                             progress_cb=progress_cb, triage=triage, preannotate=preannotate)
+
+
+def classify_images_service(images: List[Tuple[str, bytes]], backend: str = None):
+    """
+    Классификация присланных кадров. Кадры всех одновременных запросов собираются
+    в общие микропакеты (inference.MicroBatcher), модель — из реестра get_model.
+    """
+    import cv2
+    import numpy as np
+    from ls_wb_pipeline import inference
+
+    if backend is not None and backend not in inference.BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд {backend!r}, доступны: {', '.join(inference.BACKENDS)}")
+    samples = []
+    for name, data in images:
+        # Пустой буфер cv2.imdecode не возвращает None, а бросает cv2.error
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
+        if frame is None:
+            raise ValueError(f"Не удалось декодировать изображение {name}")
+        samples.append((name, inference.resize_frame(frame)))
+
+    batcher = inference.get_batcher(backend)
+    futures = [(name, batcher.submit(sample)) for name, sample in samples]
+    result = []
+    for name, future in futures:
+        class_id, score = future.result()
+        result.append({"file": name, "class_id": class_id, "label": inference.CLASS_NAMES[class_id],
+                       "score": round(score, 4)})
+    return {"status": "classified", "result": result}
+
+
+def preannotate_service(backend: str = None, overwrite: bool = False, dry_run: bool = False, progress_cb=None):
+    from ls_wb_pipeline import preannotate
+    return {"status": "preannotated",
+            "result": preannotate.preannotate_tasks(backend=backend, overwrite=overwrite, dry_run=dry_run,
+                                                    progress_cb=progress_cb)}
 
 
 # ==== ZIP background preparation ====
 
 _ARCHIVE_DIR = Path(getattr(settings, "DATASET_ARCHIVE_DIR",
                             Path(settings.DATASET_PATH).parent / "dataset_archives"))
-_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
 _ARCHIVE_PATH = _ARCHIVE_DIR / "dataset.zip"
 _META_PATH = _ARCHIVE_DIR / "dataset.zip.meta.json"
-_LOCK_PATH = _ARCHIVE_DIR / ".dataset_zip.lock"
-
-_TASKS: Dict[str, Dict[str, Any]] = {}
-_TASKS_LOCK = threading.Lock()
-
-
-def _count_files(root: Path) -> int:
-    total = 0
-    for dp, _, fns in os.walk(root):
-        total += len(fns)
-    return total
-
-
-def _latest_mtime(root: Path) -> float:
-    latest = 0.0
+_MANIFEST_PATH = _ARCHIVE_DIR / "dataset.zip.manifest.json"
+_CRC_CACHE_PATH = _ARCHIVE_DIR / "stream_crc.json"
+_VERSIONS_DIR = _ARCHIVE_DIR / "versions"
+_DELTAS_DIR = _ARCHIVE_DIR / "deltas"
+_VERSIONS_LOCK_NAME = "dataset_versions"
+_DELTAS_LOCK_NAME = "dataset_deltas"
+_LOCK_NAME = "dataset_zip"
+_SHARDS_DIR = _ARCHIVE_DIR / "shards"
+_SHARDS_LOCK_NAME = "dataset_shards"
+_TENSORS_DIR = _ARCHIVE_DIR / "tensors"
+_TENSORS_LOCK_NAME = "dataset_tensors"
+SHARD_SIZE = int(getattr(settings, "DATASET_SHARD_SIZE", 1000))
+SHARD_WORKERS = int(getattr(settings, "DATASET_SHARD_WORKERS", min(8, os.cpu_count() or 1)))
+ARCHIVE_WORKERS = int(getattr(settings, "DATASET_ARCHIVE_WORKERS", os.cpu_count() or 1))
+TENSOR_WORKERS = int(getattr(settings, "DATASET_TENSOR_WORKERS", os.cpu_count() or 1))
+
+# Статусы задач и локи сборок — в общем task_store (SQLite, см. task_store.get_task_store)
+LOCK_TTL = task_store.LOCK_TTL
+LOCK_WAIT = task_store.LOCK_WAIT
+
+
+def _ensure_archive_dir():
+    _ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def _scan_dataset(root: Path) -> Dict[str, List[float]]:
+    """Снимок датасета: {arcname: [size, mtime]} за один проход по дереву.
+    Служебные скрытые файлы (.split_state.json и т.п.) в архив не попадают."""
+    snapshot = {}
     for dp, _, fns in os.walk(root):
         for f in fns:
-            p = os.path.join(dp, f)
+            if f.startswith("."):
+                continue
+            full = os.path.join(dp, f)
             try:
-                m = os.path.getmtime(p)
-                if m > latest:
-                    latest = m
+                st = os.stat(full)
             except FileNotFoundError:
                 continue
-    return latest
+            snapshot[os.path.relpath(full, root)] = [st.st_size, st.st_mtime]
+    return snapshot
 
 
-def _need_rebuild(dataset_dir: Path, archive_path: Path, meta_path: Path) -> bool:
-    if not archive_path.exists() or not meta_path.exists():
-        return True
+def _load_manifest(manifest_path: Path) -> Optional[Dict[str, List[float]]]:
+    if not manifest_path.exists():
+        return None
     try:
-        meta = json.loads(meta_path.read_text() or "{}")
+        return json.loads(manifest_path.read_text(encoding="utf-8") or "{}")
     except Exception:
-        return True
-    latest = _latest_mtime(dataset_dir)
-    return float(meta.get("latest_mtime", 0)) < latest
-
-
-def _write_meta(dataset_dir: Path):
-    meta = {"latest_mtime": _latest_mtime(dataset_dir), "built_at": time.time()}
-    _META_PATH.write_text(json.dumps(meta, ensure_ascii=False))
+        return None
 
 
-def _acquire_lock() -> bool:
+def _zip_update_plan(current: Dict[str, List[float]], archive_path: Path, meta_path: Path,
+                     manifest_path: Path):
+    """
+    Сравнивает текущий снимок датасета с манифестом уже упакованного архива.
+    Возвращает (mode, to_add): mode — "fresh" (ничего не менялось),
+    "append" (только добавленные файлы) или "rebuild" (удаления/изменения).
+    """
+    if not archive_path.exists() or not meta_path.exists():
+        return "rebuild", sorted(current)
+    manifest = _load_manifest(manifest_path)
+    if manifest is None:
+        return "rebuild", sorted(current)
+    for arcname, (size, mtime) in manifest.items():
+        cur = current.get(arcname)
+        if cur is None or cur[0] != size or cur[1] != mtime:
+            return "rebuild", sorted(current)
+    to_add = sorted(arcname for arcname in current if arcname not in manifest)
+    return ("append" if to_add else "fresh"), to_add
+
+
+def _is_archive_fresh(archive_path: Path, meta_path: Path, fingerprint: str) -> bool:
+    """O(1)-проверка: архив собран с того же поколения датасета."""
+    if not archive_path.exists() or not meta_path.exists():
+        return False
     try:
-        fd = os.open(_LOCK_PATH, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-        os.close(fd)
-        return True
-    except FileExistsError:
+        meta = json.loads(meta_path.read_text() or "{}")
+    except Exception:
         return False
+    return meta.get("fingerprint") == fingerprint
 
 
-def _release_lock():
-    try:
-        _LOCK_PATH.unlink()
-    except FileNotFoundError:
-        pass
+def _need_rebuild(dataset_dir: Path, archive_path: Path, meta_path: Path) -> bool:
+    if _is_archive_fresh(archive_path, meta_path, dataset_generation.dataset_fingerprint(dataset_dir)):
+        return False
+    mode, _ = _zip_update_plan(_scan_dataset(dataset_dir), archive_path, meta_path, _MANIFEST_PATH)
+    return mode != "fresh"
 
 
-def _zip_build_worker(task_id: str, dataset_dir: Path):
-    with _TASKS_LOCK:
-        task = _TASKS.get(task_id)
-        if not task:
-            return
-        task.update({"status": "running", "progress": 0, "detail": "Initializing"})
+def _write_meta(snapshot: Dict[str, List[float]], meta_path: Path = _META_PATH,
+                manifest_path: Path = _MANIFEST_PATH, version: Optional[int] = None,
+                fingerprint: Optional[str] = None):
+    latest = max((mtime for _, mtime in snapshot.values()), default=0.0)
+    meta = {"latest_mtime": latest, "files": len(snapshot), "built_at": time.time(), "version": version,
+            "fingerprint": fingerprint}
+    # Сначала манифест, мета — последней: по ней архив считается готовым
+    _write_text_atomic(manifest_path, json.dumps(snapshot, ensure_ascii=False))
+    _write_text_atomic(meta_path, json.dumps(meta, ensure_ascii=False))
 
-    total_files = _count_files(dataset_dir)
-    if total_files == 0:
-        with _TASKS_LOCK:
-            _TASKS[task_id].update({"status": "error", "error": "Dataset is empty"})
-        return
 
-    waited = 0
-    while not _acquire_lock():
-        time.sleep(0.5)
-        waited += 0.5
-        if waited > 300:
-            with _TASKS_LOCK:
-                _TASKS[task_id].update({"status": "error", "error": "Timeout waiting for another build"})
-            return
+def _write_text_atomic(path: Path, text: str):
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
 
-    try:
-        if not _need_rebuild(dataset_dir, _ARCHIVE_PATH, _META_PATH):
-            with _TASKS_LOCK:
-                _TASKS[task_id].update({
-                    "status": "done",
-                    "progress": 100,
-                    "result": {"archive_path": str(_ARCHIVE_PATH)}
-                })
-            return
 
-        tmp_path = _ARCHIVE_PATH.with_suffix(".zip.tmp")
-        if tmp_path.exists():
+def _zip_build_worker(task_id: str, dataset_dir: Path):
+    def build(on_progress):
+        # Отпечаток берём до обхода: изменения во время упаковки дадут несовпадение в следующий раз
+        fingerprint = dataset_generation.dataset_fingerprint(dataset_dir)
+        if _is_archive_fresh(_ARCHIVE_PATH, _META_PATH, fingerprint):
+            return {"archive_path": str(_ARCHIVE_PATH)}
+
+        snapshot = _scan_dataset(dataset_dir)
+        if not snapshot:
+            raise ValueError("Dataset is empty")
+
+        version = _record_version(snapshot, fingerprint)["version"]
+        mode, to_add = _zip_update_plan(snapshot, _ARCHIVE_PATH, _META_PATH, _MANIFEST_PATH)
+        if mode == "fresh":
+            _write_meta(snapshot, version=version, fingerprint=fingerprint)
+            return {"archive_path": str(_ARCHIVE_PATH)}
+
+        target_path = _ARCHIVE_PATH.with_suffix(".zip.tmp")
+        if target_path.exists():
             try:
-                tmp_path.unlink()
+                target_path.unlink()
             except FileNotFoundError:
                 pass
+        if mode == "append":
+            # Дописываем новые файлы в копию: живой архив могут в это время отдавать
+            # (в т.ч. докачкой по Range), его central directory трогать нельзя
+            shutil.copyfile(_ARCHIVE_PATH, target_path)
+            zip_mode = "a"
+        else:
+            zip_mode = "w"
 
+        total_files = len(to_add)
         written = 0
-        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as zf:
-            root = Path(dataset_dir)
-            for dp, _, fns in os.walk(root):
-                for f in fns:
-                    full = Path(dp) / f
-                    arcname = str(full.relative_to(root))
-                    try:
-                        zf.write(full, arcname)
-                    except FileNotFoundError:
-                        continue
-                    written += 1
-                    if written % 50 == 0 or written == total_files:
-                        with _TASKS_LOCK:
-                            _TASKS[task_id].update({
-                                "status": "running",
-                                "progress": int(written * 100 / max(1, total_files)),
-                                "detail": f"Packed {written}/{total_files} files"
-                            })
-
-        tmp_path.replace(_ARCHIVE_PATH)
-        _write_meta(dataset_dir)
-
-        with _TASKS_LOCK:
-            _TASKS[task_id].update({
-                "status": "done",
-                "progress": 100,
-                "result": {"archive_path": str(_ARCHIVE_PATH)}
-            })
-    except Exception as e:
-        logger.exception("ZIP build failed")
-        with _TASKS_LOCK:
-            _TASKS[task_id].update({"status": "error", "error": str(e)})
-    finally:
-        _release_lock()
-
-
-def prepare_dataset_start() -> Dict[str, Any]:
+        packed = {}
+        root = Path(dataset_dir)
+        with zipfile.ZipFile(target_path, zip_mode, compression=zipfile.ZIP_STORED) as zf:
+            for arcname in to_add:
+                try:
+                    zf.write(root / arcname, arcname)
+                except FileNotFoundError:
+                    continue
+                packed[arcname] = snapshot[arcname]
+                written += 1
+                if written % 50 == 0 or written == total_files:
+                    on_progress(written, total_files, f"files ({mode})")
+
+        metrics.inc("archive_packed_files", written, kind=_LOCK_NAME)
+        metrics.inc("archive_packed_bytes", sum(size for size, _ in packed.values()), kind=_LOCK_NAME)
+        if mode == "append":
+            manifest = _load_manifest(_MANIFEST_PATH) or {}
+            manifest.update(packed)
+        else:
+            manifest = packed
+        # Открытые загрузки дочитывают старый inode, новые получают целый архив
+        os.replace(target_path, _ARCHIVE_PATH)
+        _write_meta(manifest, version=version, fingerprint=fingerprint)
+        return {"archive_path": str(_ARCHIVE_PATH), "mode": mode, "packed": written}
+
+    _locked_build_worker(task_id, _LOCK_NAME, build, "ZIP build")
+
+
+def _archive_paths(codec: str):
+    """(архив, meta, manifest, имя лока) для выбранного кодека."""
+    if codec == "stored":
+        return _ARCHIVE_PATH, _META_PATH, _MANIFEST_PATH, _LOCK_NAME
+    archive_path = _ARCHIVE_DIR / parallel_archive.ARCHIVE_NAMES[codec]
+    return (archive_path,
+            archive_path.with_name(archive_path.name + ".meta.json"),
+            archive_path.with_name(archive_path.name + ".manifest.json"),
+            f"dataset_{codec}")
+
+
+def _compressed_build_worker(task_id: str, dataset_dir: Path, codec: str, level: int):
+    archive_path, meta_path, manifest_path, lock_name = _archive_paths(codec)
+
+    def build(on_progress):
+        fingerprint = dataset_generation.dataset_fingerprint(dataset_dir)
+        if _is_archive_fresh(archive_path, meta_path, fingerprint):
+            return {"archive_path": str(archive_path), "codec": codec}
+        snapshot = _scan_dataset(dataset_dir)
+        if not snapshot:
+            raise ValueError("Dataset is empty")
+        version = _record_version(snapshot, fingerprint)["version"]
+        mode, _ = _zip_update_plan(snapshot, archive_path, meta_path, manifest_path)
+        if mode == "fresh":
+            _write_meta(snapshot, meta_path, manifest_path, version=version, fingerprint=fingerprint)
+            return {"archive_path": str(archive_path), "codec": codec}
+        result = parallel_archive.build_archive(
+            dataset_dir, archive_path, snapshot, codec=codec, level=level, workers=ARCHIVE_WORKERS,
+            progress_cb=lambda done, total: on_progress(done, total, "files"))
+        metrics.inc("archive_packed_files", len(snapshot), kind=lock_name)
+        metrics.inc("archive_packed_bytes", sum(size for size, _ in snapshot.values()), kind=lock_name)
+        _write_meta(snapshot, meta_path, manifest_path, version=version, fingerprint=fingerprint)
+        return result
+
+    _locked_build_worker(task_id, lock_name, build, f"Archive build ({codec})")
+
+
+def prepare_dataset_start(codec: str = "stored", level: int = 6) -> Dict[str, Any]:
     dataset_dir = Path(settings.DATASET_PATH)
     if not dataset_dir.exists():
         raise FileNotFoundError("Датасет ещё не создан.")
+    # Проверяем сразу: иначе неверный уровень всплывёт только ошибкой фоновой задачи
+    parallel_archive.check_codec(codec, level)
+
+    if codec == "stored":
+        # ZIP_STORED собирается инкрементально (дописываются только новые файлы)
+        return _start_background_task(_zip_build_worker, dataset_dir)
+    return _start_background_task(_compressed_build_worker, dataset_dir, codec, level)
+
+
+def prepare_dataset_status(task_id: str) -> Optional[Dict[str, Any]]:
+    return task_store.get_task_store().get(task_id)
+
+
+def get_ready_zip_path(codec: str = "stored") -> str:
+    if codec not in parallel_archive.CODECS:
+        raise FileNotFoundError(f"Неизвестный codec {codec}.")
+    archive_path = _archive_paths(codec)[0]
+    if not archive_path.exists():
+        raise FileNotFoundError("Архив ещё не готов. Сначала вызовите /prepare-dataset и дождитесь статуса done.")
+    return str(archive_path)
+
+
+# ==== Tar shards (WebDataset-style) export ====
+
+def _read_export_fingerprint(export_dir: Path) -> Optional[str]:
+    try:
+        return (export_dir / ".fingerprint").read_text()
+    except FileNotFoundError:
+        return None
+
+
+def _write_export_fingerprint(export_dir: Path, fingerprint: str):
+    (export_dir / ".fingerprint").write_text(fingerprint)
+
+
+def _locked_build_worker(task_id: str, lock_name: str, build_fn, error_label: str):
+    """Общая обвязка фоновых сборок: аренда лока, прогресс в хранилище задач, обработка ошибок.
+    build_fn(on_progress) -> dict результата."""
+    if task_store.get_task_store().update(task_id, {"status": "running", "progress": 0, "detail": "Initializing"}) is None:
+        return
 
+    last_update = [0.0]
+
+    def on_progress(done: int, total: int, unit: str = "items"):
+        # Прогресс пишется в общую базу, поэтому не чаще пары раз в секунду
+        now = time.monotonic()
+        if done < total and now - last_update[0] < 0.5:
+            return
+        last_update[0] = now
+        task_store.get_task_store().update(task_id, {
+            "status": "running",
+            "progress": int(done * 100 / total) if total else 100,
+            "detail": f"Written {done}/{total} {unit}"
+        })
+
+    with task_store.get_task_store().heartbeat(task_id), task_store.get_task_store().lease(lock_name, ttl=LOCK_TTL, wait=LOCK_WAIT) as acquired:
+        if not acquired:
+            task_store.get_task_store().update(task_id, {"status": "error", "error": "Timeout waiting for another build"})
+            return
+        try:
+            with metrics.timer("archive_build_seconds", kind=lock_name):
+                result = build_fn(on_progress)
+            task_store.get_task_store().update(task_id, {"status": "done", "progress": 100, "result": result})
+        except Exception as e:
+            logger.exception(f"{error_label} failed")
+            task_store.get_task_store().update(task_id, {"status": "error", "error": str(e)})
+
+
+def _start_background_task(target, *args) -> Dict[str, Any]:
     task_id = uuid.uuid4().hex
-    with _TASKS_LOCK:
-        _TASKS[task_id] = {"status": "queued", "progress": 0, "created_at": time.time()}
+    task_store.get_task_store().create(task_id, {"status": "queued", "progress": 0, "created_at": time.time()})
 
-    t = threading.Thread(target=_zip_build_worker, args=(task_id, dataset_dir), daemon=True)
+    t = threading.Thread(target=target, args=(task_id, *args), daemon=True)
     t.start()
 
     return {"task_id": task_id, "status": "queued"}
 
 
-def prepare_dataset_status(task_id: str) -> Optional[Dict[str, Any]]:
-    with _TASKS_LOCK:
-        return _TASKS.get(task_id)
+def collect_queue_metrics():
+    """Глубина очередей берётся из общего хранилища задач — одинакова для всех воркеров."""
+    if not metrics.ENABLED:
+        return
+    counts = task_store.get_task_store().count_active()
+    for task_type in {"build", *(t for t, _ in counts)}:
+        for status in task_store.ACTIVE_STATUSES:
+            metrics.set_gauge("queue_depth", counts.get((task_type, status), 0), queue=task_type, status=status)
 
 
-def get_ready_zip_path() -> str:
-    if not _ARCHIVE_PATH.exists():
-        raise FileNotFoundError("Архив ещё не готов. Сначала вызовите /prepare-dataset и дождитесь статуса done.")
-    return str(_ARCHIVE_PATH)
+def _shards_build_worker(task_id: str, dataset_dir: Path):
+    def build(on_progress):
+        fingerprint = dataset_generation.dataset_fingerprint(dataset_dir)
+        if _read_export_fingerprint(_SHARDS_DIR) == fingerprint:
+            return {"shards_dir": str(_SHARDS_DIR), "written_shards": 0}
+        summary = dataset_shards.build_shards(
+            dataset_dir, _SHARDS_DIR, shard_size=SHARD_SIZE, workers=SHARD_WORKERS,
+            progress_cb=lambda done, total: on_progress(done, total, "shards"))
+        _write_export_fingerprint(_SHARDS_DIR, fingerprint)
+        return {"shards_dir": str(_SHARDS_DIR), "written_shards": summary["written_shards"]}
+
+    _locked_build_worker(task_id, _SHARDS_LOCK_NAME, build, "Shards build")
+
+
+def prepare_shards_start() -> Dict[str, Any]:
+    dataset_dir = Path(settings.DATASET_PATH)
+    if not dataset_dir.exists():
+        raise FileNotFoundError("Датасет ещё не создан.")
+    return _start_background_task(_shards_build_worker, dataset_dir)
+
+
+def get_shards_index() -> Dict[str, Any]:
+    index_path = _SHARDS_DIR / dataset_shards.INDEX_FILE
+    if not index_path.exists():
+        raise FileNotFoundError("Шарды ещё не готовы. Сначала вызовите /prepare-shards.")
+    return json.loads(index_path.read_text(encoding="utf-8"))
+
+
+def get_shard_path(shard_name: str) -> str:
+    path = _SHARDS_DIR / os.path.basename(shard_name)
+    if not shard_name.endswith(".tar") or not path.exists():
+        raise FileNotFoundError(f"Шард {shard_name} не найден.")
+    return str(path)
+
+
+# ==== Preprocessed memmap tensors export ====
+
+def _tensors_build_worker(task_id: str, dataset_dir: Path):
+    def build(on_progress):
+        fingerprint = dataset_generation.dataset_fingerprint(dataset_dir)
+        if _read_export_fingerprint(_TENSORS_DIR) == fingerprint:
+            return {"tensors_dir": str(_TENSORS_DIR), "added": 0}
+        summary = dataset_tensors.build_tensors(
+            dataset_dir, _TENSORS_DIR, workers=TENSOR_WORKERS,
+            progress_cb=lambda done, total: on_progress(done, total, "images"))
+        _write_export_fingerprint(_TENSORS_DIR, fingerprint)
+        return {"tensors_dir": str(_TENSORS_DIR), **summary}
+
+    _locked_build_worker(task_id, _TENSORS_LOCK_NAME, build, "Tensors build")
+
+
+def prepare_tensors_start() -> Dict[str, Any]:
+    dataset_dir = Path(settings.DATASET_PATH)
+    if not dataset_dir.exists():
+        raise FileNotFoundError("Датасет ещё не создан.")
+    return _start_background_task(_tensors_build_worker, dataset_dir)
 
 
 # ===== Streaming download helpers =====
 
 CHUNK_SIZE = int(getattr(settings, "DOWNLOAD_CHUNK_SIZE", 1024 * 1024))  # 1 MiB default
+# Больше диапазонов в одном Range — заголовок игнорируется (отдаём целиком), без multipart-раздувания
+MAX_RANGES = int(getattr(settings, "DOWNLOAD_MAX_RANGES", 16))
+_RANGE_PART_RE = re.compile(r"^(\d*)-(\d*)$")
 
-def get_download_headers_and_path():
-    path = get_ready_zip_path()
-    stat = os.stat(path)
+def _read_archive_meta(codec: str) -> Dict[str, Any]:
+    try:
+        return json.loads(_archive_paths(codec)[1].read_text() or "{}")
+    except Exception:
+        return {}
+
+
+def get_archive_etag(path: str, meta: Optional[Dict[str, Any]] = None, stat: Optional[os.stat_result] = None) -> str:
+    """Сильный ETag архива: из его меты (время сборки, число файлов) и размера."""
+    stat = stat or os.stat(path)
+    meta = meta or {}
+    raw = f"{meta.get('built_at', stat.st_mtime)}-{meta.get('files', 0)}-{stat.st_size}-{stat.st_mtime_ns}"
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+def _download_headers(path: str, stat: os.stat_result, meta: Dict[str, Any]) -> Dict[str, str]:
     headers = {
         "Content-Length": str(stat.st_size),
-        "Content-Disposition": 'attachment; filename="dataset.zip"',
+        "Content-Disposition": f'attachment; filename="{os.path.basename(path)}"',
         "Accept-Ranges": "bytes",
         "Cache-Control": "no-store",
+        "ETag": get_archive_etag(path, meta, stat),
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
     }
-    return path, stat.st_size, headers
+    if meta.get("version") is not None:
+        headers["X-Dataset-Version"] = str(meta["version"])
+    return headers
+
+
+def get_download_headers_and_path(codec: str = "stored", path: Optional[str] = None):
+    """Заголовки для отдачи архива кодека codec (или произвольного готового файла path)."""
+    meta = {}
+    if path is None:
+        path = get_ready_zip_path(codec)
+        meta = _read_archive_meta(codec)
+    stat = os.stat(path)
+    return path, stat.st_size, _download_headers(path, stat, meta)
+
+
+def iter_fd(f, start: int, end: int) -> Iterator[bytes]:
+    """Байты [start, end] уже открытого файла через os.pread — без повторного open по пути."""
+    fd = f.fileno()
+    while start <= end:
+        data = os.pread(fd, min(CHUNK_SIZE, end - start + 1), start)
+        if not data:
+            break
+        yield data
+        start += len(data)
 
 
 def iter_file(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
@@ -280,14 +586,260 @@ def parse_range_header(range_header: str, total_size: int):
         return None, None
 
 
-def build_range_headers(start: int, end: int, total: int):
-    return {
+def build_range_headers(start: int, end: int, total: int, filename: str = "dataset.zip",
+                        etag: Optional[str] = None):
+    headers = {
         "Content-Range": f"bytes {start}-{end}/{total}",
         "Content-Length": str(end - start + 1),
         "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Cache-Control": "no-store",
+    }
+    if etag:
+        headers["ETag"] = etag
+    return headers
+
+
+def parse_ranges(range_header: str, total_size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Разбирает Range с несколькими диапазонами.
+    None — заголовок не в байтах, без единого корректного диапазона или с числом диапазонов
+    больше MAX_RANGES (игнорируем), [] — ни одного выполнимого (416).
+    Синтаксически неверные части пропускаются. Пересекающиеся и соседние диапазоны склеиваются.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    parts = [part.strip() for part in spec.split(",") if part.strip()]
+    if len(parts) > MAX_RANGES:
+        return None
+    ranges, valid = [], 0
+    for part in parts:
+        match = _RANGE_PART_RE.match(part)
+        if not match or part == "-" or (match.group(1) and match.group(2)
+                                        and int(match.group(2)) < int(match.group(1))):
+            continue
+        valid += 1
+        start, end = parse_range_header(f"bytes={part}", total_size)
+        if start is not None:
+            ranges.append((start, end))
+    if not valid:
+        return None
+    ranges.sort()
+    merged: List[Tuple[int, int]] = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_matches(if_range: str, etag: str, mtime: Optional[float]) -> bool:
+    if_range = if_range.strip()
+    if if_range.startswith(("\"", "W/")):
+        return if_range == etag
+    if mtime is None:
+        # Без Last-Modified дата ничего не подтверждает
+        return False
+    try:
+        # RFC 9110 §13.1.5: дата в If-Range должна точно совпасть с Last-Modified
+        return int(mtime) == int(parsedate_to_datetime(if_range).timestamp())
+    except Exception:
+        return False
+
+
+def plan_ranges(total: int, headers: Dict[str, str], filename: str, media_type: str,
+                range_header: Optional[str] = None, if_range: Optional[str] = None,
+                if_none_match: Optional[str] = None, mtime: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Решает, как отдавать ресурс размером total с заголовками полного ответа headers (в них есть ETag):
+    целиком (200), одним (206) или несколькими диапазонами (206 multipart/byteranges), 304 или 416.
+    mtime — момент Last-Modified для If-Range с датой (None — такой If-Range не совпадает никогда).
+    Возвращает {"status", "headers", "ranges", "boundary", "media_type"}.
+    """
+    etag = headers["ETag"]
+    validators = {key: headers[key] for key in ("ETag", "Last-Modified") if key in headers}
+    plan = {"status": 200, "headers": headers, "ranges": [(0, total - 1)] if total else [],
+            "boundary": None, "media_type": media_type}
+
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")] + ["*"]:
+        plan.update({"status": 304, "ranges": [], "headers": validators})
+        return plan
+    if not range_header:
+        return plan
+    if if_range and not _if_range_matches(if_range, etag, mtime):
+        # Ресурс поменялся с момента начала загрузки — отдаём целиком
+        return plan
+
+    ranges = parse_ranges(range_header, total)
+    if ranges is None:
+        return plan
+    if not ranges:
+        plan.update({"status": 416, "ranges": [],
+                     "headers": {"Content-Range": f"bytes */{total}", "ETag": etag}})
+        return plan
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        range_headers = build_range_headers(start, end, total, filename=filename, etag=etag)
+        range_headers.update(validators)
+        plan.update({"status": 206, "ranges": ranges, "headers": range_headers})
+        return plan
+
+    boundary = uuid.uuid4().hex
+    length = sum(len(multipart_part_header(boundary, media_type, start, end, total)) + end - start + 1
+                 for start, end in ranges) + len(multipart_tail(boundary))
+    plan.update({
+        "status": 206,
+        "ranges": ranges,
+        "boundary": boundary,
+        "headers": {
+            "Content-Length": str(length),
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+            **validators,
+        },
+    })
+    return plan
+
+
+def plan_download(codec: str = "stored", range_header: Optional[str] = None,
+                  if_range: Optional[str] = None, if_none_match: Optional[str] = None,
+                  path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    План отдачи готового архива (см. plan_ranges).
+    Файл открывается здесь один раз, заголовки строятся по его fstat: если архив подменят
+    через os.replace посреди ответа, все части отдаются из того же inode, что описан в ETag.
+    Возвращает {"status", "path", "file", "headers", "ranges", "boundary", "media_type"};
+    file закрывает тот, кто отдаёт ответ.
+    """
+    meta = {}
+    if path is None:
+        path = get_ready_zip_path(codec)
+        meta = _read_archive_meta(codec)
+    f = open(path, "rb")
+    try:
+        stat = os.fstat(f.fileno())
+        filename = os.path.basename(path)
+        media_type = "application/zstd" if filename.endswith(".zst") else "application/zip"
+        plan = plan_ranges(stat.st_size, _download_headers(path, stat, meta), filename, media_type,
+                           range_header, if_range, if_none_match, mtime=stat.st_mtime)
+    except BaseException:
+        f.close()
+        raise
+    plan.update({"path": path, "file": f})
+    return plan
+
+
+def multipart_part_header(boundary: str, media_type: str, start: int, end: int, total: int) -> bytes:
+    return (f"\r\n--{boundary}\r\nContent-Type: {media_type}\r\n"
+            f"Content-Range: bytes {start}-{end}/{total}\r\n\r\n").encode("latin-1")
+
+
+def multipart_tail(boundary: str) -> bytes:
+    return f"\r\n--{boundary}--\r\n".encode("latin-1")
+
+
+# ===== Dataset versions and delta archives =====
+
+def record_dataset_version() -> Dict[str, int]:
+    """Фиксирует текущее состояние датасета как новое поколение (если оно изменилось)."""
+    dataset_dir = Path(settings.DATASET_PATH)
+    fingerprint = dataset_generation.dataset_fingerprint(dataset_dir)
+    if dataset_versions.recorded_fingerprint(_VERSIONS_DIR) == fingerprint:
+        return {"version": dataset_versions.current_version(_VERSIONS_DIR), "added": 0, "removed": 0}
+    snapshot = _scan_dataset(dataset_dir) if dataset_dir.exists() else {}
+    return _record_version(snapshot, fingerprint)
+
+
+def _record_version(snapshot: Dict[str, List[float]], fingerprint: Optional[str]) -> Dict[str, int]:
+    """record_version под общей арендой: index.json и snapshot.json меняет один писатель на все процессы."""
+    with task_store.get_task_store().lease(_VERSIONS_LOCK_NAME, ttl=LOCK_TTL, wait=LOCK_WAIT) as acquired:
+        if not acquired:
+            raise TimeoutError("Timeout waiting for dataset version lock")
+        return dataset_versions.record_version(_VERSIONS_DIR, snapshot, fingerprint)
+
+
+def get_dataset_version() -> Dict[str, Any]:
+    return {"version": dataset_versions.current_version(_VERSIONS_DIR)}
+
+
+def get_delta_archive_path(since: int) -> str:
+    """
+    ZIP с изменениями после версии since (ValueError/FileNotFoundError, если дельта невозможна;
+    TimeoutError, если не дождались чужой сборки).
+    """
+    dataset_dir = Path(settings.DATASET_PATH)
+    if not dataset_dir.exists():
+        raise FileNotFoundError("Датасет ещё не создан.")
+    record_dataset_version()
+    # Одна сборка дельты на все процессы: параллельные запросы той же версии дождутся кеша
+    with task_store.get_task_store().lease(_DELTAS_LOCK_NAME, ttl=LOCK_TTL, wait=LOCK_WAIT) as acquired:
+        if not acquired:
+            raise TimeoutError("Timeout waiting for another delta build")
+        with metrics.timer("archive_build_seconds", kind=_DELTAS_LOCK_NAME):
+            return str(dataset_versions.build_delta_archive(dataset_dir, _VERSIONS_DIR, _DELTAS_DIR, since))
+
+
+# ===== On-the-fly ZIP streaming (без промежуточного архива) =====
+
+_CRC_CACHE: Optional[zip_stream.CrcCache] = None
+_CRC_CACHE_LOCK = threading.Lock()
+
+
+def _get_crc_cache() -> zip_stream.CrcCache:
+    global _CRC_CACHE
+    with _CRC_CACHE_LOCK:
+        if _CRC_CACHE is None:
+            _ensure_archive_dir()
+            _CRC_CACHE = zip_stream.CrcCache(_CRC_CACHE_PATH)
+        return _CRC_CACHE
+
+
+def get_stream_layout() -> zip_stream.ZipLayout:
+    dataset_dir = Path(settings.DATASET_PATH)
+    if not dataset_dir.exists():
+        raise FileNotFoundError("Датасет ещё не создан.")
+    snapshot = _scan_dataset(dataset_dir)
+    if not snapshot:
+        raise FileNotFoundError("Датасет пуст.")
+    crc_cache = _get_crc_cache()
+    crc_cache.retain(snapshot)
+    return zip_stream.ZipLayout(dataset_dir, snapshot, crc_cache, iter_file)
+
+
+def plan_stream(range_header: Optional[str] = None, if_range: Optional[str] = None,
+                if_none_match: Optional[str] = None) -> Dict[str, Any]:
+    """
+    План отдачи архива, собираемого на лету (см. plan_ranges). ETag — отпечаток снимка датасета,
+    поэтому докачка с устаревшим If-Range получает архив целиком, а не куски двух разных раскладок.
+    Last-Modified не отдаётся: удаление файла его бы не сдвинуло.
+    """
+    layout = get_stream_layout()
+    headers = {
+        "Content-Length": str(layout.total_size),
         "Content-Disposition": 'attachment; filename="dataset.zip"',
+        "Accept-Ranges": "bytes",
         "Cache-Control": "no-store",
+        "ETag": layout.etag,
     }
+    plan = plan_ranges(layout.total_size, headers, "dataset.zip", "application/zip",
+                       range_header, if_range, if_none_match)
+    plan["layout"] = layout
+    return plan
+
+
+def iter_stream_plan(plan: Dict[str, Any]) -> Iterator[bytes]:
+    """Тело ответа по plan_stream: диапазоны раскладки, для нескольких — multipart/byteranges."""
+    layout, boundary = plan["layout"], plan["boundary"]
+    for start, end in plan["ranges"]:
+        if boundary:
+            yield multipart_part_header(boundary, plan["media_type"], start, end, layout.total_size)
+        yield from layout.iter_range(start, end)
+    if boundary:
+        yield multipart_tail(boundary)
 
 
 # ===== Legacy endpoints kept for compatibility =====
@@ -310,8 +862,25 @@ def delete_dataset_service():
                 _ARCHIVE_PATH.unlink()
             if _META_PATH.exists():
                 _META_PATH.unlink()
+            if _MANIFEST_PATH.exists():
+                _MANIFEST_PATH.unlink()
+            for codec in parallel_archive.CODECS:
+                for path in _archive_paths(codec)[:3]:
+                    if path.exists():
+                        path.unlink()
+            if _SHARDS_DIR.exists():
+                shutil.rmtree(_SHARDS_DIR)
+            if _TENSORS_DIR.exists():
+                shutil.rmtree(_TENSORS_DIR)
+            if _DELTAS_DIR.exists():
+                shutil.rmtree(_DELTAS_DIR)
+        except Exception:
+            logger.exception("Не удалось удалить производные архивы датасета")
+        try:
+            # Удаление тоже поколение: клиенты с дельтами получат полный список удалений
+            _record_version({}, dataset_generation.dataset_fingerprint(settings.DATASET_PATH))
         except Exception:
-            pass
+            logger.exception("Не удалось записать версию датасета после удаления")
         return {"status": "Датасет успешно удален", "path": settings.DATASET_PATH}
     else:
         return {"status": "Датасет не найден", "path": settings.DATASET_PATH}
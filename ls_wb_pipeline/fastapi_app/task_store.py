@@ -0,0 +1,222 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from ls_wb_pipeline import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    heartbeat_at REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+ACTIVE_STATUSES = ("queued", "running")
+
+# Статусы задач и локи сборок живут в SQLite (WAL), общем для всех воркеров uvicorn:
+# статус виден из любого процесса, а лок упавшего процесса истекает сам через LOCK_TTL
+LOCK_TTL = float(getattr(settings, "BUILD_LOCK_TTL", 60))
+LOCK_WAIT = float(getattr(settings, "BUILD_LOCK_WAIT", 300))
+TASKS_RETENTION = float(getattr(settings, "TASKS_RETENTION", 7 * 24 * 3600))
+# База задач создаётся при первом обращении, а не при импорте модуля
+_TASK_STORE: Optional["TaskStore"] = None
+_TASK_STORE_LOCK = threading.Lock()
+
+
+class TaskStore:
+    """
+    Общее для всех воркеров uvicorn хранилище статусов задач и локов (SQLite, WAL).
+    Локи — аренды с истечением: упавший процесс не держит лок вечно.
+    Задачи, чей процесс перестал слать heartbeat, помечаются как потерянные.
+    """
+
+    def __init__(self, db_path, heartbeat_ttl: float = 60.0):
+        self.db_path = str(db_path)
+        self.heartbeat_ttl = heartbeat_ttl
+        self._local = threading.local()
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---- Задачи ----
+
+    def create(self, task_id: str, data: Dict[str, Any]):
+        now = time.time()
+        data = dict(data)
+        data.setdefault("created_at", now)
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO tasks (id, data, heartbeat_at, created_at) VALUES (?, ?, ?, ?)",
+                         (task_id, json.dumps(data, ensure_ascii=False, default=str), now, data["created_at"]))
+
+    def _decode(self, data: str, heartbeat_at: float) -> Dict[str, Any]:
+        task = json.loads(data)
+        if task.get("status") in ACTIVE_STATUSES and time.time() - heartbeat_at > self.heartbeat_ttl:
+            task["status"] = "error"
+            task["error"] = "Worker process stopped responding"
+        return task
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT data, heartbeat_at FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return self._decode(*row) if row else None
+
+    def modify(self, task_id: str, fn: Callable[[Dict[str, Any]], None],
+               touch: bool = True) -> Optional[Dict[str, Any]]:
+        """Атомарно читает задачу, передаёт её в fn для изменения и сохраняет.
+        touch=False — правка из чужого процесса (например, отмена), heartbeat не обновляется."""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            if not row:
+                return None
+            task = json.loads(row[0])
+            fn(task)
+            conn.execute("UPDATE tasks SET data = ?, heartbeat_at = CASE WHEN ? THEN ? ELSE heartbeat_at END "
+                         "WHERE id = ?",
+                         (json.dumps(task, ensure_ascii=False, default=str), touch, time.time(), task_id))
+            return task
+
+    def update(self, task_id: str, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return self.modify(task_id, lambda task: task.update(fields))
+
+    def list(self, limit: int = 200) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT id, data, heartbeat_at FROM tasks ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(self._decode(data, heartbeat_at), task_id=task_id) for task_id, data, heartbeat_at in rows]
+
+    def count_active(self) -> Dict[tuple, int]:
+        """{(type, status): n} для задач в очереди и в работе (фоновые сборки без type — "build")."""
+        rows = self._conn().execute(
+            "SELECT COALESCE(json_extract(data, '$.type'), 'build'), json_extract(data, '$.status'), COUNT(*) "
+            "FROM tasks WHERE json_extract(data, '$.status') IN (?, ?) AND heartbeat_at > ? GROUP BY 1, 2",
+            (*ACTIVE_STATUSES, time.time() - self.heartbeat_ttl)).fetchall()
+        return {(task_type, status): n for task_type, status, n in rows}
+
+    def touch(self, task_id: str):
+        self._conn().execute("UPDATE tasks SET heartbeat_at = ? WHERE id = ?", (time.time(), task_id))
+
+    def purge(self, older_than: float):
+        self._conn().execute("DELETE FROM tasks WHERE created_at < ?", (time.time() - older_than,))
+
+    @contextmanager
+    def heartbeat(self, task_id: str, interval: Optional[float] = None):
+        """Пока блок выполняется, фоновый поток подтверждает, что задача жива."""
+        stop = threading.Event()
+        interval = interval or self.heartbeat_ttl / 3
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.touch(task_id)
+                except sqlite3.Error:
+                    pass
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+
+    # ---- Аренды (локи) ----
+
+    def try_acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                         (name, owner, now + ttl))
+            return True
+
+    def renew(self, name: str, owner: str, ttl: float) -> bool:
+        cur = self._conn().execute("UPDATE leases SET expires_at = ? WHERE name = ? AND owner = ?",
+                                   (time.time() + ttl, name, owner))
+        return cur.rowcount == 1
+
+    def release(self, name: str, owner: str):
+        self._conn().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    @contextmanager
+    def lease(self, name: str, ttl: float = 60.0, wait: float = 300.0, poll: float = 0.5, slots: int = 1,
+              owner: Optional[str] = None, should_stop: Optional[Callable[[], bool]] = None):
+        """
+        Захватывает аренду name (ожидая до wait секунд) и продлевает её в фоне.
+        При slots > 1 берётся любой свободный из слотов name:0..name:{slots-1} —
+        так ограничивается число одновременных задач на все процессы сразу.
+        Отдаёт True при успехе, False — если не дождались (или should_stop() вернул True).
+        """
+        owner = owner or f"{os.getpid()}:{uuid.uuid4().hex}"
+        names = [name] if slots <= 1 else [f"{name}:{i}" for i in range(slots)]
+        deadline = time.time() + wait
+        acquired = None
+        while True:
+            acquired = next((n for n in names if self.try_acquire(n, owner, ttl)), None)
+            if acquired or time.time() >= deadline or (should_stop is not None and should_stop()):
+                break
+            time.sleep(poll)
+        if not acquired:
+            yield False
+            return
+
+        stop = threading.Event()
+
+        def renew_loop():
+            while not stop.wait(ttl / 3):
+                try:
+                    self.renew(acquired, owner, ttl)
+                except sqlite3.Error:
+                    pass
+
+        thread = threading.Thread(target=renew_loop, daemon=True)
+        thread.start()
+        try:
+            yield True
+        finally:
+            stop.set()
+            self.release(acquired, owner)
+
+
+def get_task_store() -> TaskStore:
+    """Общее хранилище процесса. По умолчанию tasks.db лежит в папке архивов датасета."""
+    global _TASK_STORE
+    with _TASK_STORE_LOCK:
+        if _TASK_STORE is None:
+            archive_dir = Path(getattr(settings, "DATASET_ARCHIVE_DIR",
+                                       Path(settings.DATASET_PATH).parent / "dataset_archives"))
+            _TASK_STORE = TaskStore(getattr(settings, "TASKS_DB_PATH", archive_dir / "tasks.db"),
+                                    heartbeat_ttl=float(getattr(settings, "TASK_HEARTBEAT_TTL", 60)))
+            _TASK_STORE.purge(TASKS_RETENTION)
+        return _TASK_STORE
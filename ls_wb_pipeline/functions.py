@@ -1,17 +1,16 @@
 from urllib.parse import urlparse, parse_qs
 from ls_wb_pipeline.logger import logger
+from ls_wb_pipeline import metrics
 from ls_wb_pipeline.settings import *
-from webdav3.client import Client
 from itertools import islice
 from pathlib import Path
 import subprocess
-import requests
 import tempfile
 import random
 import json
 import time
 import os
-import cv2
+import threading
 import re
 
 
@@ -24,102 +23,82 @@ WEBDAV_OPTIONS = {
     'webdav_password': os.environ.get("webdav_password"),
     'disable_check': True  # Отключает кеширование
 }
-client = Client(WEBDAV_OPTIONS)
 
+# Клиент WebDAV и история загрузок создаются при первом обращении, а не при импорте:
+# API и CLI, которым они не нужны, стартуют без webdav3/requests/lxml и чтения JSON
+_client = None
+_downloaded_videos = None
+_lazy_lock = threading.Lock()
 
 
-# Загруженные файлы
-if os.path.exists(DOWNLOAD_HISTORY_FILE):
-    with open(DOWNLOAD_HISTORY_FILE, "r") as f:
-        downloaded_videos = set(json.load(f))
-else:
-    downloaded_videos = set()
+def new_webdav_client():
+    from webdav3.client import Client
+    return Client(WEBDAV_OPTIONS)
 
 
-def save_download_history():
-    with open(DOWNLOAD_HISTORY_FILE, "w") as f:
-        json.dump(list(downloaded_videos), f)
+def get_webdav_client():
+    global _client
+    if _client is None:
+        with _lazy_lock:
+            if _client is None:
+                _client = new_webdav_client()
+    return _client
 
-def is_mounted():
-    """Проверяет, смонтирована ли папка WebDAV и работает ли соединение."""
-    # 1. Проверяем, что путь действительно смонтирован
-    if not os.path.ismount(MOUNTED_PATH):
-        return False
 
-    # 2. Пробуем получить список файлов — если endpoint мёртв, тут вылетит OSError
-    try:
-        test = os.listdir(MOUNTED_PATH)
-        return True
-    except OSError as e:
-        logger.warning(f"Путь {MOUNTED_PATH} смонтирован, но недоступен: {e}")
-        return False
+def get_downloaded_videos():
+    """Загруженные файлы."""
+    global _downloaded_videos
+    if _downloaded_videos is None:
+        with _lazy_lock:
+            if _downloaded_videos is None:
+                if os.path.exists(DOWNLOAD_HISTORY_FILE):
+                    with open(DOWNLOAD_HISTORY_FILE, "r") as f:
+                        _downloaded_videos = set(json.load(f))
+                else:
+                    _downloaded_videos = set()
+    return _downloaded_videos
 
 
+def __getattr__(name):
+    # Совместимость: functions.client / functions.downloaded_videos по-прежнему доступны
+    if name == "client":
+        return get_webdav_client()
+    if name == "downloaded_videos":
+        return get_downloaded_videos()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def mount_webdav(from_systemd=False):
-    """Монтирует WebDAV как локальную директорию."""
-    if is_mounted():
-        logger.info("WebDAV уже смонтирован.")
-        return
 
-    try:
-        logger.info("Монтируем WebDAV...")
-        os.makedirs(MOUNTED_PATH, exist_ok=True)
-        args = [
-            "rclone", "mount", WEBDAV_REMOTE, MOUNTED_PATH,
-            "--no-modtime"
-        ]
-        if not from_systemd:
-            args.append("--daemon")
-
-        subprocess.run(args, check=True)
-        time.sleep(2)
-        if is_mounted():
-            logger.info(f"WebDAV успешно смонтирован в {MOUNTED_PATH}")
-        else:
-            logger.error("WebDAV не смонтирован.")
-    except Exception as e:
-        logger.error(f"Ошибка при монтировании WebDAV: {e}")
+def save_download_history():
+    with open(DOWNLOAD_HISTORY_FILE, "w") as f:
+        json.dump(list(get_downloaded_videos()), f)
 
+def is_mounted():
+    """Проверяет, смонтирована ли папка WebDAV и отвечает ли endpoint (statvfs с таймаутом)."""
+    from ls_wb_pipeline import mount_supervisor
+    return mount_supervisor.probe(MOUNTED_PATH)
 
-def remount_webdav(from_systemd=False):
-    """Пытается перемонтировать WebDAV, если он отключился."""
-    if is_mounted():
-        return
 
-    logger.warning("WebDAV отключен. Перемонтируем...")
+def mount_webdav(from_systemd=False):
+    """Монтирует WebDAV как локальную директорию и ждёт готовности (см. mount_supervisor)."""
+    from ls_wb_pipeline import mount_supervisor
+    return mount_supervisor.ensure_mounted(from_systemd=from_systemd)
 
-    subprocess.run(["fusermount", "-uz", MOUNTED_PATH], check=False)
-    time.sleep(3)
 
-    try:
-        os.makedirs(MOUNTED_PATH, exist_ok=True)
-        args = ["rclone", "mount", WEBDAV_REMOTE, MOUNTED_PATH, "--no-modtime"]
-        if not from_systemd:
-            args.append("--daemon", )
-        else:
-            args += [
-                "--vfs-cache-mode", "writes",
-                "--dir-cache-time", "5s",
-                "--poll-interval", "5s"
-            ]
-        subprocess.run(
-            args,
-            check=True
-        )
-        time.sleep(3)
-        if is_mounted():
-            logger.info("WebDAV успешно перемонтирован.")
-        else:
-            logger.error("Ошибка: WebDAV не смонтирован после попытки перемонтирования.")
-    except Exception as e:
-        logger.error(f"Ошибка при монтировании WebDAV: {e}")
+def remount_webdav(from_systemd=False):
+    """
+    Ждёт, пока WebDAV смонтирован. Проверкой и перемонтированием с backoff занимается
+    фоновый супервизор; если монтирование живо, возврат сразу.
+    """
+    from ls_wb_pipeline import mount_supervisor
+    return mount_supervisor.ensure_mounted(from_systemd=from_systemd)
 
 
 def iter_video_files(path):
+    client = get_webdav_client()
     try:
-        items = with_retries(lambda: client.list(path),
-                             log_prefix=f"[WebDAV:list {path}] ")
+        with metrics.timer(stage="webdav_list"):
+            items = with_retries(lambda: client.list(path),
+                                 log_prefix=f"[WebDAV:list {path}] ")
     except Exception as e:
         logger.error(f"[WebDAV] Ошибка при list({path}): {e}")
         return
@@ -130,7 +109,7 @@ def iter_video_files(path):
             item_path = sanitize_path(f"{path}/{item}")
             if any(reg in item for reg in BLACKLISTED_REGISTRATORS):
                 continue
-            if item_path in downloaded_videos:
+            if item_path in get_downloaded_videos():
                 continue
             yield item_path
 
@@ -205,6 +184,9 @@ def delete_all_cloud_files(dry_run=False):
         actual_files = [f for f in os.listdir(MOUNTED_PATH) if f.lower().endswith(".jpg")]
     except Exception as e:
         logger.error(f"Не удалось прочитать директорию {MOUNTED_PATH}: {e}")
+        if isinstance(e, OSError):
+            from ls_wb_pipeline import mount_supervisor
+            mount_supervisor.report_io_error()
         return {"error": e}
     report =  delete_files(files=actual_files, dry_run=dry_run)
     report["saved_amount"] = 0
@@ -228,7 +210,30 @@ def delete_files(files, dry_run=False):
     return {"deleted": deleted, "deleted_amount": deleted_amount}
 
 
-def get_all_tasks():
+def report_progress(progress_cb, stage, done=None, total=None, **info):
+    """Сообщает о прогрессе этапа, если вызывающий передал колбэк (фоновые задачи API)."""
+    if progress_cb is not None:
+        progress_cb(stage, done=done, total=total, **info)
+
+
+def ls_request(method, url, endpoint, session=None, **kwargs):
+    """
+    Запрос к Label Studio API с замером латентности (endpoint — метка без id, например "tasks/{id}").
+    session — requests.Session для серий запросов по keep-alive соединениям.
+    """
+    import requests
+    started = time.perf_counter()
+    status = "error"
+    try:
+        response = (session or requests).request(method, url, headers=HEADERS, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        metrics.observe("ls_request_seconds", time.perf_counter() - started,
+                        endpoint=endpoint, method=method, status=status)
+
+
+def get_all_tasks(progress_cb=None):
     page = 1
     page_size = 100
     all_tasks = []
@@ -244,7 +249,7 @@ def get_all_tasks():
         )
 
         logger.debug(f"[DEBUG] URL: {url}")
-        r = requests.get(url, headers=HEADERS)
+        r = ls_request("GET", url, "tasks")
 
         if r.status_code != 200:
             logger.error(f"[LS] Ошибка {r.status_code}: {r.text}")
@@ -271,6 +276,7 @@ def get_all_tasks():
             seen_ids.add(task["id"])
             all_tasks.append(task)
 
+        report_progress(progress_cb, "fetch_tasks", done=len(all_tasks), total=total)
         if len(all_tasks) >= total:
             logger.info("[LS] Все задачи получены.")
             break
@@ -299,7 +305,7 @@ def delete_ls_tasks(tasks, dry_run=False, save_annotated=True):
         if dry_run:
             logger.debug(f"[DRY RUN] Будет удалена задача {task_id}")
         else:
-            r = requests.delete(f"{LABELSTUDIO_API_URL}/tasks/{task_id}", headers=HEADERS)
+            r = ls_request("DELETE", f"{LABELSTUDIO_API_URL}/tasks/{task_id}", "tasks/{id}")
             if r.status_code == 204:
                 logger.debug(f"[LS DEL] Удалена задача {task_id}")
             else:
@@ -312,23 +318,48 @@ def delete_ls_tasks(tasks, dry_run=False, save_annotated=True):
     return to_delete, saved
 
 
-def frames_to_video(input_dir, output_video_path, fps=25):
-    frame_files = sorted(f for f in os.listdir(input_dir) if f.endswith(".jpg"))
-    sample = cv2.imread(os.path.join(input_dir, frame_files[0]))
-    height, width, _ = sample.shape
+def frames_to_video(input_dir, output_video_path, fps=25, codec=None, preset=None):
+    """Кадры читаются в потоках с опережением, кодирование — ffmpeg (VIDEO_CODEC/VIDEO_PRESET)."""
+    from ls_wb_pipeline import video_writer
+    report = video_writer.assemble_video(input_dir, output_video_path, fps,
+                                         codec=codec or video_writer.VIDEO_CODEC,
+                                         preset=preset or video_writer.VIDEO_PRESET)
+    print(f"🎞 Видео сохранено: {output_video_path} ({report['frames']} кадров, {report['fps']} fps сборки)")
+    return report
+
 
-    out = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+def _upload_frame(local_client, local_frame_path, remote_frame_path, max_retries=3):
+    """Загружает кадр в WebDAV с повторами и удаляет локальную копию. True при успехе."""
+    frame_filename = os.path.basename(local_frame_path)
+    for attempt in range(1, max_retries + 1):
+        try:
+            with metrics.timer(stage="upload"):
+                local_client.upload_sync(remote_path=remote_frame_path,
+                                         local_path=local_frame_path)
+            os.remove(local_frame_path)
+            metrics.inc("frames_uploaded")
+            return True
+        except Exception as e:
+            logger.error(
+                f"Ошибка при загрузке кадра {frame_filename} (Попытка {attempt}/{max_retries}): {e}")
+            metrics.inc("retries", op="WebDAV:upload")
+            time.sleep(5)  # Ждем 5 секунд перед повторной попыткой
 
-    for file in frame_files:
-        frame = cv2.imread(os.path.join(input_dir, file))
-        out.write(frame)
-    out.release()
-    print(f"🎞 Видео сохранено: {output_video_path}")
+    logger.error(
+        f"Не удалось загрузить кадр {frame_filename} после {max_retries} попыток.")
+    metrics.inc("upload_failures")
+    return False
 
 
-def extract_frames(video_path, frames_per_second: float = None, max_frames: int = None):
-    """Разбивает видео на кадры и загружает в WebDAV с повторной попыткой при ошибках."""
-    local_client = Client(WEBDAV_OPTIONS)
+def extract_frames(video_path, frames_per_second: float = None, max_frames: int = None, progress_cb=None,
+                   triage=None):
+    """
+    Разбивает видео на кадры и загружает в WebDAV с повторной попыткой при ошибках.
+    С triage (triage.FrameTriage) кадры сначала оцениваются моделью, а загружаются
+    только отобранные — в порядке приоритета и в пределах оставшейся квоты max_frames.
+    """
+    import cv2
+    local_client = new_webdav_client()
     cap = cv2.VideoCapture(video_path)
     existing_frames = count_remote_frames(webdav_client=local_client)
     logger.info(f"Извлекаем кадры из {video_path}. FPS - {frames_per_second}")
@@ -351,48 +382,63 @@ def extract_frames(video_path, frames_per_second: float = None, max_frames: int
     frame_interval = max(int(fps / frames_per_second), 1)
     frame_count = 0
     saved_frame_count = 0
-    max_retries = 3  # Количество повторных попыток при ошибке
+    candidates = []  # кадры, ждущие решения triage
 
     logger.info(
         f"Извлекаем кадры из {video_path} (FPS: {fps}, Интервал: {frame_interval})")
 
     while cap.isOpened():
-        ret, frame = cap.read()
+        with metrics.timer(stage="decode"):
+            ret, frame = cap.read()
         if not ret:
             break
+        metrics.inc("frames_decoded")
 
         if frame_count % frame_interval == 0:
+            metrics.inc("frames_sampled")
             frame_filename = f"{Path(video_path).stem}_{saved_frame_count:06d}.jpg"
             local_frame_path = os.path.join(FRAME_DIR_TEMP, frame_filename)
             remote_frame_path = f"{REMOTE_FRAME_DIR}/{frame_filename}"
 
-            cv2.imwrite(local_frame_path, frame)
-            if os.path.exists(local_frame_path):
-                success = False
-                for attempt in range(1, max_retries + 1):
-                    try:
-                        local_client.upload_sync(remote_path=remote_frame_path,
-                                                 local_path=local_frame_path)
-                        os.remove(local_frame_path)
-                        success = True
-                        break  # Успешная загрузка, выходим из цикла
-                    except Exception as e:
-                        logger.error(
-                            f"Ошибка при загрузке кадра {frame_filename} (Попытка {attempt}/{max_retries}): {e}")
-                        time.sleep(5)  # Ждем 5 секунд перед повторной попыткой
-
-                if not success:
-                    logger.error(
-                        f"Не удалось загрузить кадр {frame_filename} после {max_retries} попыток.")
-                    cap.release()
-                    return False, video_path, existing_frames
-            else:
+            with metrics.timer(stage="encode"):
+                cv2.imwrite(local_frame_path, frame)
+            if not os.path.exists(local_frame_path):
                 logger.warning(
                     f"Предупреждение: Кадр {local_frame_path} не был создан.")
+            elif triage is not None:
+                # Загрузка — после оценки всех кадров видео
+                triage.add(local_frame_path, frame)
+                candidates.append(local_frame_path)
+            elif not _upload_frame(local_client, local_frame_path, remote_frame_path):
+                cap.release()
+                return False, video_path, existing_frames
             saved_frame_count += 1
+            if saved_frame_count % 10 == 0:
+                report_progress(progress_cb, "extract", done=saved_frame_count, video=os.path.basename(video_path))
         frame_count += 1
 
     cap.release()
+    if triage is not None:
+        selected, report = triage.select(budget=max_frames - existing_frames)
+        logger.info(f"[TRIAGE] {video_path}: {report}")
+        report_progress(progress_cb, "triage", done=report["selected"], total=report["scored"],
+                        video=os.path.basename(video_path))
+        keep = set(selected)
+        # Неотобранные кадры в хранилище не попадают
+        for local_frame_path in candidates:
+            if local_frame_path not in keep:
+                os.remove(local_frame_path)
+        for i, local_frame_path in enumerate(selected):
+            if not _upload_frame(local_client, local_frame_path,
+                                 f"{REMOTE_FRAME_DIR}/{os.path.basename(local_frame_path)}"):
+                # Незагруженные отобранные кадры не оставляем в FRAME_DIR_TEMP
+                for leftover in selected[i:]:
+                    try:
+                        os.remove(leftover)
+                    except FileNotFoundError:
+                        pass
+                return False, video_path, existing_frames
+        saved_frame_count = len(selected)
     logger.info(
         f"Извлечено и загружено {saved_frame_count} кадров из {video_path}")
     return True, video_path, saved_frame_count
@@ -418,7 +464,7 @@ def sync_label_studio_storage():
     remount_webdav()
     sync_url = f"{LABELSTUDIO_HOST}:{LABELSTUDIO_PORT}/api/storages/localfiles/{LABELSTUDIO_STORAGE_ID}/sync"
 
-    response = requests.post(sync_url, headers=HEADERS)
+    response = ls_request("POST", sync_url, "storages/sync")
 
     if response.status_code == 200:
         logger.info("Хранилище успешно синхронизовано")
@@ -449,20 +495,45 @@ def delete_blacklisted_files():
 '''
 
 
-def main_process_new_frames(max_frames=7000, only_cargo_type: str = None, fps: float = None, video_name: str = None):
+def main_process_new_frames(max_frames=7000, only_cargo_type: str = None, fps: float = None, video_name: str = None,
+                            progress_cb=None, triage: bool = None, preannotate: bool = None):
     logger.info("\n\U0001f504 Запущен основной цикл создания фреймов")
-    result = process_video_loop(max_frames=max_frames, only_cargo_type=only_cargo_type, fps=fps, concrete_video_name=video_name)
-    remount_webdav()
-    time.sleep(3)
-    sync_label_studio_storage()
-    cleanup_videos()
+    with metrics.collect_timings() as timings:
+        result = process_video_loop(max_frames=max_frames, only_cargo_type=only_cargo_type, fps=fps,
+                                    concrete_video_name=video_name, progress_cb=progress_cb, triage=triage)
+        report_progress(progress_cb, "sync")
+        with metrics.timer(stage="ls_sync"):
+            sync_label_studio_storage()
+        from ls_wb_pipeline import preannotate as preannotation
+        if preannotate is None:
+            preannotate = preannotation.PREANNOTATE_ENABLED
+        if preannotate:
+            # Новые задачи сразу получают предсказания модели
+            report_progress(progress_cb, "preannotate")
+            with metrics.timer(stage="preannotate"):
+                try:
+                    result["preannotate"] = preannotation.preannotate_tasks(progress_cb=progress_cb)
+                except Exception as e:
+                    logger.error(f"[PREANNOTATE] Предразметка не выполнена: {e}")
+                    result["preannotate"] = {"error": str(e)}
+        report_progress(progress_cb, "cleanup")
+        with metrics.timer(stage="cleanup"):
+            cleanup_videos()
+            client = get_webdav_client()
+            for item in client.list(REMOTE_FRAME_DIR):
+                client.check(item)
     result["status"] = "frames processed"
-    for item in client.list(REMOTE_FRAME_DIR):
-        client.check(item)
+    result["timings"] = timings
     return result
 
 
 
+def _retry_op(log_prefix):
+    """"[WebDAV:list /path] " -> "WebDAV:list": метка операции без путей (ограниченная кардинальность)."""
+    match = re.match(r"\[([^\s\]]+)", log_prefix or "")
+    return match.group(1) if match else "other"
+
+
 def with_retries(func, max_attempts=3, delay=1.0, jitter=0.5, exceptions=(Exception,), log_prefix=""):
     for attempt in range(1, max_attempts + 1):
         try:
@@ -470,6 +541,7 @@ def with_retries(func, max_attempts=3, delay=1.0, jitter=0.5, exceptions=(Except
         except exceptions as e:
             if attempt == max_attempts:
                 raise
+            metrics.inc("retries", op=_retry_op(log_prefix))
             logger.warning(f"{log_prefix}Ошибка (попытка {attempt}/{max_attempts}): {e}. Повтор через {delay} сек.")
             time.sleep(delay + random.uniform(0, jitter))
 
@@ -509,12 +581,25 @@ def resolve_video_path(concrete_video_name: str, base_remote_dir: str, client) -
     return f"{remote_dir}/{mp4_files[0]}"
 
 def top_level_generator():
+    client = get_webdav_client()
     registrators = with_retries(lambda: client.list(BASE_REMOTE_DIR))
     for reg in registrators:
         yield sanitize_path(f"{BASE_REMOTE_DIR}/{reg}")
 
-def process_video_loop(max_frames=7000, only_cargo_type: str = None, fps: float = None, concrete_video_name: str = None):
+def process_video_loop(max_frames=7000, only_cargo_type: str = None, fps: float = None, concrete_video_name: str = None,
+                       progress_cb=None, triage: bool = None):
+    """
+    triage=True (по умолчанию settings.FRAME_TRIAGE) — кадры каждого видео сначала оцениваются
+    классификатором, а в хранилище уходят неуверенные и редкие (см. triage.FrameTriage).
+    """
+    from ls_wb_pipeline import triage as frame_triage
+    if triage is None:
+        triage = frame_triage.TRIAGE_ENABLED
+    # Один отборщик на прогон: частоты классов копятся между видео
+    frame_selector = frame_triage.create_triage() if triage else None
     remount_webdav()
+    client = get_webdav_client()
+    downloaded_videos = get_downloaded_videos()
     os.makedirs(LOCAL_VIDEO_DIR, exist_ok=True)
     downloaded_video_counter = 0
 
@@ -542,13 +627,16 @@ def process_video_loop(max_frames=7000, only_cargo_type: str = None, fps: float
         logger.debug("Итерируем генератор...")
         try:
             logger.debug("Считаем количество кадров, которые уже в хранилище...")
-            items = with_retries(lambda: client.list(REMOTE_FRAME_DIR), log_prefix="[WebDAV:list REMOTE_FRAME_DIR] ")
+            with metrics.timer(stage="webdav_list"):
+                items = with_retries(lambda: client.list(REMOTE_FRAME_DIR),
+                                     log_prefix="[WebDAV:list REMOTE_FRAME_DIR] ")
             frame_count = sum(1 for item in items if item.endswith(".jpg"))
             logger.debug(f"В хранилище {frame_count} кадров")
         except Exception as e:
             logger.error(f"Ошибка при проверке лимита кадров: {e}")
             break
 
+        report_progress(progress_cb, "crawl", done=frame_count, total=max_frames, videos=downloaded_video_counter)
         if frame_count >= max_frames:
             logger.info(f"\nДостигнут лимит кадров ({frame_count}/{max_frames}). Остановка загрузки.")
             if not downloaded_video_counter:
@@ -558,7 +646,8 @@ def process_video_loop(max_frames=7000, only_cargo_type: str = None, fps: float
 
         try:
             logger.debug("Получаем видео с генератора...")
-            video = next(video_generator)
+            with metrics.timer(stage="crawl"):
+                video = next(video_generator)
         except StopIteration:
             logger.info("Все видео обработаны")
             return {"error": "Все видео обработаны, больше нет необработанных"}
@@ -577,7 +666,9 @@ def process_video_loop(max_frames=7000, only_cargo_type: str = None, fps: float
         report_path = os.path.join(os.path.dirname(video), "report.json")
         try:
             with tempfile.NamedTemporaryFile(mode="w+b", delete=False) as tmpf:
-                client.download_sync(remote_path=report_path, local_path=tmpf.name)
+                with metrics.timer(stage="report_json"):
+                    client.download_sync(remote_path=report_path, local_path=tmpf.name)
+                metrics.inc("webdav_bytes_downloaded", os.path.getsize(tmpf.name), kind="report")
                 tmpf.seek(0)
                 report_data = json.load(tmpf)
                 switch_events = report_data.get("switch_events", [])
@@ -602,10 +693,13 @@ def process_video_loop(max_frames=7000, only_cargo_type: str = None, fps: float
 
         local_path = os.path.join(LOCAL_VIDEO_DIR, current_video_name)
         logger.info(f"Скачивание {video}")
+        report_progress(progress_cb, "download", done=downloaded_video_counter, video=current_video_name)
         try:
             temp_path = local_path + ".part"
-            with_retries(lambda: client.download_sync(remote_path=video, local_path=temp_path),
-                         log_prefix=f"[WebDAV:download {video}] ")
+            with metrics.timer(stage="download"):
+                with_retries(lambda: client.download_sync(remote_path=video, local_path=temp_path),
+                             log_prefix=f"[WebDAV:download {video}] ")
+            metrics.inc("webdav_bytes_downloaded", os.path.getsize(temp_path), kind="video")
             os.rename(temp_path, local_path)
             downloaded_videos.add(video)
             logger.info(f"Скачано {video} в {local_path}")
@@ -619,15 +713,18 @@ def process_video_loop(max_frames=7000, only_cargo_type: str = None, fps: float
             FRAMES_PER_SECOND_EURO if cargo_type == "euro" else FRAMES_PER_SECOND_BUNKER
         )
         logger.info(f"Нарезка кадров из {local_path}. Используется FPS: {effective_fps}")
-        success, video_path, frames = extract_frames(local_path, frames_per_second=effective_fps, max_frames=max_frames)
+        success, video_path, frames = extract_frames(local_path, frames_per_second=effective_fps, max_frames=max_frames,
+                                                     progress_cb=progress_cb, triage=frame_selector)
         total_frames_in_storage = frame_count + int(frames)
         logger.info(f"Статус: {success}. Кадров {total_frames_in_storage}/{max_frames}")
         if not success:
             logger.warning(f"Не удалось обработать видео: {video_path}")
             if frames >= max_frames:
                 break
-        result_dict["vid_process_results"].append(
-            {"video_path": video_path, "frames": frames, "success": success, "cargo_type": cargo_type})
+        video_result = {"video_path": video_path, "frames": frames, "success": success, "cargo_type": cargo_type}
+        if frame_selector is not None and frame_selector.last_report:
+            video_result["triage"], frame_selector.last_report = frame_selector.last_report, None
+        result_dict["vid_process_results"].append(video_result)
         result_dict["total_frames_downloaded"] += int(frames)
         result_dict["total_frames_in_storage"] = total_frames_in_storage
         save_download_history()
@@ -0,0 +1,413 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from ls_wb_pipeline import metrics, settings
+from ls_wb_pipeline.logger import logger
+
+# Параметры пакетного инференса на CPU
+BATCH_SIZE = int(getattr(settings, "INFERENCE_BATCH_SIZE", 32))
+# Потоки загрузчика: декодирование JPEG и ресайз в cv2/PIL отпускают GIL
+LOADER_WORKERS = int(getattr(settings, "INFERENCE_LOADER_WORKERS", max(1, min(8, (os.cpu_count() or 1) // 4))))
+# Сколько пакетов готовится заранее, пока модель считает текущий
+PREFETCH_BATCHES = int(getattr(settings, "INFERENCE_PREFETCH_BATCHES", 2))
+# intra-op потоки torch: ядра, не занятые загрузчиком (иначе потоки дерутся за CPU)
+INTRA_OP_THREADS = int(getattr(settings, "INFERENCE_THREADS", 0)) or max(1, (os.cpu_count() or 1) - LOADER_WORKERS)
+
+# Модель и бэкенд: eager (исходный best.pt), torchscript или onnx (см. model_export)
+MODEL_PATH = str(getattr(settings, "MODEL_PATH", "best.pt"))
+BACKEND = getattr(settings, "INFERENCE_BACKEND", "eager")
+QUANTIZED = bool(getattr(settings, "INFERENCE_INT8", False))
+BACKENDS = ("eager", "torchscript", "onnx")
+# Онлайн-классификация (/classify): окно сбора микропакета и его максимальный размер
+MICROBATCH_WAIT = float(getattr(settings, "CLASSIFY_BATCH_WAIT", 0.01))
+MICROBATCH_MAX = int(getattr(settings, "CLASSIFY_MAX_BATCH", BATCH_SIZE))
+# Размер пустого пакета для прогрева после загрузки модели (0 — без прогрева)
+WARMUP_BATCH = int(getattr(settings, "INFERENCE_WARMUP_BATCH", 2))
+# Через сколько секунд повторить неудачную перезагрузку изменившейся модели (пока — старая версия)
+RELOAD_RETRY = float(getattr(settings, "INFERENCE_RELOAD_RETRY", 30))
+IMAGE_SIZE = 224
+# Нормализация ImageNet, как T.Normalize в исходной цепочке torchvision
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+CLASS_NAMES = [
+    "лодка опрокинута",
+    "евроконтейнер опрокинут",
+    "лодка захвачена",
+    "евроконтейнер захвачен",
+    "свободно",
+]
+
+_END = object()
+_THREADS_CONFIGURED = False
+_THREADS_LOCK = threading.Lock()
+_MODELS = {}
+_RELOAD_FAILED = {}
+_MODELS_LOCK = threading.Lock()
+_NORM = None
+_BATCHERS = {}
+_BATCHERS_LOCK = threading.Lock()
+
+
+def configure_threads(threads: int = None):
+    """Настраивает пулы потоков torch один раз на процесс (inter-op можно задать только до первого инференса)."""
+    global _THREADS_CONFIGURED
+    if _THREADS_CONFIGURED:
+        return
+    with _THREADS_LOCK:
+        if _THREADS_CONFIGURED:
+            return
+        import torch
+        torch.set_num_threads(threads or INTRA_OP_THREADS)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:  # инференс в процессе уже запускался
+            pass
+        _THREADS_CONFIGURED = True
+
+
+def artifact_path(model_path: str, backend: str, quantized: bool = False) -> str:
+    """best.pt -> best.ts / best.int8.onnx и т.п. рядом с исходной моделью."""
+    base = os.path.splitext(model_path)[0] + (".int8" if quantized else "")
+    return base + (".ts" if backend == "torchscript" else ".onnx")
+
+
+def load_eager(path: str = None):
+    import torch
+    ckpt = torch.load(path or MODEL_PATH, map_location="cpu", weights_only=False)
+    # Чекпойнт yolov5 ({"model": ...}) или целиком сохранённая модель
+    model = ckpt["model"] if isinstance(ckpt, dict) else ckpt
+    return model.float().eval()
+
+
+class OnnxModel:
+    """Обёртка onnxruntime с тем же интерфейсом, что у модели torch: пакет -> логиты."""
+
+    def __init__(self, path: str, threads: int = None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or INTRA_OP_THREADS
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        import torch
+        logits = self.session.run(None, {self.input_name: batch.contiguous().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def load_model(backend: str = None, path: str = None, model_path: str = None, quantized: bool = None,
+               fallback: bool = True):
+    """
+    Загружает классификатор для инференса. Для torchscript/onnx path — экспортированный
+    артефакт (по умолчанию рядом с model_path). Если артефакт не загрузился (нет файла,
+    не установлен onnxruntime), при fallback=True используется eager-модель model_path.
+    """
+    backend = backend or BACKEND
+    model_path = model_path or MODEL_PATH
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд {backend!r}, доступны: {', '.join(BACKENDS)}")
+    if backend != "eager":
+        path = path or artifact_path(model_path, backend, QUANTIZED if quantized is None else quantized)
+        try:
+            if backend == "onnx":
+                return OnnxModel(path)
+            import torch
+            return torch.jit.load(path, map_location="cpu").eval()
+        except Exception as e:
+            if not fallback:
+                raise
+            logger.warning(f"Бэкенд {backend} ({path}) недоступен, используется eager: {e}")
+    return load_eager(model_path)
+
+
+def _model_stamp(backend: str, model_path: str):
+    """Версия модели на диске: mtime исходника и артефакта (если он есть)."""
+    stamp = [os.path.getmtime(model_path) if os.path.exists(model_path) else None]
+    if backend != "eager":
+        path = artifact_path(model_path, backend, QUANTIZED)
+        stamp.append(os.path.getmtime(path) if os.path.exists(path) else None)
+    return tuple(stamp)
+
+
+def warm_up(model, batch_size: int = WARMUP_BATCH):
+    """Прогон пустого пакета: первый вызов платит за выделение памяти и выбор ядер, а не запрос пользователя."""
+    import numpy as np
+    if batch_size <= 0:
+        return
+    frames = [np.zeros((IMAGE_SIZE, IMAGE_SIZE, 3), np.uint8)] * batch_size
+    predict(model, BatchBuffer().to_tensor(frames))
+
+
+def get_model(backend: str = None, model_path: str = None):
+    """
+    Реестр моделей: один экземпляр на (бэкенд, путь, mtime). Модель загружается и прогревается
+    при первом обращении; если файл модели заменили, следующий вызов загрузит новую версию.
+    Если новая версия не загрузилась (например, файл ещё копируется), продолжает работать
+    прежняя, а перезагрузка повторяется не чаще раза в RELOAD_RETRY секунд.
+    """
+    backend = backend or BACKEND
+    model_path = model_path or MODEL_PATH
+    key = (backend, model_path)
+    stamp = _model_stamp(backend, model_path)
+    cached = _MODELS.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with _MODELS_LOCK:
+        cached = _MODELS.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        failed = _RELOAD_FAILED.get(key)
+        if cached is not None and failed is not None and failed[0] == stamp \
+                and time.monotonic() - failed[1] < RELOAD_RETRY:
+            return cached[1]
+        configure_threads()
+        started = time.perf_counter()
+        try:
+            model = load_model(backend, model_path=model_path)
+            loaded = time.perf_counter()
+            warm_up(model)
+        except Exception as e:
+            if cached is None:
+                raise
+            _RELOAD_FAILED[key] = (stamp, time.monotonic())
+            logger.error(f"Не удалось перезагрузить модель {model_path} ({backend}), работает прежняя версия: {e}")
+            return cached[1]
+        _RELOAD_FAILED.pop(key, None)
+        logger.info(f"Модель {model_path} ({backend}) загружена за {loaded - started:.2f} с, "
+                    f"прогрев {time.perf_counter() - loaded:.2f} с")
+        _MODELS[key] = (stamp, model)
+        return model
+
+
+# ---- Препроцессинг ----
+
+def _norm_params():
+    """Масштаб и сдвиг в форме 1×3×1×1: x / 255 / std - mean / std за одно умножение и сложение."""
+    global _NORM
+    if _NORM is None:
+        import numpy as np
+        mean = np.array(MEAN, np.float32).reshape(1, 3, 1, 1)
+        std = np.array(STD, np.float32).reshape(1, 3, 1, 1)
+        _NORM = (1.0 / (255.0 * std), -mean / std)
+    return _NORM
+
+
+def resize_frame(frame, size: int = IMAGE_SIZE):
+    """
+    Кадр BGR uint8 -> size×size×3 uint8 одним cv2.resize. При уменьшении INTER_AREA: он ближе
+    всего к ресайзу PIL с антиалиасингом, который делал T.Resize. Если хоть одна сторона
+    растягивается — INTER_LINEAR: INTER_AREA при увеличении работает как ближайший сосед.
+    """
+    import cv2
+    h, w = frame.shape[:2]
+    interpolation = cv2.INTER_AREA if h >= size and w >= size else cv2.INTER_LINEAR
+    return cv2.resize(frame, (size, size), interpolation=interpolation)
+
+
+def normalize_batch(images, out=None, bgr: bool = True):
+    """
+    Пакет uint8 N×S×S×3 (массив или список кадров) -> float32 N×3×S×S, как T.ToTensor + T.Normalize,
+    одной векторной операцией на весь пакет. out — заранее выделенный буфер (не меньше N);
+    результат пишется в out[:N] и возвращается этот срез.
+    """
+    import numpy as np
+    batch = images if isinstance(images, np.ndarray) else np.stack(images)
+    n, size = batch.shape[0], batch.shape[1]
+    if out is None or out.shape[0] < n or out.shape[1:] != (3, size, size):
+        out = np.empty((n, 3, size, size), np.float32)
+    scale, bias = _norm_params()
+    chw = batch.transpose(0, 3, 1, 2)
+    if bgr:
+        chw = chw[:, ::-1]
+    target = out[:n]
+    np.multiply(chw, scale, out=target)
+    target += bias
+    return target
+
+
+def preprocess_batch(frames, size: int = IMAGE_SIZE, out=None):
+    """Кадры BGR любого размера -> нормализованный float32 N×3×size×size."""
+    return normalize_batch([resize_frame(frame, size) for frame in frames], out=out)
+
+
+class BatchBuffer:
+    """
+    Переиспользуемый float32-буфер пакета: кадры uint8 после resize_frame нормализуются
+    прямо в него, тензор torch смотрит в ту же память. Готовые тензоры просто склеиваются.
+    Тензор действителен до следующего вызова.
+    """
+
+    def __init__(self):
+        self._array = None
+
+    def to_tensor(self, samples):
+        import numpy as np
+        import torch
+        if not isinstance(samples[0], np.ndarray):
+            return torch.stack(samples)
+        n, size = len(samples), samples[0].shape[0]
+        if self._array is None or self._array.shape[0] < n or self._array.shape[2] != size:
+            self._array = np.empty((n, 3, size, size), np.float32)
+        return torch.from_numpy(normalize_batch(samples, out=self._array))
+
+
+def reference_transform(size: int = IMAGE_SIZE):
+    """Исходная цепочка torchvision (через PIL) — эталон для сверки препроцессинга."""
+    import torchvision.transforms as T
+    return T.Compose([T.Resize((size, size)), T.ToTensor(), T.Normalize(MEAN, STD)])
+
+
+def check_preprocess_parity(frames, transform=None, mean_atol: float = 0.03, p99_atol: float = 0.4,
+                            max_atol: float = 1.0):
+    """
+    Сверяет preprocess_batch с цепочкой torchvision на кадрах BGR (проверка в рантайме, её запускает
+    python -m ls_wb_pipeline.model_export --preprocess-only).
+    Допуски в единицах после нормализации (один уровень яркости ≈ 0.017). INTER_AREA — прямоугольный
+    фильтр, а T.Resize на PIL — треугольный, поэтому на резких границах расхождение неизбежно:
+    на кадрах 480p–4K в среднем до 0.015, 99-й перцентиль до 0.35, максимум до 0.85 на отдельных
+    пикселях. Допуски с запасом над этим; основной сторож — среднее и 99-й перцентиль.
+    """
+    import cv2
+    import numpy as np
+    from PIL import Image
+    transform = transform or reference_transform()
+    expected = np.stack([np.asarray(transform(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))))
+                         for frame in frames])
+    diff = np.abs(preprocess_batch(frames) - expected)
+    p99 = float(np.percentile(diff, 99))
+    return {"ok": bool(diff.mean() <= mean_atol and p99 <= p99_atol and diff.max() <= max_atol),
+            "frames": len(frames), "mean_abs_diff": round(float(diff.mean()), 5),
+            "p99_abs_diff": round(p99, 4), "max_abs_diff": round(float(diff.max()), 4)}
+
+
+# ---- Пакетный инференс ----
+
+def prefetch_batches(items, load, batch_size: int = None, workers: int = None, prefetch: int = None):
+    """
+    Загружает элементы в потоках пула, опережая потребителя на prefetch пакетов.
+    load(item) -> (sample, payload), sample — кадр после resize_frame или готовый тензор C×H×W.
+    Отдаёт (items, samples, payloads) пакетами в исходном порядке.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    window = batch_size * ((prefetch or PREFETCH_BATCHES) + 1)
+    items = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers or LOADER_WORKERS) as pool:
+        def fill():
+            while len(pending) < window:
+                item = next(items, _END)
+                if item is _END:
+                    return
+                pending.append((item, pool.submit(load, item)))
+
+        fill()
+        while pending:
+            batch_items, samples, payloads = [], [], []
+            while pending and len(batch_items) < batch_size:
+                item, future = pending.popleft()
+                sample, payload = future.result()
+                batch_items.append(item)
+                samples.append(sample)
+                payloads.append(payload)
+            fill()
+            yield batch_items, samples, payloads
+
+
+def predict_proba(model, batch):
+    """Пакет N×C×H×W -> вероятности классов (тензор N×K)."""
+    import torch
+    with torch.inference_mode():
+        logits = model(batch)
+        if isinstance(logits, (tuple, list)):
+            logits = logits[0]
+        return torch.softmax(logits.float(), dim=1)
+
+
+def predict(model, batch):
+    """Пакет N×C×H×W -> (номера классов, уверенности) списками."""
+    scores, class_ids = predict_proba(model, batch).max(dim=1)
+    return class_ids.tolist(), scores.tolist()
+
+
+def classify_batched(model, items, load, batch_size: int = None, workers: int = None):
+    """
+    Пакетная классификация: декодирование и ресайз в потоках, нормализация — одной операцией
+    на пакет в переиспользуемый буфер, модель — под torch.inference_mode. Отдаёт (item, payload, class_id, score) в исходном порядке.
+    """
+    configure_threads()
+    buffer = BatchBuffer()
+    for batch_items, samples, payloads in prefetch_batches(items, load, batch_size, workers):
+        with metrics.timer(stage="inference"):
+            class_ids, scores = predict(model, buffer.to_tensor(samples))
+        yield from zip(batch_items, payloads, class_ids, scores)
+
+
+class MicroBatcher:
+    """
+    Объединяет кадры из одновременных запросов в один вызов модели: первый кадр открывает
+    окно max_wait секунд, всё, что пришло за это время (до max_batch кадров), считается
+    одним пакетом. Под нагрузкой пакеты растут, в тишине задержка — не больше окна.
+    """
+
+    def __init__(self, backend: str = None, max_batch: int = MICROBATCH_MAX, max_wait: float = MICROBATCH_WAIT):
+        self.backend = backend
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"microbatch-{backend or BACKEND}")
+        self._thread.start()
+
+    def submit(self, sample) -> Future:
+        """sample — кадр после resize_frame. Future вернёт (class_id, score)."""
+        future = Future()
+        self._queue.put((sample, future))
+        return future
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return [(sample, future) for sample, future in items if future.set_running_or_notify_cancel()]
+
+    def _run(self):
+        buffer = BatchBuffer()
+        while True:
+            items = self._collect()
+            if not items:
+                continue
+            try:
+                model = get_model(self.backend)
+                with metrics.timer(stage="classify_batch"):
+                    class_ids, scores = predict(model, buffer.to_tensor([sample for sample, _ in items]))
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), class_id, score in zip(items, class_ids, scores):
+                future.set_result((class_id, score))
+
+
+def get_batcher(backend: str = None) -> MicroBatcher:
+    """Один микробатчер (и поток) на бэкенд в процессе."""
+    backend = backend or BACKEND
+    batcher = _BATCHERS.get(backend)
+    if batcher is None:
+        with _BATCHERS_LOCK:
+            batcher = _BATCHERS.get(backend)
+            if batcher is None:
+                batcher = _BATCHERS[backend] = MicroBatcher(backend)
+    return batcher
@@ -0,0 +1,187 @@
+import cProfile
+import importlib.util
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from ls_wb_pipeline import settings
+
+# Метрики необязательны: без prometheus_client все хуки — пустышки. Сама библиотека
+# импортируется при первой записи метрики, чтобы не замедлять старт.
+# Выключается через settings.METRICS_ENABLED = False; при выключенных метриках
+# хук стоит одной проверки флага
+_AVAILABLE = importlib.util.find_spec("prometheus_client") is not None
+ENABLED = bool(getattr(settings, "METRICS_ENABLED", True)) and _AVAILABLE
+
+_STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+# name -> (тип, описание, метки)
+_DEFINITIONS = {
+    "stage_seconds": ("histogram", "Длительность этапа пайплайна", ("stage",)),
+    "webdav_bytes_downloaded": ("counter", "Скачано байт с WebDAV", ("kind",)),
+    "frames_decoded": ("counter", "Декодировано кадров из видео", ()),
+    "frames_sampled": ("counter", "Кадров отобрано для разметки", ()),
+    "frames_uploaded": ("counter", "Кадров загружено в WebDAV", ()),
+    "upload_failures": ("counter", "Кадров, которые не удалось загрузить", ()),
+    "predictions_pushed": ("counter", "Предсказаний модели отправлено в Label Studio", ()),
+    "webdav_remounts": ("counter", "Перемонтирования WebDAV по результату", ("result",)),
+    "retries": ("counter", "Повторы в with_retries и загрузке кадров", ("op",)),
+    "ls_request_seconds": ("histogram", "Латентность запросов к Label Studio API", ("endpoint", "method", "status")),
+    "archive_build_seconds": ("histogram", "Длительность сборки экспорта датасета", ("kind",)),
+    "archive_packed_files": ("counter", "Упаковано файлов датасета", ("kind",)),
+    "archive_packed_bytes": ("counter", "Упаковано байт датасета", ("kind",)),
+    "queue_depth": ("gauge", "Задачи в очереди/в работе по типам", ("queue", "status")),
+}
+
+_METRICS = {}
+
+
+def _multiprocess() -> bool:
+    # Несколько воркеров uvicorn: prometheus_client пишет значения в PROMETHEUS_MULTIPROC_DIR
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get("prometheus_multiproc_dir"))
+
+
+def _create(name, kind, doc, labels):
+    import prometheus_client
+    full_name = f"ls_pipeline_{name}"
+    if kind == "counter":
+        return prometheus_client.Counter(full_name, doc, labels)
+    if kind == "histogram":
+        return prometheus_client.Histogram(full_name, doc, labels, buckets=_STAGE_BUCKETS)
+    extra = {"multiprocess_mode": "mostrecent"} if _multiprocess() else {}
+    return prometheus_client.Gauge(full_name, doc, labels, **extra)
+
+
+_METRICS_LOCK = threading.Lock()
+
+
+def _registered():
+    """Все метрики регистрируются разом при первом обращении."""
+    if not _METRICS:
+        with _METRICS_LOCK:
+            if not _METRICS:
+                for name, (kind, doc, labels) in _DEFINITIONS.items():
+                    _METRICS[name] = _create(name, kind, doc, labels)
+    return _METRICS
+
+
+def _metric(name, labels):
+    metric = _registered()[name]
+    return metric.labels(**labels) if labels else metric
+
+
+def inc(name: str, amount: float = 1, **labels):
+    if ENABLED and amount:
+        _metric(name, labels).inc(amount)
+
+
+def observe(name: str, value: float, **labels):
+    if ENABLED:
+        _metric(name, labels).observe(value)
+
+
+def set_gauge(name: str, value: float, **labels):
+    if ENABLED:
+        _metric(name, labels).set(value)
+
+
+# Разбивка времени текущего прогона по этапам (см. collect_timings), своя у каждого потока
+_RUN = threading.local()
+
+
+@contextmanager
+def _timer(name, labels, timings):
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - started
+        cpu = time.thread_time() - cpu_started
+        if ENABLED:
+            _metric(name, labels).observe(wall)
+        if timings is not None:
+            stage = timings.setdefault(labels.get("stage", name), {"wall": 0.0, "cpu": 0.0, "count": 0})
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+            stage["count"] += 1
+
+
+_NULL_TIMER = nullcontext()
+
+
+def timer(name: str = "stage_seconds", **labels):
+    """with metrics.timer(stage="download"): ... — пишет длительность в гистограмму
+    и в разбивку текущего прогона, если она собирается."""
+    timings = getattr(_RUN, "timings", None)
+    if not ENABLED and timings is None:
+        return _NULL_TIMER
+    return _timer(name, labels, timings)
+
+
+@contextmanager
+def collect_timings():
+    """
+    Собирает wall/CPU-время этапов, выполненных в этом потоке внутри блока.
+    Отдаёт словарь, который при выходе заполняется разбивкой
+    {stage: {"wall": сек, "cpu": сек, "count": n}, ..., "total": {...}}.
+    Вложенные этапы входят и во внешние (например, webdav_list внутри crawl).
+    CPU — время только этого потока.
+    """
+    previous = getattr(_RUN, "timings", None)
+    timings = {}
+    report = {}
+    _RUN.timings = timings
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    try:
+        yield report
+    finally:
+        _RUN.timings = previous
+        for stage, v in sorted(timings.items(), key=lambda item: -item[1]["wall"]):
+            report[stage] = {"wall": round(v["wall"], 4), "cpu": round(v["cpu"], 4), "count": v["count"]}
+        report["total"] = {"wall": round(time.perf_counter() - started, 4),
+                           "cpu": round(time.thread_time() - cpu_started, 4), "count": 1}
+
+
+def profile_call(fn, *args, top: int = 25, **kwargs):
+    """
+    Выполняет fn под cProfile. Возвращает (результат, сводка самых тяжёлых функций
+    по cumulative time). Профилировщик видит только текущий поток.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:  # в процессе уже работает другой профилировщик
+        return fn(*args, **kwargs), {"error": str(e)}
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    hottest = []
+    for (filename, line, func), (_, ncalls, tottime, cumtime, _) in sorted(
+            stats.stats.items(), key=lambda item: -item[1][3])[:top]:
+        hottest.append({"function": f"{os.path.basename(filename)}:{line}({func})", "calls": ncalls,
+                        "tottime": round(tottime, 4), "cumtime": round(cumtime, 4)})
+    return result, {"total_calls": stats.total_calls, "total_time": round(stats.total_tt, 4), "hottest": hottest}
+
+
+def render():
+    """(тело, content-type) для эндпоинта /metrics."""
+    if not _AVAILABLE:
+        return b"# prometheus_client is not installed\n", "text/plain; version=0.0.4; charset=utf-8"
+    import prometheus_client
+    if ENABLED:
+        _registered()
+    registry = prometheus_client.REGISTRY
+    if _multiprocess():
+        from prometheus_client import multiprocess
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
@@ -1,50 +1,75 @@
-import torch
-import torchvision.transforms as T
-from PIL import Image
 import cv2
+import numpy as np
 import os
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
-# Модель
-model = torch.load("best.pt", map_location="cpu")  # или "cuda"
-model.eval()
+from ls_wb_pipeline.inference import (BATCH_SIZE, CLASS_NAMES, IMAGE_SIZE, LOADER_WORKERS, classify_batched,
+                                      get_model, preprocess_batch, reference_transform, resize_frame)
+from ls_wb_pipeline.logger import logger
+from ls_wb_pipeline.video_stream import label_video
 
 # Классы
-class_names = [
-    "лодка опрокинута",
-    "евроконтейнер опрокинут",
-    "лодка захвачена",
-    "евроконтейнер захвачен",
-    "свободно",
-]
-
-# Преобразование
-transform = T.Compose([
-    T.Resize((224, 224)),
-    T.ToTensor(),
-    T.Normalize([0.485, 0.456, 0.406],
-                [0.229, 0.224, 0.225])
-])
-
-
-def classify_and_draw(input_dir, output_dir):
-    os.makedirs(output_dir, exist_ok=True)
-    frame_files = sorted(f for f in os.listdir(input_dir) if f.endswith(".jpg"))
+class_names = CLASS_NAMES
+
+
+def __getattr__(name):
+    # Совместимость: ml_utils.model — модель по умолчанию, загружается при первом обращении
+    if name == "model":
+        return get_model()
+    # Исходное преобразование torchvision — теперь только эталон для сверки
+    # (inference.check_preprocess_parity); torchvision импортируется при первом обращении
+    if name == "transform":
+        return reference_transform()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def preprocess_frame(frame):
+    """Кадр BGR (как из cv2) -> тензор для модели."""
+    import torch
+    return torch.from_numpy(preprocess_batch([frame])[0])
+
 
-    for file in tqdm(frame_files):
-        img_path = os.path.join(input_dir, file)
-        img = Image.open(img_path).convert("RGB")
-        tensor = transform(img).unsqueeze(0)
+def _load_frame(img_path):
+    """Декодирует кадр один раз: оригинал BGR нужен для отрисовки, уменьшенная копия — для модели."""
+    frame = cv2.imread(img_path)
+    if frame is None:
+        # Битый или исчезнувший файл — пустышка для пакета, кадр пропускается
+        logger.warning(f"Пропущен кадр {img_path}: не удалось декодировать")
+        return np.zeros((IMAGE_SIZE, IMAGE_SIZE, 3), np.uint8), None
+    return resize_frame(frame), frame
 
-        with torch.no_grad():
-            preds = model(tensor)
-            class_id = preds.argmax(1).item()
-            label = class_names[class_id]
 
-        # Рисуем на оригинале
-        frame = cv2.imread(img_path)
-        cv2.putText(frame, label, (30, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 2)
-        cv2.imwrite(os.path.join(output_dir, file), frame)
+def _draw_and_save(frame, label, out_path):
+    cv2.putText(frame, label, (30, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 2)
+    cv2.imwrite(out_path, frame)
+
+
+def classify_and_draw(input_dir, output_dir, batch_size=BATCH_SIZE, workers=LOADER_WORKERS, backend=None):
+    os.makedirs(output_dir, exist_ok=True)
+    frame_files = sorted(f for f in os.listdir(input_dir) if f.endswith(".jpg"))
+    paths = [os.path.join(input_dir, file) for file in frame_files]
+
+    # Декодирование и запись идут в потоках, модель считает пакетами
+    with ThreadPoolExecutor(max_workers=workers) as writer:
+        pending = []
+        for img_path, frame, class_id, _ in tqdm(
+                classify_batched(get_model(backend), paths, _load_frame, batch_size, workers), total=len(paths)):
+            if frame is None:
+                continue
+            out_path = os.path.join(output_dir, os.path.basename(img_path))
+            pending.append(writer.submit(_draw_and_save, frame, class_names[class_id], out_path))
+            if len(pending) >= batch_size * 2:
+                pending.pop(0).result()
+        for future in pending:
+            future.result()
 
     print("✅ Все кадры обработаны")
 
+
+def classify_video(video_path, output_path, every_n=1, fps=None, batch_size=BATCH_SIZE, backend=None):
+    """Видео -> видео с подписями классов без промежуточных кадров на диске."""
+    report = label_video(video_path, output_path, get_model(backend), resize_frame, class_names,
+                         fps=fps, every_n=every_n, batch_size=batch_size)
+    print(f"🎞 Видео сохранено: {output_path}, {report['fps']} кадров/с")
+    return report
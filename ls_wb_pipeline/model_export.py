@@ -0,0 +1,195 @@
+"""
+Экспорт классификатора (best.pt) в TorchScript или ONNX для инференса на CPU,
+при желании — с динамическим int8-квантованием весов.
+
+После экспорта артефакт загружается тем же кодом, что и при инференсе (inference.load_model),
+и сверяется с eager-моделью: максимальное расхождение логитов и совпадение top-1.
+Заодно быстрый препроцессинг (cv2 + пакетная нормализация) сверяется с цепочкой torchvision.
+Артефакт собирается во временный файл и подменяет рабочий только после успешной сверки;
+если сверка не прошла, рабочий артефакт не трогается и команда завершается с кодом 1.
+Для ONNX нужны необязательные пакеты onnx и onnxruntime; без onnxruntime инференс
+откатывается на eager.
+
+Пример:
+    python -m ls_wb_pipeline.model_export --format onnx
+    python -m ls_wb_pipeline.model_export --format torchscript --int8 --images ./frames
+    python -m ls_wb_pipeline.model_export --preprocess-only --images ./frames
+
+Инференс на артефакте: settings.INFERENCE_BACKEND = "onnx" (и INFERENCE_INT8 = True для int8)
+или get_model(backend="onnx").
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+from ls_wb_pipeline.inference import (BACKENDS, IMAGE_SIZE, MODEL_PATH, artifact_path, check_preprocess_parity,
+                                      load_eager, load_model, preprocess_batch)
+
+# Допуски сверки: fp32-экспорт должен совпадать почти точно, int8 — по top-1
+FP32_ATOL = 1e-3
+MIN_AGREEMENT = {False: 1.0, True: 0.98}
+
+
+def load_frames(images_dir: str, limit: int):
+    import cv2
+    files = sorted(f for f in os.listdir(images_dir) if f.lower().endswith((".jpg", ".jpeg", ".png")))
+    return [cv2.imread(os.path.join(images_dir, f)) for f in files[:limit]]
+
+
+def synthetic_frames(count: int = 8, width: int = 1280, height: int = 720, seed: int = 0):
+    """Кадры-заглушки для сверки препроцессинга без реальных данных: градиенты, прямоугольники, JPEG."""
+    import cv2
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    frames = []
+    for _ in range(count):
+        frame = np.stack([xx * 255 // width, yy * 255 // height, (xx + yy) % 256], axis=-1).astype(np.uint8)
+        for _ in range(20):
+            x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            cv2.rectangle(frame, (x, y), (x + int(rng.integers(10, 300)), y + int(rng.integers(10, 200))), color, -1)
+        frames.append(cv2.imdecode(cv2.imencode(".jpg", frame)[1], cv2.IMREAD_COLOR))
+    return frames
+
+
+def example_batch(batch_size: int = 32, images_dir: str = None):
+    """Пакет для трассировки и сверки: реальные кадры из images_dir или шум с фиксированным seed."""
+    import torch
+    if images_dir:
+        frames = load_frames(images_dir, batch_size)
+        if frames:
+            return torch.from_numpy(preprocess_batch(frames))
+    generator = torch.Generator().manual_seed(0)
+    return torch.randn(batch_size, 3, IMAGE_SIZE, IMAGE_SIZE, generator=generator)
+
+
+def _quantize(model):
+    import torch
+    # Динамическое квантование: int8-веса у Linear, активации квантуются на лету
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_torchscript(model, example, out_path: str, quantize: bool = False):
+    import torch
+    if quantize:
+        model = _quantize(model)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example[:1], check_trace=False)
+        traced = torch.jit.freeze(traced.eval())
+    traced.save(out_path)
+
+
+def export_onnx(model, example, out_path: str, quantize: bool = False, opset: int = 17):
+    import torch
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fp32_path = os.path.join(tmp_dir, "model.onnx") if quantize else out_path
+        with torch.no_grad():
+            torch.onnx.export(model, example[:1], fp32_path, input_names=["images"], output_names=["logits"],
+                              dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}},
+                              opset_version=opset, do_constant_folding=True)
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(fp32_path, out_path, weight_type=QuantType.QInt8)
+
+
+def _logits(model, batch):
+    import torch
+    with torch.inference_mode():
+        out = model(batch)
+        if isinstance(out, (tuple, list)):
+            out = out[0]
+        return out.float()
+
+
+def _throughput(model, batch, repeat: int = 3):
+    _logits(model, batch)  # прогрев
+    started = time.perf_counter()
+    for _ in range(repeat):
+        _logits(model, batch)
+    return len(batch) * repeat / (time.perf_counter() - started)
+
+
+def check_parity(reference, candidate, batch, quantized: bool = False, atol: float = FP32_ATOL):
+    """Сверяет логиты кандидата с эталонной моделью на batch. Возвращает отчёт с ключом ok."""
+    expected = _logits(reference, batch)
+    actual = _logits(candidate, batch)
+    max_abs_diff = (expected - actual).abs().max().item()
+    agreement = (expected.argmax(1) == actual.argmax(1)).float().mean().item()
+    ok = agreement >= MIN_AGREEMENT[quantized] and (quantized or max_abs_diff <= atol)
+    return {"ok": ok, "samples": len(batch), "max_abs_diff": round(max_abs_diff, 6),
+            "top1_agreement": round(agreement, 4)}
+
+
+def export_model(model_path: str = MODEL_PATH, backend: str = "onnx", quantize: bool = False,
+                 out_path: str = None, images_dir: str = None, batch_size: int = 32):
+    """
+    Экспортирует модель во временный файл рядом с артефактом, сверяет его с eager и только
+    при успешной сверке подменяет артефакт через os.replace: реестр моделей перечитывает файл
+    по mtime, и непроверенный экспорт не должен попасть в инференс.
+    """
+    if backend not in BACKENDS or backend == "eager":
+        raise ValueError(f"Экспорт возможен в torchscript или onnx, не {backend!r}")
+    out_path = out_path or artifact_path(model_path, backend, quantize)
+    root, ext = os.path.splitext(out_path)
+    tmp_path = f"{root}.{uuid.uuid4().hex}.tmp{ext}"
+    reference = load_eager(model_path)
+    batch = example_batch(batch_size, images_dir)
+
+    try:
+        started = time.perf_counter()
+        if backend == "torchscript":
+            export_torchscript(reference, batch, tmp_path, quantize)
+        else:
+            export_onnx(reference, batch, tmp_path, quantize)
+        export_seconds = time.perf_counter() - started
+
+        candidate = load_model(backend, path=tmp_path, model_path=model_path, fallback=False)
+        report = check_parity(reference, candidate, batch, quantized=quantize)
+        eager_fps = _throughput(reference, batch)
+        candidate_fps = _throughput(candidate, batch)
+        report.update({
+            "artifact": out_path if report["ok"] else None,
+            "backend": backend,
+            "int8": quantize,
+            "export_s": round(export_seconds, 2),
+            "size_mb": round(os.path.getsize(tmp_path) / 1024 / 1024, 2),
+            "eager_images_per_s": round(eager_fps, 1),
+            "images_per_s": round(candidate_fps, 1),
+            "speedup": round(candidate_fps / eager_fps, 2) if eager_fps else None,
+        })
+        if report["ok"]:
+            os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Экспорт классификатора в TorchScript/ONNX со сверкой с eager")
+    parser.add_argument("--model", default=MODEL_PATH, help="Исходная модель (best.pt)")
+    parser.add_argument("--format", choices=("torchscript", "onnx"), default="onnx", help="Формат артефакта")
+    parser.add_argument("--int8", action="store_true", help="Динамическое int8-квантование весов")
+    parser.add_argument("--out", help="Куда сохранить артефакт (по умолчанию рядом с моделью)")
+    parser.add_argument("--images", help="Папка с кадрами для сверки (иначе — случайные входы)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Размер пакета для сверки и замера")
+    parser.add_argument("--preprocess-only", action="store_true",
+                        help="Только сверить препроцессинг с torchvision, без модели")
+    args = parser.parse_args()
+
+    frames = (load_frames(args.images, args.batch_size) if args.images else None) or synthetic_frames()
+    result = {"preprocess": check_preprocess_parity(frames)}
+    if not args.preprocess_only:
+        result.update(export_model(args.model, args.format, args.int8, args.out, args.images, args.batch_size))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if not result["preprocess"]["ok"]:
+        print("❌ Быстрый препроцессинг расходится с torchvision", file=sys.stderr)
+        sys.exit(1)
+    if not result.get("ok", True):
+        print("❌ Артефакт расходится с eager-моделью и не установлен", file=sys.stderr)
+        sys.exit(1)
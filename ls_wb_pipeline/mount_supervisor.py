@@ -0,0 +1,275 @@
+import atexit
+import os
+import random
+import subprocess
+import threading
+import time
+import uuid
+
+from ls_wb_pipeline import metrics, settings
+from ls_wb_pipeline.logger import logger
+
+# Проверка монтирования — statvfs точки (или stat контрольного файла), а не listdir тысяч кадров
+MOUNT_SENTINEL = getattr(settings, "MOUNT_SENTINEL", None)  # имя файла внутри MOUNTED_PATH, None — statvfs
+# Сколько ждать ответа FUSE: зависший endpoint не должен блокировать вызывающий поток
+MOUNT_PROBE_TIMEOUT = float(getattr(settings, "MOUNT_PROBE_TIMEOUT", 5))
+# Период фоновой проверки живого монтирования
+MOUNT_CHECK_INTERVAL = float(getattr(settings, "MOUNT_CHECK_INTERVAL", 15))
+# Сколько вызывающий ждёт готовности монтирования
+MOUNT_READY_TIMEOUT = float(getattr(settings, "MOUNT_READY_TIMEOUT", 60))
+# Экспоненциальная пауза между неудачными перемонтированиями: 1, 2, 4 ... до MOUNT_BACKOFF_MAX сек
+MOUNT_BACKOFF_BASE = float(getattr(settings, "MOUNT_BACKOFF_BASE", 1))
+MOUNT_BACKOFF_MAX = float(getattr(settings, "MOUNT_BACKOFF_MAX", 60))
+# Перемонтирует только владелец аренды webdav_mount (общей для процессов, в task_store):
+# сервис монтирования держит её постоянно, остальные берут, лишь если сервиса нет
+MOUNT_LEASE_NAME = "webdav_mount"
+MOUNT_LEASE_TTL = float(getattr(settings, "MOUNT_LEASE_TTL", 60))
+
+# Проверки, зависшие на мёртвом FUSE: поток не прервать, но новых сверх лимита не плодим
+MAX_HUNG_PROBES = 4
+
+_PROBE_LOCK = threading.Lock()
+_probes = []
+
+
+def _stat_mount(path, sentinel):
+    if not os.path.ismount(path):
+        return False
+    if sentinel:
+        os.stat(os.path.join(path, sentinel))
+    else:
+        os.statvfs(path)
+    return True
+
+
+def probe(path: str = None, sentinel: str = MOUNT_SENTINEL, timeout: float = MOUNT_PROBE_TIMEOUT) -> bool:
+    """
+    Смонтирован ли path и отвечает ли FUSE. Проверка идёт в отдельном потоке с таймаутом;
+    если уже MAX_HUNG_PROBES проверок висят на мёртвом endpoint, новая не запускается и ответ — False.
+    """
+    path = path or settings.MOUNTED_PATH
+    result = {}
+
+    def run():
+        try:
+            result["ok"] = _stat_mount(path, sentinel)
+        except OSError as e:
+            result["error"] = e
+
+    with _PROBE_LOCK:
+        _probes[:] = [t for t in _probes if t.is_alive()]
+        if len(_probes) >= MAX_HUNG_PROBES:
+            logger.warning(f"Путь {path} не отвечает: {len(_probes)} проверок ещё висят")
+            return False
+        thread = threading.Thread(target=run, name="mount-probe", daemon=True)
+        _probes.append(thread)
+        thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        logger.warning(f"Путь {path} не ответил за {timeout} сек")
+        return False
+    if "error" in result:
+        logger.warning(f"Путь {path} смонтирован, но недоступен: {result['error']}")
+        return False
+    return result.get("ok", False)
+
+
+def rclone_args(from_systemd: bool = False):
+    args = ["rclone", "mount", settings.WEBDAV_REMOTE, settings.MOUNTED_PATH, "--no-modtime"]
+    if not from_systemd:
+        args.append("--daemon")
+    else:
+        args += [
+            "--vfs-cache-mode", "writes",
+            "--dir-cache-time", "5s",
+            "--poll-interval", "5s"
+        ]
+    return args
+
+
+class MountSupervisor:
+    """
+    Держит WebDAV смонтированным: фоновый поток проверяет точку монтирования раз в
+    check_interval, при отказе перемонтирует с экспоненциальной паузой между попытками.
+    Вызывающие не спят фиксированное время, а ждут события готовности (wait_ready).
+    Перемонтирует только держатель аренды MOUNT_LEASE_NAME, остальные процессы лишь проверяют и ждут:
+    иначе несколько воркеров одновременно делали бы fusermount -uz чужому свежему монтированию.
+    from_systemd=True — сервис монтирования: держит аренду постоянно, rclone работает дочерним
+    процессом без --daemon; его выход = размонтирование.
+    """
+
+    def __init__(self, from_systemd: bool = False, check_interval: float = MOUNT_CHECK_INTERVAL,
+                 backoff_base: float = MOUNT_BACKOFF_BASE, backoff_max: float = MOUNT_BACKOFF_MAX):
+        self.from_systemd = from_systemd
+        self.check_interval = check_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.ready = threading.Event()
+        self.failures = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._rclone = None
+        self._thread = None
+        self._owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="mount-supervisor", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = MOUNT_READY_TIMEOUT):
+        """Останавливает фоновый поток, завершает дочерний rclone (from_systemd) и отпускает аренду."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # Если поток завис на мёртвом FUSE, rclone всё равно не должен пережить супервизор
+        self._terminate_rclone()
+        self._release_lease()
+
+    def check_now(self):
+        """Внеочередная проверка (например, после ошибки чтения из точки монтирования)."""
+        self.ready.clear()
+        self._wake.set()
+
+    def wait_ready(self, timeout: float = MOUNT_READY_TIMEOUT) -> bool:
+        return self.ready.wait(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.from_systemd:
+                self._acquire_lease()
+            if self._healthy():
+                self.failures = 0
+                self.ready.set()
+                delay = self.check_interval
+            else:
+                self.ready.clear()
+                if not self._acquire_lease():
+                    # Перемонтирует другой процесс — только ждём его результата
+                    delay = min(self.check_interval, MOUNT_PROBE_TIMEOUT)
+                elif probe():
+                    # Пока ждали аренду, смонтировал кто-то другой
+                    self.ready.set()
+                    delay = self.check_interval
+                elif self._remount():
+                    self.failures = 0
+                    self.ready.set()
+                    delay = self.check_interval
+                else:
+                    self.failures += 1
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** (self.failures - 1))
+                    delay += random.uniform(0, delay / 4)
+                    logger.error(f"WebDAV не смонтирован (попытка {self.failures}), повтор через {delay:.1f} сек")
+            self._wake.wait(delay)
+            self._wake.clear()
+        self._terminate_rclone()
+        self._release_lease()
+
+    def _acquire_lease(self) -> bool:
+        """
+        Берёт или продлевает аренду перемонтирования. После перемонтирования аренда не
+        отпускается, а истекает сама: это пауза, за которую остальные увидят свежее монтирование.
+        """
+        try:
+            from ls_wb_pipeline.fastapi_app.task_store import get_task_store
+            return get_task_store().try_acquire(MOUNT_LEASE_NAME, self._owner, MOUNT_LEASE_TTL)
+        except Exception as e:
+            # Без общего хранилища координировать не с кем — ведём себя как единственный процесс
+            logger.warning(f"Аренда {MOUNT_LEASE_NAME} недоступна, перемонтируем сами: {e}")
+            return True
+
+    def _release_lease(self):
+        try:
+            from ls_wb_pipeline.fastapi_app.task_store import get_task_store
+            get_task_store().release(MOUNT_LEASE_NAME, self._owner)
+        except Exception:
+            pass
+
+    def _healthy(self) -> bool:
+        if self._rclone is not None and self._rclone.poll() is not None:
+            logger.warning(f"rclone mount завершился с кодом {self._rclone.returncode}")
+            self._rclone = None
+            return False
+        return probe()
+
+    def _remount(self) -> bool:
+        logger.warning("WebDAV отключен. Перемонтируем...")
+        subprocess.run(["fusermount", "-uz", settings.MOUNTED_PATH], check=False,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._terminate_rclone()
+        try:
+            os.makedirs(settings.MOUNTED_PATH, exist_ok=True)
+            if self.from_systemd:
+                self._rclone = subprocess.Popen(rclone_args(from_systemd=True))
+            else:
+                # С --daemon rclone возвращается, когда монтирование уже готово
+                subprocess.run(rclone_args(), check=True)
+        except Exception as e:
+            logger.error(f"Ошибка при монтировании WebDAV: {e}")
+            metrics.inc("webdav_remounts", result="error")
+            return False
+
+        # Для дочернего rclone — короткий опрос до появления точки монтирования
+        deadline = time.monotonic() + MOUNT_PROBE_TIMEOUT
+        while True:
+            if probe():
+                logger.info(f"WebDAV успешно смонтирован в {settings.MOUNTED_PATH}")
+                metrics.inc("webdav_remounts", result="ok")
+                return True
+            if time.monotonic() >= deadline or self._stop.wait(0.2):
+                metrics.inc("webdav_remounts", result="failed")
+                return False
+
+    def _terminate_rclone(self):
+        rclone, self._rclone = self._rclone, None
+        if rclone is not None and rclone.poll() is None:
+            rclone.terminate()
+            try:
+                rclone.wait(10)
+            except subprocess.TimeoutExpired:
+                rclone.kill()
+                rclone.wait()
+
+
+_SUPERVISOR_LOCK = threading.Lock()
+_supervisor = None
+
+
+def get_supervisor(from_systemd: bool = False) -> MountSupervisor:
+    """Общий супервизор процесса (запускается при первом обращении, останавливается при выходе)."""
+    global _supervisor
+    with _SUPERVISOR_LOCK:
+        if _supervisor is None:
+            _supervisor = MountSupervisor(from_systemd=from_systemd)
+            atexit.register(shutdown)
+        return _supervisor.start()
+
+
+def shutdown():
+    """Останавливает супервизор процесса: дочерний rclone завершается и дожидается, аренда отпускается."""
+    with _SUPERVISOR_LOCK:
+        supervisor = _supervisor
+    if supervisor is not None:
+        supervisor.stop()
+
+
+def report_io_error():
+    """Ошибка чтения/записи в точке монтирования: внеочередная проверка, если супервизор запущен."""
+    with _SUPERVISOR_LOCK:
+        supervisor = _supervisor
+    if supervisor is not None:
+        supervisor.check_now()
+
+
+def ensure_mounted(from_systemd: bool = False, timeout: float = MOUNT_READY_TIMEOUT) -> bool:
+    """Ждёт готовности WebDAV; если монтирование живо, возвращается сразу, без проверок."""
+    supervisor = get_supervisor(from_systemd)
+    if supervisor.ready.is_set():
+        return True
+    if not supervisor.wait_ready(timeout):
+        logger.error(f"WebDAV не готов за {timeout} сек")
+        return False
+    return True
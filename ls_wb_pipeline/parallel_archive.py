@@ -0,0 +1,142 @@
+import os
+import tarfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from ls_wb_pipeline import zip_stream
+
+CODECS = ("stored", "deflate", "zstd")
+ARCHIVE_NAMES = {
+    "stored": "dataset.zip",
+    "deflate": "dataset.deflate.zip",
+    "zstd": "dataset.tar.zst",
+}
+# Допустимые уровни сжатия (для stored уровень не используется)
+LEVELS = {
+    "deflate": (0, 9),
+    "zstd": (1, 22),
+}
+_METHOD_STORED = 0
+_METHOD_DEFLATED = 8
+_ZIP_FLAGS = 0x0800  # UTF-8 имена, CRC и размеры известны заранее
+
+ProgressCallback = Optional[Callable[[int, int], None]]
+
+
+def check_codec(codec: str, level: int):
+    """ValueError для неизвестного кодека или уровня вне допустимого для него диапазона."""
+    if codec not in CODECS:
+        raise ValueError(f"Неизвестный codec {codec}. Доступны: {', '.join(CODECS)}")
+    if codec in LEVELS:
+        low, high = LEVELS[codec]
+        if not low <= level <= high:
+            raise ValueError(f"Уровень сжатия {level} вне диапазона {low}..{high} для codec={codec}")
+
+
+def _read_and_compress(path: str, method: int, level: int):
+    """Выполняется в пуле: zlib отпускает GIL, поэтому потоки реально параллельны."""
+    with open(path, "rb") as f:
+        data = f.read()
+    crc = zlib.crc32(data)
+    if method == _METHOD_DEFLATED:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        payload = compressor.compress(data) + compressor.flush()
+        if len(payload) >= len(data):
+            # Несжимаемое (например, JPEG) — храним как есть
+            return crc, len(data), data, _METHOD_STORED
+        return crc, len(data), payload, method
+    return crc, len(data), data, method
+
+
+def _build_zip(root: Path, out_path: Path, arcnames: List[str], snapshot: Dict[str, List[float]],
+               method: int, level: int, workers: int, progress_cb: ProgressCallback):
+    central = []
+    offset = 0
+    total = len(arcnames)
+    window = max(1, workers) * 4
+    with open(out_path, "wb") as out, ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        names = iter(arcnames)
+        pending = deque()
+
+        def submit_next():
+            arcname = next(names, None)
+            if arcname is not None:
+                pending.append((arcname, pool.submit(_read_and_compress, str(root / arcname), method, level)))
+
+        for _ in range(window):
+            submit_next()
+
+        done = 0
+        while pending:
+            arcname, future = pending.popleft()
+            submit_next()
+            done += 1
+            try:
+                crc, size, payload, member_method = future.result()
+            except FileNotFoundError:
+                continue
+            name = arcname.replace(os.sep, "/").encode("utf-8")
+            mtime = snapshot[arcname][1]
+            header = zip_stream.pack_local_header(name, mtime, flags=_ZIP_FLAGS, method=member_method,
+                                                  crc=crc, compressed_size=len(payload), size=size)
+            out.write(header)
+            out.write(payload)
+            central.append(zip_stream.pack_central_header(name, mtime, crc, len(payload), size, offset,
+                                                          flags=_ZIP_FLAGS, method=member_method))
+            offset += len(header) + len(payload)
+            if progress_cb and (done % 50 == 0 or done == total):
+                progress_cb(done, total)
+
+        cd_size = sum(len(c) for c in central)
+        for record in central:
+            out.write(record)
+        out.write(zip_stream.pack_end_records(len(central), offset, cd_size))
+
+
+def _build_tar_zst(root: Path, out_path: Path, arcnames: List[str], level: int, workers: int,
+                   progress_cb: ProgressCallback):
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("Для codec=zstd нужен пакет zstandard (pip install zstandard)")
+
+    total = len(arcnames)
+    compressor = zstandard.ZstdCompressor(level=level, threads=max(1, workers))
+    with open(out_path, "wb") as raw, compressor.stream_writer(raw, closefd=False) as zst, \
+            tarfile.open(fileobj=zst, mode="w|", format=tarfile.GNU_FORMAT) as tar:
+        for done, arcname in enumerate(arcnames, 1):
+            try:
+                tar.add(str(root / arcname), arcname=arcname, recursive=False)
+            except FileNotFoundError:
+                continue
+            if progress_cb and (done % 50 == 0 or done == total):
+                progress_cb(done, total)
+
+
+def build_archive(dataset_dir, out_path, snapshot: Dict[str, List[float]], codec: str = "deflate",
+                  level: int = 6, workers: int = 4, progress_cb: ProgressCallback = None):
+    """
+    Собирает архив датасета выбранным кодеком с многопоточным сжатием.
+    stored/deflate — ZIP: члены сжимаются в пуле потоков, пишутся строго по порядку;
+    zstd — tar.zst с внутренней многопоточностью zstd.
+    Пишет во временный файл и атомарно подменяет out_path.
+    """
+    check_codec(codec, level)
+    root = Path(dataset_dir)
+    out_path = Path(out_path)
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    arcnames = sorted(snapshot)
+    if progress_cb:
+        progress_cb(0, len(arcnames))
+
+    if codec == "zstd":
+        _build_tar_zst(root, tmp_path, arcnames, level, workers, progress_cb)
+    else:
+        method = _METHOD_DEFLATED if codec == "deflate" else _METHOD_STORED
+        _build_zip(root, tmp_path, arcnames, snapshot, method, level, workers, progress_cb)
+    tmp_path.replace(out_path)
+    return {"archive_path": str(out_path), "codec": codec, "files": len(arcnames),
+            "size": out_path.stat().st_size}
@@ -0,0 +1,199 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import unquote
+
+from ls_wb_pipeline import functions, metrics, settings
+from ls_wb_pipeline.inference import CLASS_NAMES, IMAGE_SIZE, MODEL_PATH, classify_batched, get_model, resize_frame
+from ls_wb_pipeline.logger import logger
+
+# Предразметка: предсказания классификатора уходят в Label Studio как predictions
+PREANNOTATE_ENABLED = bool(getattr(settings, "PREANNOTATE", False))
+# Сколько предсказаний в одном запросе импорта
+PREDICTIONS_CHUNK_SIZE = int(getattr(settings, "PREDICTIONS_CHUNK_SIZE", 500))
+# Параллельных запросов импорта (и размер пула соединений сессии)
+PREDICTIONS_PUSH_WORKERS = int(getattr(settings, "PREDICTIONS_PUSH_WORKERS", 2))
+# Имена тегов из конфига разметки проекта: <Choices name="choice" toName="image">
+LS_CHOICES_FROM_NAME = getattr(settings, "LS_CHOICES_FROM_NAME", "choice")
+LS_IMAGE_TO_NAME = getattr(settings, "LS_IMAGE_TO_NAME", "image")
+
+
+def model_version(model_path: str = MODEL_PATH) -> str:
+    """best.pt@2025-05-01T08:00 — меняется вместе с файлом модели."""
+    version = getattr(settings, "PREDICTIONS_MODEL_VERSION", None)
+    if version:
+        return version
+    mtime = datetime.fromtimestamp(os.path.getmtime(model_path)).strftime("%Y-%m-%dT%H:%M")
+    return f"{os.path.basename(model_path)}@{mtime}"
+
+
+def needs_prediction(task: dict, version: str, overwrite: bool = False) -> bool:
+    """Неразмеченная задача без предсказаний (или с предсказаниями другой версии модели при overwrite)."""
+    if functions.check_if_ann(task):
+        return False
+    predictions = task.get("predictions") or []
+    if not predictions:
+        return not task.get("total_predictions")
+    # Версию видно только у развёрнутых предсказаний (fields=all); без неё задачу не трогаем
+    if not overwrite or not all(isinstance(p, dict) for p in predictions):
+        return False
+    return all(p.get("model_version") != version for p in predictions)
+
+
+def stale_prediction_ids(task: dict, version: str):
+    """id предсказаний задачи от других версий модели — удаляются после отправки новых при overwrite."""
+    return [p["id"] for p in task.get("predictions") or []
+            if isinstance(p, dict) and p.get("id") is not None and p.get("model_version") != version]
+
+
+def task_image_path(task: dict) -> str:
+    """Кадр задачи в смонтированном WebDAV (как в build_classification_dataset)."""
+    return os.path.join(settings.MOUNTED_PATH, os.path.basename(unquote(task["data"]["image"])))
+
+
+def _load_task_image(task):
+    import cv2
+    import numpy as np
+    frame = cv2.imread(task_image_path(task))
+    if frame is None:
+        # Файла нет (удалён или не примонтирован) — пустышка, предсказание не отправляется
+        return np.zeros((IMAGE_SIZE, IMAGE_SIZE, 3), np.uint8), None
+    return resize_frame(frame), task
+
+
+def build_prediction(task_id: int, label: str, score: float, version: str) -> dict:
+    return {
+        "task": task_id,
+        "model_version": version,
+        "score": round(float(score), 4),
+        "result": [{
+            "from_name": LS_CHOICES_FROM_NAME,
+            "to_name": LS_IMAGE_TO_NAME,
+            "type": "choices",
+            "value": {"choices": [label]},
+        }],
+    }
+
+
+def new_ls_session(pool_size: int = PREDICTIONS_PUSH_WORKERS):
+    """Сессия requests с пулом keep-alive соединений к Label Studio."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class _NotProcessed(Exception):
+    """Ответ, после которого сервер точно не принял запрос (502/503/504) — повтор безопасен."""
+
+
+def push_predictions(session, predictions) -> int:
+    """
+    Одним запросом импортирует пакет предсказаний в проект. Возвращает число принятых (0 при ошибке).
+    Импорт не идемпотентен, поэтому повторяются только запросы, не дошедшие до сервера
+    (таймаут соединения, 502/503/504): повтор после таймаута чтения или 4xx задвоил бы предсказания.
+    """
+    import requests
+    url = f"{settings.LABELSTUDIO_API_URL}/projects/{settings.PROJECT_ID}/import/predictions"
+
+    def post():
+        response = functions.ls_request("POST", url, "projects/import/predictions", json=predictions,
+                                        session=session, timeout=120)
+        if response.status_code in (502, 503, 504):
+            raise _NotProcessed(f"HTTP {response.status_code}")
+        response.raise_for_status()
+
+    try:
+        functions.with_retries(post, exceptions=(requests.exceptions.ConnectTimeout, _NotProcessed),
+                               log_prefix="[LS:import/predictions] ")
+    except Exception as e:
+        logger.error(f"[PREANNOTATE] Не удалось отправить {len(predictions)} предсказаний: {e}")
+        return 0
+    metrics.inc("predictions_pushed", len(predictions))
+    return len(predictions)
+
+
+def delete_predictions(session, prediction_ids) -> int:
+    """Удаляет предсказания по id (уже удалённые считаются успехом). Возвращает число удалённых."""
+    deleted = 0
+    for prediction_id in prediction_ids:
+        try:
+            response = functions.ls_request("DELETE", f"{settings.LABELSTUDIO_API_URL}/predictions/{prediction_id}",
+                                            "predictions/{id}", session=session, timeout=30)
+        except Exception as e:
+            logger.warning(f"[PREANNOTATE] Не удалось удалить предсказание {prediction_id}: {e}")
+            continue
+        if response.ok or response.status_code == 404:
+            deleted += 1
+        else:
+            logger.warning(f"[PREANNOTATE] Не удалось удалить предсказание {prediction_id}: "
+                           f"HTTP {response.status_code}")
+    return deleted
+
+
+def _push_chunk(session, predictions, stale_ids):
+    """Отправляет пакет; старые версии удаляются только после того, как новые приняты."""
+    pushed = push_predictions(session, predictions)
+    deleted = delete_predictions(session, stale_ids) if pushed and stale_ids else 0
+    return pushed, deleted
+
+
+def preannotate_tasks(tasks=None, backend: str = None, chunk_size: int = PREDICTIONS_CHUNK_SIZE,
+                      overwrite: bool = False, dry_run: bool = False, progress_cb=None):
+    """
+    Предразметка новых задач: пакетный инференс по кадрам неразмеченных задач без
+    предсказаний и отправка predictions в Label Studio чанками по одной пуловой сессии.
+    Чанки уходят в фоне, пока модель считает следующие кадры.
+    overwrite=True — задачи с предсказаниями только других версий модели предсказываются
+    заново, а старые предсказания удаляются.
+    """
+    started = time.perf_counter()
+    if tasks is None:
+        tasks = functions.get_all_tasks(progress_cb=progress_cb) or []
+    version = model_version()
+    todo = [task for task in tasks if needs_prediction(task, version, overwrite)]
+    logger.info(f"[PREANNOTATE] Задач: {len(tasks)}, к предразметке: {len(todo)}, модель {version}")
+
+    report = {"tasks": len(tasks), "candidates": len(todo), "predicted": 0, "pushed": 0, "missing_images": 0,
+              "stale_deleted": 0, "model_version": version, "dry_run": dry_run, "by_class": {}}
+    if not todo:
+        return report
+
+    session = new_ls_session()
+    chunk, stale, pending = [], [], []
+    with ThreadPoolExecutor(max_workers=PREDICTIONS_PUSH_WORKERS) as pusher:
+        def flush():
+            if chunk and not dry_run:
+                pending.append(pusher.submit(_push_chunk, session, list(chunk), list(stale)))
+            chunk.clear()
+            stale.clear()
+
+        for task, loaded, class_id, score in classify_batched(get_model(backend), todo, _load_task_image):
+            if loaded is None:
+                report["missing_images"] += 1
+                continue
+            label = CLASS_NAMES[class_id]
+            report["by_class"][label] = report["by_class"].get(label, 0) + 1
+            chunk.append(build_prediction(task["id"], label, score, version))
+            if overwrite:
+                stale.extend(stale_prediction_ids(task, version))
+            report["predicted"] += 1
+            if len(chunk) >= chunk_size:
+                flush()
+                functions.report_progress(progress_cb, "preannotate", done=report["predicted"], total=len(todo))
+        flush()
+        for future in pending:
+            pushed, deleted = future.result()
+            report["pushed"] += pushed
+            report["stale_deleted"] += deleted
+    session.close()
+    if not dry_run:
+        report["failed"] = report["predicted"] - report["pushed"]
+
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    logger.info(f"[PREANNOTATE] {'[DRY RUN] ' if dry_run else ''}Готово: {report}")
+    return report
@@ -0,0 +1,122 @@
+import math
+
+from ls_wb_pipeline import metrics, settings
+from ls_wb_pipeline.inference import (BATCH_SIZE, CLASS_NAMES, BatchBuffer, configure_threads, predict_proba,
+                                      resize_frame)
+
+# Отбор кадров моделью перед загрузкой в Label Studio (выключен по умолчанию)
+TRIAGE_ENABLED = bool(getattr(settings, "FRAME_TRIAGE", False))
+# Мера неуверенности: entropy (энтропия распределения) или margin (1 - разрыв top-1 и top-2)
+TRIAGE_METHOD = getattr(settings, "TRIAGE_METHOD", "entropy")
+# Доля отобранных из видео кадров, которая уходит в загрузку
+TRIAGE_KEEP_RATIO = float(getattr(settings, "TRIAGE_KEEP_RATIO", 0.25))
+# Не больше этой доли загружаемых из видео кадров на один предсказанный класс
+TRIAGE_CLASS_CAP = float(getattr(settings, "TRIAGE_CLASS_CAP", 0.4))
+# Вес бонуса за редкость предсказанного класса (по всем кадрам прогона) относительно неуверенности
+TRIAGE_RARE_WEIGHT = float(getattr(settings, "TRIAGE_RARE_WEIGHT", 0.5))
+
+
+def uncertainty(probs, method: str = TRIAGE_METHOD):
+    """Вероятности N×K (numpy) -> неуверенность модели в [0, 1] для каждого кадра."""
+    import numpy as np
+    if method == "margin":
+        top2 = np.sort(probs, axis=1)[:, -2:]
+        return 1.0 - (top2[:, 1] - top2[:, 0])
+    if method == "entropy":
+        entropy = -(probs * np.log(np.clip(probs, 1e-12, 1.0))).sum(axis=1)
+        return entropy / math.log(probs.shape[1])
+    raise ValueError(f"Неизвестный метод отбора {method!r}: entropy или margin")
+
+
+def create_triage(**kwargs):
+    """FrameTriage с моделью по умолчанию; None (с предупреждением), если модель не загрузилась."""
+    from ls_wb_pipeline.inference import get_model
+    from ls_wb_pipeline.logger import logger
+    try:
+        return FrameTriage(get_model(), **kwargs)
+    except Exception as e:
+        logger.warning(f"[TRIAGE] Модель недоступна, кадры загружаются без отбора: {e}")
+        return None
+
+
+class FrameTriage:
+    """
+    Оценивает кадры видео классификатором пакетами и решает, какие из них загружать.
+    Приоритет кадра — неуверенность модели плюс бонус за редкость предсказанного класса
+    (доля класса считается по всем кадрам прогона), на каждый класс — потолок.
+    Один экземпляр на прогон process_video_loop: статистика классов копится между видео.
+    """
+
+    def __init__(self, model, method: str = TRIAGE_METHOD, keep_ratio: float = TRIAGE_KEEP_RATIO,
+                 class_cap: float = TRIAGE_CLASS_CAP, rare_weight: float = TRIAGE_RARE_WEIGHT,
+                 batch_size: int = BATCH_SIZE, class_names=CLASS_NAMES):
+        import numpy as np
+        uncertainty(np.full((1, len(class_names)), 1.0 / len(class_names)), method)  # проверка метода
+        self.model = model
+        self.method = method
+        self.keep_ratio = keep_ratio
+        self.class_cap = class_cap
+        self.rare_weight = rare_weight
+        self.batch_size = batch_size
+        self.class_names = class_names
+        self.class_counts = np.zeros(len(class_names), dtype=np.int64)
+        self._buffer = BatchBuffer()
+        self._pending = []
+        self._scored = []
+        self.last_report = None
+        configure_threads()
+
+    def add(self, key, frame):
+        """Кадр BGR видео; key — то, что вернёт select (например, путь к сохранённому JPEG)."""
+        self._pending.append((key, resize_frame(frame)))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        keys, samples = zip(*self._pending)
+        self._pending = []
+        with metrics.timer(stage="triage"):
+            probs = predict_proba(self.model, self._buffer.to_tensor(list(samples))).numpy()
+        scores = uncertainty(probs, self.method)
+        class_ids = probs.argmax(axis=1)
+        for class_id in class_ids:
+            self.class_counts[class_id] += 1
+        self._scored.extend(zip(keys, class_ids.tolist(), scores.tolist()))
+
+    def select(self, budget: int = None):
+        """
+        Завершает видео: возвращает (ключи к загрузке в порядке приоритета, отчёт).
+        Не больше keep_ratio кадров видео и не больше budget (остаток квоты хранилища).
+        """
+        self._flush()
+        scored, self._scored = self._scored, []
+        total = max(1, int(self.class_counts.sum()))
+        limit = math.ceil(self.keep_ratio * len(scored))
+        if budget is not None:
+            limit = min(limit, max(0, budget))
+        cap = max(1, math.ceil(self.class_cap * limit))
+
+        def priority(item):
+            _, class_id, score = item
+            return score + self.rare_weight * (1.0 - self.class_counts[class_id] / total)
+
+        selected, per_class = [], {}
+        for key, class_id, score in sorted(scored, key=priority, reverse=True):
+            if len(selected) >= limit:
+                break
+            if per_class.get(class_id, 0) >= cap:
+                continue
+            per_class[class_id] = per_class.get(class_id, 0) + 1
+            selected.append(key)
+
+        report = {
+            "scored": len(scored),
+            "selected": len(selected),
+            "method": self.method,
+            "mean_uncertainty": round(sum(s for _, _, s in scored) / len(scored), 4) if scored else None,
+            "selected_by_class": {self.class_names[c]: n for c, n in sorted(per_class.items())},
+        }
+        self.last_report = report
+        return selected, report
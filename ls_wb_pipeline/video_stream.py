@@ -0,0 +1,247 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from ls_wb_pipeline import metrics, settings
+from ls_wb_pipeline.inference import (BATCH_SIZE, CLASS_NAMES, LOADER_WORKERS, BatchBuffer, configure_threads,
+                                      predict, resize_frame)
+from ls_wb_pipeline.video_writer import open_video_writer
+
+# Ёмкость очередей между этапами (в кадрах): ограничивает память, если один этап отстаёт
+QUEUE_SIZE = int(getattr(settings, "VIDEO_STREAM_QUEUE_SIZE", 128))
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Другой этап упал — текущему пора выходить."""
+
+
+class _StageStats:
+    def __init__(self):
+        self.frames = 0
+        self.busy = 0.0
+
+    def report(self):
+        return {"frames": self.frames, "busy_s": round(self.busy, 3),
+                "fps": round(self.frames / self.busy, 1) if self.busy else None}
+
+
+def _put(q, item, stop):
+    while True:
+        if stop.is_set():
+            raise _Stopped()
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _get(q, stop):
+    while True:
+        if stop.is_set():
+            raise _Stopped()
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+
+def put_text(frame, label):
+    """Подпись как в ml_utils.classify_and_draw."""
+    import cv2
+    cv2.putText(frame, label, (30, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 2)
+
+
+class LabelOverlay:
+    """
+    Подпись через PIL (cv2.putText не умеет кириллицу). Каждая метка рендерится один раз,
+    дальше накладывается на кадр по альфа-маске без конвертации кадра в PIL.
+    """
+
+    def __init__(self, font_path=None, size: int = 32, color=(255, 0, 0), position=(400, 30)):
+        self.font_path = font_path
+        self.size = size
+        self.color = tuple(color)
+        self.position = position
+        self._cache = {}
+
+    def _render(self, label):
+        import numpy as np
+        from PIL import Image, ImageDraw, ImageFont
+        font = ImageFont.truetype(self.font_path, self.size) if self.font_path else ImageFont.load_default()
+        _, _, right, bottom = font.getbbox(label)
+        img = Image.new("RGBA", (max(1, right), max(1, bottom)), (0, 0, 0, 0))
+        ImageDraw.Draw(img).text((0, 0), label, font=font, fill=self.color + (255,))
+        rgba = np.asarray(img)
+        # RGB -> BGR, альфа в [0, 1] для смешивания
+        return rgba[..., 2::-1].astype(np.float32), rgba[..., 3:4].astype(np.float32) / 255.0
+
+    def __call__(self, frame, label):
+        if label not in self._cache:
+            self._cache[label] = self._render(label)
+        patch, alpha = self._cache[label]
+        x, y = self.position
+        h = min(patch.shape[0], frame.shape[0] - y)
+        w = min(patch.shape[1], frame.shape[1] - x)
+        if h <= 0 or w <= 0:
+            return
+        roi = frame[y:y + h, x:x + w]
+        a = alpha[:h, :w]
+        roi[:] = (roi * (1.0 - a) + patch[:h, :w] * a).astype(frame.dtype)
+
+
+def _decode_stage(cap, out_q, stats, stop):
+    index = 0
+    while True:
+        started = time.perf_counter()
+        ok, frame = cap.read()
+        stats.busy += time.perf_counter() - started
+        if not ok:
+            break
+        stats.frames += 1
+        _put(out_q, (index, frame), stop)
+        index += 1
+    _put(out_q, _DONE, stop)
+
+
+def _classify_stage(in_q, out_q, model, preprocess, batch_size, every_n, pool, stats, stop):
+    buffer = BatchBuffer()
+    class_id, score = None, None
+    done = False
+    while not done:
+        # Пакет — batch_size кадров для модели плюс кадры между ними, которые получат их метку
+        batch = []
+        while len(batch) < batch_size * every_n:
+            item = _get(in_q, stop)
+            if item is _DONE:
+                done = True
+                break
+            batch.append(item)
+        if not batch:
+            break
+
+        selected = [frame for index, frame in batch if index % every_n == 0]
+        results = iter(())
+        if selected:
+            started = time.perf_counter()
+            tensors = buffer.to_tensor(list(pool.map(preprocess, selected)))
+            stats["preprocess"].busy += time.perf_counter() - started
+            stats["preprocess"].frames += len(selected)
+
+            started = time.perf_counter()
+            class_ids, scores = predict(model, tensors)
+            stats["inference"].busy += time.perf_counter() - started
+            stats["inference"].frames += len(selected)
+            results = zip(class_ids, scores)
+
+        for index, frame in batch:
+            if index % every_n == 0:
+                class_id, score = next(results)
+            # Промежуточные кадры наследуют метку последнего классифицированного
+            _put(out_q, (index, frame, class_id, score), stop)
+    _put(out_q, _DONE, stop)
+
+
+def _encode_stage(in_q, output_path, fps, fourcc, draw, class_names, stats, labels, stop):
+    import cv2
+
+    writer = None
+    try:
+        while True:
+            item = _get(in_q, stop)
+            if item is _DONE:
+                break
+            _, frame, class_id, _ = item
+            label = class_names[class_id]
+            labels[label] += 1
+
+            started = time.perf_counter()
+            draw(frame, label)
+            stats["draw"].busy += time.perf_counter() - started
+            stats["draw"].frames += 1
+
+            started = time.perf_counter()
+            if writer is None:
+                height, width = frame.shape[:2]
+                if fourcc:
+                    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+                else:
+                    writer = open_video_writer(output_path, width, height, fps)
+            writer.write(frame)
+            stats["encode"].busy += time.perf_counter() - started
+            stats["encode"].frames += 1
+    finally:
+        if writer is not None:
+            writer.release()
+
+
+def label_video(video_path, output_path, model, preprocess=resize_frame, class_names=CLASS_NAMES,
+                draw=put_text, fps: float = None, every_n: int = 1, batch_size: int = BATCH_SIZE,
+                workers: int = LOADER_WORKERS, queue_size: int = QUEUE_SIZE, fourcc: str = None):
+    """
+    Видео -> классификация -> видео с подписями одним потоковым конвейером, без папок с JPEG.
+    Этапы (декодирование, препроцессинг + модель, отрисовка + кодирование) работают
+    в своих потоках и связаны ограниченными очередями.
+
+    preprocess(frame BGR) -> кадр uint8 S×S×3 (по умолчанию resize_frame; нормализация идёт
+    пакетом в общий буфер) или готовый тензор C×H×W. every_n > 1 — модель видит только каждый
+    N-й кадр, остальные получают метку предыдущего классифицированного.
+    fourcc=None — кодирование через ffmpeg (video_writer), иначе cv2.VideoWriter с этим fourcc.
+    Возвращает отчёт с пропускной способностью каждого этапа.
+    """
+    import cv2
+
+    every_n = max(1, int(every_n))
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise FileNotFoundError(f"Не удалось открыть видео {video_path}")
+    fps = fps or cap.get(cv2.CAP_PROP_FPS) or 25
+    configure_threads()
+
+    stats = {name: _StageStats() for name in ("decode", "preprocess", "inference", "draw", "encode")}
+    labels = Counter()
+    stop = threading.Event()
+    errors = []
+    decoded_q = queue.Queue(maxsize=max(queue_size, batch_size * every_n))
+    labeled_q = queue.Queue(maxsize=max(queue_size, batch_size * every_n))
+
+    def run(fn, *args):
+        try:
+            fn(*args)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    started = time.perf_counter()
+    with metrics.timer(stage="label_video"), ThreadPoolExecutor(max_workers=workers) as pool:
+        threads = [
+            threading.Thread(target=run, args=(_decode_stage, cap, decoded_q, stats["decode"], stop), daemon=True),
+            threading.Thread(target=run, args=(_classify_stage, decoded_q, labeled_q, model, preprocess,
+                                               batch_size, every_n, pool, stats, stop), daemon=True),
+            threading.Thread(target=run, args=(_encode_stage, labeled_q, output_path, fps, fourcc, draw,
+                                               class_names, stats, labels, stop), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    cap.release()
+    if errors:
+        raise errors[0]
+
+    wall = time.perf_counter() - started
+    frames = stats["encode"].frames
+    return {
+        "frames": frames,
+        "classified": stats["inference"].frames,
+        "wall_s": round(wall, 3),
+        "fps": round(frames / wall, 1) if wall else None,
+        "labels": dict(labels),
+        "stages": {name: s.report() for name, s in stats.items()},
+    }
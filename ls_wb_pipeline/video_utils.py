@@ -2,6 +2,7 @@
 from importlib.resources import read_text
 from urllib.parse import urlparse, parse_qs, unquote
 from ls_wb_pipeline.logger import logger
+from ls_wb_pipeline import metrics
 from ls_wb_pipeline.settings import *
 from webdav3.client import Client
 from itertools import islice
@@ -45,7 +46,9 @@ def parse_cargo_type(video_path, client) -> str:
     report_path = os.path.join(os.path.dirname(video_path), "report.json")
     try:
         with tempfile.NamedTemporaryFile(mode="w+b", delete=False) as tmpf:
-            client.download_sync(remote_path=report_path, local_path=tmpf.name)
+            with metrics.timer(stage="report_json"):
+                client.download_sync(remote_path=report_path, local_path=tmpf.name)
+            metrics.inc("webdav_bytes_downloaded", os.path.getsize(tmpf.name), kind="report")
             tmpf.seek(0)
             report_data = json.load(tmpf)
             switch_events = report_data.get("switch_events", [])
@@ -75,8 +78,10 @@ def should_skip_video(video_path, downloaded, only_cargo_type, current_type, con
 
 def download_video(client, remote_path, local_path):
     temp_path = local_path + ".part"
-    with_retries(lambda: client.download_sync(remote_path=remote_path, local_path=temp_path),
-                 log_prefix=f"[WebDAV:download {remote_path}] ")
+    with metrics.timer(stage="download"):
+        with_retries(lambda: client.download_sync(remote_path=remote_path, local_path=temp_path),
+                     log_prefix=f"[WebDAV:download {remote_path}] ")
+    metrics.inc("webdav_bytes_downloaded", os.path.getsize(temp_path), kind="video")
     os.rename(temp_path, local_path)
 
 
@@ -91,7 +96,8 @@ def process_video_loop(max_frames=3000, only_cargo_type: str = None, fps: float
     result_dict = {"total_frames_downloaded": 0, "vid_process_results": [], "total_frames_in_storage": 0}
 
     try:
-        items = with_retries(lambda: client.list(REMOTE_FRAME_DIR), log_prefix="[WebDAV:list REMOTE_FRAME_DIR] ")
+        with metrics.timer(stage="webdav_list"):
+            items = with_retries(lambda: client.list(REMOTE_FRAME_DIR), log_prefix="[WebDAV:list REMOTE_FRAME_DIR] ")
         frame_count = sum(1 for item in items if item.endswith(".jpg"))
     except Exception as e:
         logger.error(f"Ошибка при проверке лимита кадров: {e}")
@@ -138,7 +144,9 @@ def process_video_loop(max_frames=3000, only_cargo_type: str = None, fps: float
             break
 
         try:
-            items = with_retries(lambda: client.list(REMOTE_FRAME_DIR), log_prefix="[WebDAV:list REMOTE_FRAME_DIR] ")
+            with metrics.timer(stage="webdav_list"):
+                items = with_retries(lambda: client.list(REMOTE_FRAME_DIR),
+                                     log_prefix="[WebDAV:list REMOTE_FRAME_DIR] ")
             frame_count = sum(1 for item in items if item.endswith(".jpg"))
         except Exception as e:
             logger.error(f"Ошибка при повторной проверке лимита кадров: {e}")
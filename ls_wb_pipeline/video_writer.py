@@ -0,0 +1,136 @@
+import os
+import shutil
+import subprocess
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ls_wb_pipeline import metrics, settings
+from ls_wb_pipeline.logger import logger
+
+# Кодирование через ffmpeg: кадры идут в stdin сырыми BGR, без промежуточных файлов
+FFMPEG_BIN = getattr(settings, "FFMPEG_BIN", "ffmpeg")
+VIDEO_CODEC = getattr(settings, "VIDEO_CODEC", "libx264")
+VIDEO_PRESET = getattr(settings, "VIDEO_PRESET", "veryfast")
+VIDEO_CRF = int(getattr(settings, "VIDEO_CRF", 23))
+# Потоки чтения JPEG: cv2.imread отпускает GIL
+VIDEO_DECODE_WORKERS = int(getattr(settings, "VIDEO_DECODE_WORKERS", min(8, os.cpu_count() or 1)))
+
+
+class FfmpegWriter:
+    """
+    Пишет кадры BGR в видео через ffmpeg (stdin — rawvideo). Интерфейс как у cv2.VideoWriter:
+    write(frame) и release().
+    """
+
+    def __init__(self, path: str, width: int, height: int, fps: float, codec: str = VIDEO_CODEC,
+                 preset: str = VIDEO_PRESET, crf: int = VIDEO_CRF, ffmpeg: str = FFMPEG_BIN):
+        self.path = path
+        self.size = (width, height)
+        args = [ffmpeg, "-y", "-loglevel", "error",
+                "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+                "-an", "-c:v", codec]
+        if preset:
+            args += ["-preset", preset]
+        if crf is not None:
+            args += ["-crf", str(crf)]
+        # yuv420p нужен большинству плееров и требует чётных сторон
+        args += ["-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p"]
+        # moov в начало файла (воспроизведение до полной загрузки) — опция только MP4/MOV-муксера
+        if os.path.splitext(path)[1].lower() in (".mp4", ".mov"):
+            args += ["-movflags", "+faststart"]
+        args.append(path)
+        self._released = False
+        self._proc = subprocess.Popen(args, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame):
+        try:
+            self._proc.stdin.write(memoryview(frame).cast("B") if frame.flags.c_contiguous else frame.tobytes())
+        except BrokenPipeError:
+            self.release()
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        if self._proc.stdin and not self._proc.stdin.closed:
+            try:
+                self._proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        stderr = self._proc.stderr.read()
+        self._proc.wait()
+        if self._proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg завершился с кодом {self._proc.returncode}: "
+                               f"{stderr.decode(errors='replace').strip()[-500:]}")
+
+
+def ffmpeg_available(ffmpeg: str = FFMPEG_BIN) -> bool:
+    return shutil.which(ffmpeg) is not None
+
+
+def open_video_writer(path: str, width: int, height: int, fps: float, codec: str = VIDEO_CODEC,
+                      preset: str = VIDEO_PRESET, crf: int = VIDEO_CRF):
+    """FfmpegWriter, а без ffmpeg в системе — cv2.VideoWriter с mp4v (как раньше)."""
+    if ffmpeg_available():
+        return FfmpegWriter(path, width, height, fps, codec=codec, preset=preset, crf=crf)
+    import cv2
+    logger.warning(f"{FFMPEG_BIN} не найден, видео {path} кодируется через cv2 (mp4v)")
+    return cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+
+
+def iter_decoded(paths, workers: int = VIDEO_DECODE_WORKERS, ahead: int = None):
+    """Читает JPEG в пуле потоков с опережением на ahead кадров и отдаёт их в исходном порядке."""
+    import cv2
+    ahead = ahead or workers * 4
+    paths = iter(paths)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path in paths:
+            pending.append(pool.submit(cv2.imread, path))
+            if len(pending) >= ahead:
+                break
+        while pending:
+            frame = pending.popleft().result()
+            path = next(paths, None)
+            if path is not None:
+                pending.append(pool.submit(cv2.imread, path))
+            yield frame
+
+
+def assemble_video(input_dir: str, output_video_path: str, fps: float = 25, codec: str = VIDEO_CODEC,
+                   preset: str = VIDEO_PRESET, crf: int = VIDEO_CRF, workers: int = VIDEO_DECODE_WORKERS):
+    """
+    Собирает видео из *.jpg папки (по имени): чтение ahead в потоках, кодирование в ffmpeg.
+    Кадры другого размера приводятся к размеру первого. Возвращает отчёт.
+    """
+    import cv2
+    started = time.perf_counter()
+    frame_files = sorted(f for f in os.listdir(input_dir) if f.endswith(".jpg"))
+    if not frame_files:
+        raise FileNotFoundError(f"В {input_dir} нет кадров .jpg")
+
+    writer, size, written, skipped = None, None, 0, 0
+    with metrics.timer(stage="assemble_video"):
+        try:
+            for frame in iter_decoded((os.path.join(input_dir, f) for f in frame_files), workers):
+                if frame is None:
+                    skipped += 1
+                    continue
+                if writer is None:
+                    size = (frame.shape[1], frame.shape[0])
+                    writer = open_video_writer(output_video_path, size[0], size[1], fps, codec, preset, crf)
+                elif (frame.shape[1], frame.shape[0]) != size:
+                    frame = cv2.resize(frame, size)
+                writer.write(frame)
+                written += 1
+        finally:
+            if writer is not None:
+                writer.release()
+
+    seconds = time.perf_counter() - started
+    return {"frames": written, "skipped": skipped, "seconds": round(seconds, 3),
+            "fps": round(written / seconds, 1) if seconds else None,
+            "encoder": codec if ffmpeg_available() else "mp4v",
+            "size_mb": round(os.path.getsize(output_video_path) / 1024 / 1024, 2)
+            if os.path.exists(output_video_path) else None}
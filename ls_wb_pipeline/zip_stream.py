@@ -0,0 +1,301 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Сигнатуры и размеры структур ZIP (APPNOTE.TXT)
+_LOCAL_SIG = 0x04034b50
+_DESCRIPTOR_SIG = 0x08074b50
+_CENTRAL_SIG = 0x02014b50
+_ZIP64_EOCD_SIG = 0x06064b50
+_ZIP64_LOCATOR_SIG = 0x07064b50
+_EOCD_SIG = 0x06054b50
+_LOCAL_HEADER_SIZE = 30
+_DESCRIPTOR_SIZE = 16
+_CENTRAL_HEADER_SIZE = 46
+_ZIP64_EOCD_SIZE = 56
+_ZIP64_LOCATOR_SIZE = 20
+_EOCD_SIZE = 22
+_FLAGS = 0x0008 | 0x0800  # data descriptor + UTF-8 имена
+_MAX32 = 0xFFFFFFFF
+_MAX16 = 0xFFFF
+
+FileReader = Callable[[str, int, Optional[int]], Iterator[bytes]]
+
+
+def _dos_datetime(mtime: float) -> Tuple[int, int]:
+    t = time.localtime(mtime)
+    year = max(t.tm_year, 1980)
+    dos_date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return dos_time, dos_date
+
+
+def pack_local_header(name: bytes, mtime: float, flags: int = _FLAGS, method: int = 0,
+                      crc: int = 0, compressed_size: int = 0, size: int = 0) -> bytes:
+    dos_time, dos_date = _dos_datetime(mtime)
+    return struct.pack("<IHHHHHIIIHH", _LOCAL_SIG, 20, flags, method, dos_time, dos_date,
+                       crc, compressed_size, size, len(name), 0) + name
+
+
+def central_header_size(name: bytes, offset: int) -> int:
+    return _CENTRAL_HEADER_SIZE + len(name) + (12 if offset >= _MAX32 else 0)
+
+
+def pack_central_header(name: bytes, mtime: float, crc: int, compressed_size: int, size: int,
+                        offset: int, flags: int = _FLAGS, method: int = 0) -> bytes:
+    dos_time, dos_date = _dos_datetime(mtime)
+    extra = b""
+    if offset >= _MAX32:
+        extra = struct.pack("<HHQ", 0x0001, 8, offset)
+        offset = _MAX32
+    version = 45 if extra else 20
+    return struct.pack("<IHHHHHHIIIHHHHHII", _CENTRAL_SIG, version, version, flags, method,
+                       dos_time, dos_date, crc, compressed_size, size,
+                       len(name), len(extra), 0, 0, 0, 0o100644 << 16, offset) + name + extra
+
+
+def needs_zip64(count: int, cd_offset: int, cd_size: int) -> bool:
+    return count >= _MAX16 or cd_offset >= _MAX32 or cd_size >= _MAX32
+
+
+def end_records_size(zip64: bool) -> int:
+    return _EOCD_SIZE + (_ZIP64_EOCD_SIZE + _ZIP64_LOCATOR_SIZE if zip64 else 0)
+
+
+def pack_end_records(count: int, cd_offset: int, cd_size: int) -> bytes:
+    """EOCD (и ZIP64 EOCD + locator, если нужно) сразу после central directory."""
+    parts = []
+    if needs_zip64(count, cd_offset, cd_size):
+        zip64_eocd_offset = cd_offset + cd_size
+        parts.append(struct.pack("<IQHHIIQQQQ", _ZIP64_EOCD_SIG, _ZIP64_EOCD_SIZE - 12, 45, 45, 0, 0,
+                                 count, count, cd_size, cd_offset))
+        parts.append(struct.pack("<IIQI", _ZIP64_LOCATOR_SIG, 0, zip64_eocd_offset, 1))
+    parts.append(struct.pack("<IHHHHIIH", _EOCD_SIG, 0, 0, min(count, _MAX16), min(count, _MAX16),
+                             min(cd_size, _MAX32), min(cd_offset, _MAX32), 0))
+    return b"".join(parts)
+
+
+class SourceChanged(RuntimeError):
+    """Файл датасета исчез или изменился после снимка: дальше архив не совпал бы с раскладкой и CRC."""
+
+
+class CrcCache:
+    """
+    CRC32 файлов по ключу (arcname, size, mtime), с сохранением на диск.
+    Файл кеша общий для воркеров: при сохранении записи с диска сливаются со своими,
+    запись идёт через уникальный временный файл.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._data: Dict[str, int] = self._read()
+        self._live: Optional[set] = None
+        self._dirty = False
+
+    def _read(self) -> Dict[str, int]:
+        if not self.path or not self.path.exists():
+            return {}
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8") or "{}")
+        except Exception:
+            return {}
+
+    @staticmethod
+    def _key(arcname: str, size: int, mtime: float) -> str:
+        return f"{arcname}|{size}|{mtime}"
+
+    def get(self, arcname: str, size: int, mtime: float) -> Optional[int]:
+        with self._lock:
+            return self._data.get(self._key(arcname, size, mtime))
+
+    def put(self, arcname: str, size: int, mtime: float, crc: int):
+        with self._lock:
+            self._data[self._key(arcname, size, mtime)] = crc
+            self._dirty = True
+
+    def retain(self, snapshot: Dict[str, List[float]]):
+        """Оставляет только записи файлов из снимка: удалённые и изменённые файлы вычищаются."""
+        live = {self._key(arcname, int(size), mtime) for arcname, (size, mtime) in snapshot.items()}
+        with self._lock:
+            self._live = live
+            stale = [key for key in self._data if key not in live]
+            for key in stale:
+                del self._data[key]
+            if stale:
+                self._dirty = True
+
+    def save(self):
+        """Пишет кеш, только если в нём что-то поменялось."""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {**self._read(), **self._data}
+            if self._live is not None:
+                data = {key: crc for key, crc in data.items() if key in self._live}
+            tmp = self.path.with_name(f"{self.path.name}.{uuid.uuid4().hex}.tmp")
+            try:
+                tmp.write_text(json.dumps(data), encoding="utf-8")
+                os.replace(tmp, self.path)
+            finally:
+                if tmp.exists():
+                    tmp.unlink()
+            self._data = data
+            self._dirty = False
+
+
+class _Entry:
+    __slots__ = ("arcname", "name", "path", "size", "mtime", "offset", "data_offset")
+
+    def __init__(self, arcname: str, path: str, size: int, mtime: float, offset: int):
+        self.arcname = arcname
+        self.name = arcname.replace(os.sep, "/").encode("utf-8")
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.offset = offset
+        self.data_offset = offset + _LOCAL_HEADER_SIZE + len(self.name)
+
+
+class ZipLayout:
+    """
+    Заранее рассчитанная раскладка ZIP_STORED архива по размерам файлов.
+    Позволяет знать Content-Length и отдавать любой байтовый диапазон
+    без промежуточного файла. etag — сильный валидатор снимка (имена, размеры, mtime):
+    если датасет поменялся, у новой раскладки другие смещения и другой etag.
+    """
+
+    def __init__(self, root: Path, snapshot: Dict[str, List[float]], crc_cache: CrcCache,
+                 read_file: FileReader):
+        self.root = Path(root)
+        self.crc_cache = crc_cache
+        self.read_file = read_file
+        self.entries: List[_Entry] = []
+        self.segments: List[Tuple[int, int, str, Optional[_Entry]]] = []  # (start, length, kind, entry)
+
+        digest = hashlib.sha1()
+        offset = 0
+        for arcname in sorted(snapshot):
+            size, mtime = snapshot[arcname]
+            size = int(size)
+            digest.update(f"{arcname}\0{size}\0{mtime}\n".encode("utf-8"))
+            if size >= _MAX32:
+                raise ValueError(f"Файл {arcname} слишком большой для потокового архива")
+            entry = _Entry(arcname, str(self.root / arcname), size, mtime, offset)
+            self.entries.append(entry)
+            self._add_segment(offset, entry.data_offset - offset, "local", entry)
+            self._add_segment(entry.data_offset, size, "data", entry)
+            self._add_segment(entry.data_offset + size, _DESCRIPTOR_SIZE, "descriptor", entry)
+            offset = entry.data_offset + size + _DESCRIPTOR_SIZE
+
+        self.cd_offset = offset
+        self.cd_size = sum(central_header_size(e.name, e.offset) for e in self.entries)
+        self.zip64 = needs_zip64(len(self.entries), self.cd_offset, self.cd_size)
+        tail_size = end_records_size(self.zip64)
+        self._add_segment(self.cd_offset, self.cd_size + tail_size, "central", None)
+        self.total_size = self.cd_offset + self.cd_size + tail_size
+        self.etag = '"' + digest.hexdigest()[:20] + '"'
+
+    def _add_segment(self, start: int, length: int, kind: str, entry: Optional[_Entry]):
+        if length:
+            self.segments.append((start, length, kind, entry))
+
+    # ---- CRC ----
+
+    def _crc(self, entry: _Entry) -> int:
+        crc = self.crc_cache.get(entry.arcname, entry.size, entry.mtime)
+        if crc is None:
+            crc = 0
+            for chunk in self._file_bytes(entry, 0, entry.size):
+                crc = zlib.crc32(chunk, crc)
+            self.crc_cache.put(entry.arcname, entry.size, entry.mtime, crc)
+        return crc
+
+    # ---- Структуры ----
+
+    def _local_header(self, e: _Entry) -> bytes:
+        # С флагом data descriptor CRC и размеры в локальном заголовке нулевые
+        return pack_local_header(e.name, e.mtime)
+
+    def _descriptor(self, e: _Entry) -> bytes:
+        return struct.pack("<IIII", _DESCRIPTOR_SIG, self._crc(e), e.size, e.size)
+
+    def _central_directory(self) -> bytes:
+        parts = [pack_central_header(e.name, e.mtime, self._crc(e), e.size, e.size, e.offset)
+                 for e in self.entries]
+        parts.append(pack_end_records(len(self.entries), self.cd_offset, self.cd_size))
+        return b"".join(parts)
+
+    # ---- Отдача ----
+
+    def _file_bytes(self, e: _Entry, start: int, end: int) -> Iterator[bytes]:
+        """
+        Байты [start, end) файла. Если файл исчез, укоротился или поменялся после снимка —
+        SourceChanged: отдача обрывается, а не подсовывает клиенту архив с неверным CRC.
+        """
+        want = end - start
+        if want <= 0:
+            return
+        try:
+            st = os.stat(e.path)
+        except FileNotFoundError:
+            raise SourceChanged(f"Файл {e.arcname} удалён во время отдачи архива")
+        if st.st_size != e.size or st.st_mtime != e.mtime:
+            raise SourceChanged(f"Файл {e.arcname} изменён во время отдачи архива")
+        sent = 0
+        try:
+            for chunk in self.read_file(e.path, start, end - 1):
+                chunk = chunk[:want - sent]
+                sent += len(chunk)
+                yield chunk
+                if sent >= want:
+                    break
+        except FileNotFoundError:
+            pass
+        if sent < want:
+            raise SourceChanged(f"Файл {e.arcname} укоротился во время отдачи архива")
+
+    def _stream_data(self, e: _Entry, start: int, end: int) -> Iterator[bytes]:
+        if start == 0 and end == e.size and self.crc_cache.get(e.arcname, e.size, e.mtime) is None:
+            # Полная отдача файла — считаем CRC попутно, без повторного чтения
+            crc = 0
+            for chunk in self._file_bytes(e, start, end):
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+            self.crc_cache.put(e.arcname, e.size, e.mtime, crc)
+            return
+        yield from self._file_bytes(e, start, end)
+
+    def iter_range(self, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Байты архива с start по end включительно."""
+        end = self.total_size - 1 if end is None else min(end, self.total_size - 1)
+        try:
+            for seg_start, seg_len, kind, entry in self.segments:
+                seg_end = seg_start + seg_len
+                if seg_end <= start:
+                    continue
+                if seg_start > end:
+                    break
+                lo = max(start, seg_start) - seg_start
+                hi = min(end + 1, seg_end) - seg_start
+                if kind == "data":
+                    yield from self._stream_data(entry, lo, hi)
+                    continue
+                if kind == "local":
+                    blob = self._local_header(entry)
+                elif kind == "descriptor":
+                    blob = self._descriptor(entry)
+                else:
+                    blob = self._central_directory()
+                yield blob[lo:hi]
+        finally:
+            self.crc_cache.save()
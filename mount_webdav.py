@@ -1,4 +1,6 @@
 from ls_wb_pipeline.functions import remount_webdav, sync_label_studio_storage
+import signal
+import sys
 import time
 
 
@@ -7,6 +9,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--from-systemd", action="store_true", help="Не использовать --daemon")
     args = parser.parse_args()
+    # systemd останавливает сервис SIGTERM: выходим штатно, чтобы atexit погасил дочерний rclone
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
     remount_webdav(from_systemd=args.from_systemd)
     sync_label_studio_storage()
     time.sleep(36000)
\ No newline at end of file
@@ -1,19 +1,19 @@
-import torch
-import torchvision.transforms as T
-from PIL import Image
-import cv2
-import os
-from tqdm import tqdm
 import cv2
+import numpy as np
 import os
 import sys
-from torch.serialization import safe_globals
-from PIL import ImageDraw, ImageFont
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 
 
+# Отсюда torch.load импортирует models.yolo при распаковке eager-чекпойнта (если у тебя есть yolov5)
 sys.path.append("/Users/artur/PycharmProjects/yolov5")
 
-from models.yolo import ClassificationModel  # если у тебя есть yolov5
+from ls_wb_pipeline.inference import (BATCH_SIZE, IMAGE_SIZE, LOADER_WORKERS, classify_batched, get_model,
+                                      resize_frame)
+from ls_wb_pipeline.logger import logger
+from ls_wb_pipeline.video_stream import LabelOverlay, label_video
+from ls_wb_pipeline.video_writer import assemble_video
 
 
 
@@ -30,16 +30,8 @@ def video_to_frames(video_path, output_dir):
     cap.release()
     print(f"✅ {i} кадров сохранено")
 
-# Модель
-ckpt = torch.load("best.pt", map_location="cpu", weights_only=False)
-model = ckpt["model"].float().eval()
-model.names = [
-    "лодка опрокинута",
-    "евроконтейнер опрокинут",
-    "лодка захвачена",
-    "евроконтейнер захвачен",
-    "свободно",
-]
+# Модель загружается при первом использовании: get_model(backend), бэкенд — eager, torchscript или onnx
+# (eager-чекпойнту yolov5 нужен models.yolo из sys.path выше; torch импортируется внутри inference)
 
 # Классы
 class_names = [
@@ -50,56 +42,58 @@ class_names = [
     "свободно",
 ]
 
-# Преобразование
-transform = T.Compose([
-    T.Resize((224, 224)),
-    T.ToTensor(),
-    T.Normalize([0.485, 0.456, 0.406],
-                [0.229, 0.224, 0.225])
-])
+# Преобразование: resize_frame + пакетная нормализация в inference (эталон — inference.reference_transform)
 
+FONT_PATH = "/System/Library/Fonts/Supplemental/Arial.ttf"  # под Mac
 
-def classify_and_draw(input_dir, output_dir):
-    os.makedirs(output_dir, exist_ok=True)
-    frame_files = sorted(f for f in os.listdir(input_dir) if f.endswith(".jpg"))
-
-    font = ImageFont.truetype("/System/Library/Fonts/Supplemental/Arial.ttf", 32)  # под Mac
 
-    for file in tqdm(frame_files):
-        img_path = os.path.join(input_dir, file)
-        img = Image.open(img_path).convert("RGB")
-        tensor = transform(img).unsqueeze(0)
+def _load_image(img_path):
+    frame = cv2.imread(img_path)
+    if frame is None:
+        # Битый или исчезнувший файл — пустышка для пакета, кадр пропускается
+        logger.warning(f"Пропущен кадр {img_path}: не удалось декодировать")
+        return np.zeros((IMAGE_SIZE, IMAGE_SIZE, 3), np.uint8), None
+    return resize_frame(frame), frame
 
-        with torch.no_grad():
-            preds = model(tensor)
-            class_id = preds.argmax(1).item()
-            label = class_names[class_id]
 
-        # Рисуем текст на изображении через PIL
-        draw = ImageDraw.Draw(img)
-        draw.text((400, 30), label, font=font, fill=(255, 0, 0))
-
-        img.save(os.path.join(output_dir, file))
+def classify_and_draw(input_dir, output_dir, batch_size=BATCH_SIZE, workers=LOADER_WORKERS, backend=None):
+    os.makedirs(output_dir, exist_ok=True)
+    frame_files = sorted(f for f in os.listdir(input_dir) if f.endswith(".jpg"))
+    paths = [os.path.join(input_dir, file) for file in frame_files]
+
+    # Текст рисуется через PIL один раз на метку и накладывается на кадр
+    overlay = LabelOverlay(FONT_PATH, 32, color=(255, 0, 0), position=(400, 30))
+
+    # Декодирование и сохранение — в потоках, модель считает пакетами
+    with ThreadPoolExecutor(max_workers=workers) as writer:
+        pending = []
+        for img_path, frame, class_id, _ in tqdm(
+                classify_batched(get_model(backend), paths, _load_image, batch_size, workers), total=len(paths)):
+            if frame is None:
+                continue
+            overlay(frame, class_names[class_id])
+            pending.append(writer.submit(cv2.imwrite, os.path.join(output_dir, os.path.basename(img_path)), frame))
+            if len(pending) >= batch_size * 2:
+                pending.pop(0).result()
+        for future in pending:
+            future.result()
 
     print("✅ Все кадры обработаны")
 
 # Использование
 
 def frames_to_video(input_dir, output_video_path, fps=25):
-    frame_files = sorted(f for f in os.listdir(input_dir) if f.endswith(".jpg"))
-    sample = cv2.imread(os.path.join(input_dir, frame_files[0]))
-    height, width, _ = sample.shape
-
-    out = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
-
-    for file in frame_files:
-        frame = cv2.imread(os.path.join(input_dir, file))
-        out.write(frame)
-    out.release()
-    print(f"🎞 Видео сохранено: {output_video_path}")
+    report = assemble_video(input_dir, output_video_path, fps)
+    print(f"🎞 Видео сохранено: {output_video_path} ({report['frames']} кадров, {report['encoder']})")
 
 # Использование
 
-video_to_frames("test.mp4", "frames")
-classify_and_draw("frames", "frames_labeled")
-frames_to_video("frames_labeled", "result_video.mp4", fps=5)
\ No newline at end of file
+if __name__ == "__main__":
+    # Одним потоковым конвейером, без папок frames/ и frames_labeled/.
+    # Старый путь: video_to_frames -> classify_and_draw -> frames_to_video
+    report = label_video("test.mp4", "result_video.mp4", get_model(), resize_frame, class_names,
+                         draw=LabelOverlay(FONT_PATH, 32, color=(255, 0, 0), position=(400, 30)),
+                         fps=5, every_n=1)
+    print("🎞 Видео сохранено: result_video.mp4")
+    for stage, stage_report in report["stages"].items():
+        print(f"  {stage:10} {stage_report['frames']:6} кадров  {stage_report['fps']} кадров/с")